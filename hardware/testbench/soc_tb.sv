@@ -29,6 +29,8 @@ module soc_tb(
     input       reset);
 
     localparam MEM_SIZE = 'h1000000;
+    localparam int unsigned FNV_OFFSET_BASIS = 32'd2166136261;
+    localparam int unsigned FNV_PRIME = 32'd16777619;
     localparam NUM_PERIPHERALS = 6;
 
     int total_cycles;
@@ -38,6 +40,7 @@ module soc_tb(
     int finish_cycles;
     bit profile_en;
     int profile_fd;
+    int image_fd;
     axi4_interface axi_bus_s[1:0]();
     axi4_interface axi_bus_m[1:0]();
     scalar_t loopback_uart_read_data;
@@ -451,7 +454,25 @@ module soc_tb(
             memory.sdram_data[i] = 0;
 
         if ($value$plusargs("bin=%s", filename) != 0)
-            $readmemh(filename, memory.sdram_data);
+        begin
+            if (filename.len() > 4
+                && filename.substr(filename.len() - 4, filename.len() - 1) == ".bin")
+            begin
+                // Raw binary image. $fread fills each word most significant
+                // byte first, which matches the byte order of the hex format.
+                image_fd = $fopen(filename, "rb");
+                if (image_fd == 0)
+                begin
+                    $display("Couldn't open memory image %s", filename);
+                    $finish;
+                end
+
+                void'($fread(memory.sdram_data, image_fd));
+                $fclose(image_fd);
+            end
+            else
+                $readmemh(filename, memory.sdram_data);
+        end
         else
         begin
             $display("No memory image file specified with +bin");
@@ -464,6 +485,7 @@ module soc_tb(
         int mem_dump_start;
         int mem_dump_length;
         int dump_fp;
+        int unsigned line_hash;
 
         $display("ran for %0d cycles", total_cycles);
         if ($value$plusargs("memdumpbase=%x", mem_dump_start) != 0
@@ -474,22 +496,50 @@ module soc_tb(
                 flush_l2_cache;
 
             dump_fp = $fopen(filename, "wb");
-            for (int i = 0; i < mem_dump_length; i += 4)
+            if ($test$plusargs("memdumphash") != 0)
+            begin
+                // Write a hash of each cache line instead of its contents.
+                // This must match write_memory_hashes_to_file in the
+                // emulator.
+                for (int i = 0; i + CACHE_LINE_BYTES <= mem_dump_length; i += CACHE_LINE_BYTES)
+                begin
+                    line_hash = FNV_OFFSET_BASIS;
+                    for (int word = 0; word < CACHE_LINE_WORDS; word++)
+                    begin
+                        line_hash = (line_hash ^ memory.sdram_data[(mem_dump_start + i) / 4 + word])
+                            * FNV_PRIME;
+                    end
+
+`ifdef VERILATOR
+                    // -verilator doesn't support fwrite with the %c modifier, so
+                    // emit code directly in the generated C files to call fputc.
+                    $c("fputc(", line_hash[31:24], ", VL_CVT_I_FP(", dump_fp, "));");
+                    $c("fputc(", line_hash[23:16], ", VL_CVT_I_FP(", dump_fp, "));");
+                    $c("fputc(", line_hash[15:8], ", VL_CVT_I_FP(", dump_fp, "));");
+                    $c("fputc(", line_hash[7:0], ", VL_CVT_I_FP(", dump_fp, "));");
+`else
+                    $fwrite(dump_fp, "%c%c%c%c", line_hash[31:24], line_hash[23:16],
+                            line_hash[15:8], line_hash[7:0]);
+`endif // !`ifdef VERILATOR
+                end
+            end
+            else
             begin
+                for (int i = 0; i < mem_dump_length; i += 4)
+                begin
 `ifdef VERILATOR
-                // -verilator doesn't support fwrite with the %c modifier, so
-                // emit code directly in the generated C files to call fputc.
-                $c("fputc(", memory.sdram_data[(mem_dump_start + i) / 4][31:24], ", VL_CVT_I_FP(", dump_fp, "));");
-                $c("fputc(", memory.sdram_data[(mem_dump_start + i) / 4][23:16], ", VL_CVT_I_FP(", dump_fp, "));");
-                $c("fputc(", memory.sdram_data[(mem_dump_start + i) / 4][15:8], ", VL_CVT_I_FP(", dump_fp, "));");
-                $c("fputc(", memory.sdram_data[(mem_dump_start + i) / 4][7:0], ", VL_CVT_I_FP(", dump_fp, "));");
+                    $c("fputc(", memory.sdram_data[(mem_dump_start + i) / 4][31:24], ", VL_CVT_I_FP(", dump_fp, "));");
+                    $c("fputc(", memory.sdram_data[(mem_dump_start + i) / 4][23:16], ", VL_CVT_I_FP(", dump_fp, "));");
+                    $c("fputc(", memory.sdram_data[(mem_dump_start + i) / 4][15:8], ", VL_CVT_I_FP(", dump_fp, "));");
+                    $c("fputc(", memory.sdram_data[(mem_dump_start + i) / 4][7:0], ", VL_CVT_I_FP(", dump_fp, "));");
 `else
-                $fwrite(dump_fp,"%c%c%c%c",
-                        memory.sdram_data[(mem_dump_start + i) / 4][31:24],
-                        memory.sdram_data[(mem_dump_start + i) / 4][23:16],
-                        memory.sdram_data[(mem_dump_start + i) / 4][15:8],
-                        memory.sdram_data[(mem_dump_start + i) / 4][7:0]);
+                    $fwrite(dump_fp,"%c%c%c%c",
+                            memory.sdram_data[(mem_dump_start + i) / 4][31:24],
+                            memory.sdram_data[(mem_dump_start + i) / 4][23:16],
+                            memory.sdram_data[(mem_dump_start + i) / 4][15:8],
+                            memory.sdram_data[(mem_dump_start + i) / 4][7:0]);
 `endif // !`ifdef VERILATOR
+                end
             end
 
             $fclose(dump_fp);
@@ -18,6 +18,13 @@
 
 import defines::*;
 
+`ifdef VERILATOR
+// Native function defined in trace_writer.cpp
+import "DPI-C" function void write_binary_trace_event(input int event_type, input int pc,
+    input int thread_idx, input int writeback_reg, input int addr, input bit[63:0] mask,
+    input bit[511:0] data);
+`endif
+
 //
 // This prints register updates and memory writes to the console. The emulator
 // uses this information to verify the hardware is working correctly in
@@ -29,6 +36,9 @@ import defines::*;
 // emulator. To be able to compare the results, this uses a queue to reorder
 // instructions and logs them in issue order.
 //
+// With +binarytrace (verilator only), this writes the events in a compact
+// binary format instead of as text (see trace_writer.cpp).
+//
 
 module trace_logger(
     input                            clk,
@@ -98,6 +108,7 @@ module trace_logger(
 
     trace_event_t trace_reorder_queue[TRACE_REORDER_QUEUE_LEN];
     bit trace_en;
+    bit binary_trace_en;
     logic writeback_sync_store;
     scalar_t fx5_instruction_pc_latched;
     scalar_t dd_instruction_pc_latched;
@@ -108,6 +119,11 @@ module trace_logger(
     initial
     begin
         trace_en = $test$plusargs("trace") != 0;
+`ifdef VERILATOR
+        binary_trace_en = $test$plusargs("binarytrace") != 0;
+`else
+        binary_trace_en = 0;
+`endif
     end
 
     assign writeback_sync_store = dd_instruction_valid && !dd_instruction_load
@@ -129,45 +145,63 @@ module trace_logger(
             ix_instruction_valid_latched <= ix_instruction_valid;
             dd_instruction_valid_latched <= dd_instruction_valid;
 
-            case (trace_reorder_queue[0].event_type)
-                EVENT_VWRITEBACK:
+            if (binary_trace_en)
+            begin
+`ifdef VERILATOR
+                if (trace_reorder_queue[0].event_type != EVENT_INVALID)
                 begin
-                    $display("vwriteback %x %x %x %x %x",
-                        trace_reorder_queue[0].pc,
-                        trace_reorder_queue[0].thread_idx,
-                        trace_reorder_queue[0].writeback_reg,
+                    write_binary_trace_event(int'(trace_reorder_queue[0].event_type),
+                        int'(trace_reorder_queue[0].pc),
+                        int'(trace_reorder_queue[0].thread_idx),
+                        int'(trace_reorder_queue[0].writeback_reg),
+                        int'(trace_reorder_queue[0].addr),
                         trace_reorder_queue[0].mask,
                         trace_reorder_queue[0].data);
                 end
+`endif
+            end
+            else
+            begin
+                case (trace_reorder_queue[0].event_type)
+                    EVENT_VWRITEBACK:
+                    begin
+                        $display("vwriteback %x %x %x %x %x",
+                            trace_reorder_queue[0].pc,
+                            trace_reorder_queue[0].thread_idx,
+                            trace_reorder_queue[0].writeback_reg,
+                            trace_reorder_queue[0].mask,
+                            trace_reorder_queue[0].data);
+                    end
 
-                EVENT_SWRITEBACK:
-                begin
-                    $display("swriteback %x %x %x %x",
-                        trace_reorder_queue[0].pc,
-                        trace_reorder_queue[0].thread_idx,
-                        trace_reorder_queue[0].writeback_reg,
-                        trace_reorder_queue[0].data[0]);
-                end
+                    EVENT_SWRITEBACK:
+                    begin
+                        $display("swriteback %x %x %x %x",
+                            trace_reorder_queue[0].pc,
+                            trace_reorder_queue[0].thread_idx,
+                            trace_reorder_queue[0].writeback_reg,
+                            trace_reorder_queue[0].data[0]);
+                    end
 
-                EVENT_STORE:
-                begin
-                    $display("store %x %x %x %x %x",
-                        trace_reorder_queue[0].pc,
-                        trace_reorder_queue[0].thread_idx,
-                        trace_reorder_queue[0].addr,
-                        trace_reorder_queue[0].mask,
-                        trace_reorder_queue[0].data);
-                end
+                    EVENT_STORE:
+                    begin
+                        $display("store %x %x %x %x %x",
+                            trace_reorder_queue[0].pc,
+                            trace_reorder_queue[0].thread_idx,
+                            trace_reorder_queue[0].addr,
+                            trace_reorder_queue[0].mask,
+                            trace_reorder_queue[0].data);
+                    end
 
-                EVENT_INTERRUPT:
-                begin
-                    $display("interrupt %d %x", trace_reorder_queue[0].thread_idx,
-                        trace_reorder_queue[0].pc);
-                end
+                    EVENT_INTERRUPT:
+                    begin
+                        $display("interrupt %d %x", trace_reorder_queue[0].thread_idx,
+                            trace_reorder_queue[0].pc);
+                    end
 
-                default:
-                    ; // Do nothing
-            endcase
+                    default:
+                        ; // Do nothing
+                endcase
+            end
 
             for (int i = 0; i < TRACE_REORDER_QUEUE_LEN - 1; i++)
                 trace_reorder_queue[i] <= trace_reorder_queue[i + 1];
@@ -0,0 +1,73 @@
+//
+// Copyright 2011-2015 Jeff Bush
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#include <stdint.h>
+#include <stdio.h>
+#include <string.h>
+#include "svdpi.h"
+#include "Vsoc_tb__Dpi.h"
+
+//
+// When the simulator is started with +trace +binarytrace, trace_logger calls
+// this with DPI to write each cosimulation event in a fixed size binary
+// format, instead of printing it as text. This is much faster for both the
+// simulator and the emulator, which reads it. See tools/emulator/cosimulation.c
+// for a description of the format.
+//
+
+namespace
+{
+const int EVENT_LENGTH = 84;
+const int NUM_VECTOR_LANES = 16;
+
+// Must match trace_event_type_t in trace_logger.sv
+const int EVENT_SWRITEBACK = 1;
+
+void write_le32(unsigned char *ptr, uint32_t value)
+{
+    ptr[0] = value & 0xff;
+    ptr[1] = (value >> 8) & 0xff;
+    ptr[2] = (value >> 16) & 0xff;
+    ptr[3] = (value >> 24) & 0xff;
+}
+}
+
+extern void write_binary_trace_event(int eventType, int pc, int threadIdx,
+    int writebackReg, int address, const svBitVecVal *mask, const svBitVecVal *data)
+{
+    unsigned char event[EVENT_LENGTH];
+
+    memset(event, 0, sizeof(event));
+    event[0] = eventType;
+    event[1] = threadIdx;
+    event[2] = writebackReg;
+    write_le32(event + 4, pc);
+    write_le32(event + 8, address);
+    write_le32(event + 12, mask[0]);
+    write_le32(event + 16, mask[1]);
+    if (eventType == EVENT_SWRITEBACK)
+        write_le32(event + 20, data[0]);
+    else
+    {
+        // The text format prints the most significant word of the vector
+        // first, and the emulator treats that as the first lane.
+        for (int lane = 0; lane < NUM_VECTOR_LANES; lane++)
+            write_le32(event + 20 + lane * 4, data[NUM_VECTOR_LANES - 1 - lane]);
+    }
+
+    // $display also writes to stdout, so events stay in order with text
+    fwrite(event, sizeof(event), 1, stdout);
+}
@@ -0,0 +1,45 @@
+//
+// Copyright 2011-2015 Jeff Bush
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#include <stdio.h>
+
+//
+// Uninitialized globals go in .bss, which takes no space in the ELF file.
+// The startup code doesn't clear it, so this checks that the loaded image
+// does, even though the emulator and hardware model start with random memory.
+//
+
+int initialized = 0x12345678;
+int uninitialized[0x4000];
+
+int main()
+{
+	int nonzero = 0;
+
+	for (int i = 0; i < sizeof(uninitialized) / sizeof(int); i++)
+	{
+		if (uninitialized[i] != 0)
+			nonzero++;
+	}
+
+	printf("initialized 0x%08x\n", initialized);
+	printf("nonzero %d\n", nonzero);
+
+	// CHECK: initialized 0x12345678
+	// CHECK: nonzero 0
+
+	return 0;
+}
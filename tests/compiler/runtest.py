@@ -23,26 +23,32 @@ sys.path.insert(0, '..')
 import test_harness
 
 
+def build_compiler_test(source_file):
+    test_harness.build_program([source_file])
+
+
 def run_compiler_test(source_file, target):
     if target == 'host':
-        subprocess.check_call(['cc', source_file, '-o', 'obj/a.out'],
+        host_executable = test_harness.get_work_dir() + 'a.out'
+        subprocess.check_call(['cc', source_file, '-o', host_executable],
                               stderr=subprocess.STDOUT)
-        result = subprocess.check_output('obj/a.out')
+        result = subprocess.check_output(host_executable)
         test_harness.check_result(source_file, result.decode())
     else:
         test_harness.build_program([source_file])
-        result = test_harness.run_program(target)
-        test_harness.check_result(source_file, result)
+        test_harness.run_program(target, check_file=source_file)
 
 test_list = [fname for fname in test_harness.find_files(
     ('.c', '.cpp')) if not fname.startswith('_')]
 
 all_targets = [fname for fname in test_list if 'noverilator' not in fname]
 test_harness.register_tests(run_compiler_test, all_targets, [
-                            'emulator', 'verilator', 'host', 'fpga'])
+                            'emulator', 'verilator', 'host', 'fpga'],
+                            build_compiler_test)
 
 noverilator_targets = [fname for fname in test_list if 'noverilator' in fname]
 test_harness.register_tests(
-    run_compiler_test, noverilator_targets, ['emulator', 'host', 'fpga'])
+    run_compiler_test, noverilator_targets, ['emulator', 'host', 'fpga'],
+    build_compiler_test)
 
 test_harness.execute_tests()
@@ -20,7 +20,6 @@ This test writes a pattern to memory and manually flushes it from code. It then
 checks the contents of system memory to ensure the data was flushed correctly.
 """
 
-import struct
 import sys
 
 sys.path.insert(0, '../..')
@@ -31,31 +30,25 @@ BASE_ADDRESS = 0x400000
 
 @test_harness.test(['verilator'])
 def dflush(_, target):
+    dump_file = test_harness.get_work_dir() + 'vmem.bin'
     test_harness.build_program(['dflush.S'])
     test_harness.run_program(
         target=target,
-        dump_file='obj/vmem.bin',
+        dump_file=dump_file,
         dump_base=BASE_ADDRESS,
         dump_length=0x40000)
-    with open('obj/vmem.bin', 'rb') as memfile:
-        for index in range(4096):
-            val = memfile.read(4)
-            if len(val) < 4:
-                raise test_harness.TestException('output file is truncated')
-
-            num_val, = struct.unpack('<L', val)
-            expected = 0x1f0e6231 + (index // 16)
-            if num_val != expected:
-                raise test_harness.TestException('FAIL: mismatch at ' + hex(
-                    BASE_ADDRESS + (index * 4)) + ' want ' + str(expected) + ' got ' + str(num_val))
+    test_harness.check_memory_dump(
+        dump_file, (0x1f0e6231 + (index // 16) for index in range(4096)),
+        BASE_ADDRESS)
 
 
 @test_harness.test(['verilator'])
 def dinvalidate(_, target):
+    dump_file = test_harness.get_work_dir() + 'vmem.bin'
     test_harness.build_program(['dinvalidate.S'])
     result = test_harness.run_program(
         target=target,
-        dump_file='obj/vmem.bin',
+        dump_file=dump_file,
         dump_base=0x2000,
         dump_length=4,
         flush_l2=True,
@@ -68,17 +61,14 @@ def dinvalidate(_, target):
 
     # 2. Read the memory dump to ensure the proper value is flushed from the
     # L2 cache
-    with open('obj/vmem.bin', 'rb') as memfile:
-        num_val, = struct.unpack('<L', memfile.read(4))
-        if num_val != 0xdeadbeef:
-            raise test_harness.TestException(
-                'memory contents were incorrect: ' + hex(num_val))
+    test_harness.check_memory_dump(dump_file, [0xdeadbeef], 0x2000,
+                                   'memory contents were incorrect')
 
 
 @test_harness.test(['verilator', 'fpga'])
 def dflush_wait(_, target):
     test_harness.build_program(['dflush_wait.S'])
-    output = test_harness.run_program(target)
+    output = test_harness.run_program(target, sentinels=['PASS', 'FAIL'])
     if 'PASS' not in output:
         raise test_harness.TestException('Test did not signal pass: ' + output)
 
@@ -86,7 +76,7 @@ def dflush_wait(_, target):
 @test_harness.test(['verilator', 'fpga'])
 def iinvalidate(_, target):
     test_harness.build_program(['iinvalidate.S'])
-    output = test_harness.run_program(target)
+    output = test_harness.run_program(target, sentinels=['PASS', 'FAIL'])
     if 'PASS' not in output:
         raise test_harness.TestException('Test did not signal pass: ' + output)
 
@@ -24,7 +24,7 @@ import test_harness
 @test_harness.test(['verilator'])
 def perf_counters(_, target):
     test_harness.build_program(['perf_counters.c'])
-    result = test_harness.run_program(target)
+    result = test_harness.run_program(target, sentinels=['PASS', 'FAIL'])
     if 'PASS' not in result:
         raise test_harness.TestException(
             'test program did not indicate pass\n' + result)
@@ -74,14 +74,15 @@ def recv_host_interrupt(_, target):
     except OSError:
         pass    # Ignore if pipe doesn't exist
 
-    test_harness.build_program(['recv_host_interrupt.S'])
+    binfile = test_harness.build_program(['recv_host_interrupt.S'])
 
     os.mknod(RECV_PIPE_NAME, stat.S_IFIFO | 0o666)
 
     args = [test_harness.BIN_DIR + 'emulator',
-            '-i', RECV_PIPE_NAME, test_harness.HEX_FILE]
+            '-i', RECV_PIPE_NAME, binfile]
     emulator_process = subprocess.Popen(args, stdout=subprocess.PIPE,
-                                        stderr=subprocess.STDOUT)
+                                        stderr=subprocess.STDOUT,
+                                        start_new_session=True)
 
     try:
         interrupt_pipe = os.open(RECV_PIPE_NAME, os.O_WRONLY)
@@ -97,7 +98,7 @@ def recv_host_interrupt(_, target):
             pass
 
         # Wait for completion
-        result, _ = test_harness.TimedProcessRunner().communicate(emulator_process, 60)
+        result = test_harness.wait_for_process(emulator_process, 60)
         strresult = str(result)
         if 'PASS' not in strresult or 'FAIL' in strresult:
             raise test_harness.TestException('Test failed ' + strresult)
@@ -115,18 +116,19 @@ def send_host_interrupt(_, target):
     except OSError:
         pass    # Ignore if pipe doesn't exist
 
-    test_harness.build_program(['send_host_interrupt.S'])
+    binfile = test_harness.build_program(['send_host_interrupt.S'])
 
     os.mknod(SEND_PIPE_NAME, stat.S_IFIFO | 0o666)
 
     args = [test_harness.BIN_DIR + 'emulator',
-            '-o', SEND_PIPE_NAME, test_harness.HEX_FILE]
+            '-o', SEND_PIPE_NAME, binfile]
     emulator_process = subprocess.Popen(args, stdout=subprocess.PIPE,
-                                        stderr=subprocess.STDOUT)
+                                        stderr=subprocess.STDOUT,
+                                        start_new_session=True)
 
     try:
         interrupt_pipe = os.open(SEND_PIPE_NAME, os.O_RDONLY | os.O_NONBLOCK)
-        test_harness.TimedProcessRunner().communicate(emulator_process, 60)
+        test_harness.wait_for_process(emulator_process, 60)
 
         # Interrupts should be in pipe now
         interrupts = os.read(interrupt_pipe, 5)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+#
+# Copyright 2011-2015 Jeff Bush
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Run a randomized cosimulation campaign: generate many random programs with
+generate_random.py, run each one in cosimulation in a pool of processes, and
+report the ones that fail.
+
+Each program has its own seed, which is also the random seed of the
+verilator model, so a failure can be reproduced from the seed alone. The
+report includes the commands to do that. Files for failing programs are
+kept in obj/campaign/<seed>/, and those for passing ones are deleted.
+
+    ./campaign.py -c 10000 -j 64
+    ./campaign.py -c 10000 -j 64 --seed 1000 -n 10000 -i --json failures.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import sys
+import time
+
+sys.path.insert(0, '..')
+
+# test_harness parses the command line when it is imported. None of its
+# options apply here, so hide the ones for this script from it.
+_campaign_argv = sys.argv
+sys.argv = sys.argv[:1]
+import test_harness
+sys.argv = _campaign_argv
+
+import cosim
+import generate_random
+
+CAMPAIGN_DIR = test_harness.OBJ_DIR + 'campaign/'
+SOURCE_NAME = 'random.s'
+
+
+def get_reproduce_commands(seed, options):
+    """Return the shell commands that run the program for seed again, with
+    the same verilator random seed."""
+
+    source_file = 'random_{}.s'.format(seed)
+    return [
+        generate_random.get_command_line(source_file, seed, options.num_instructions,
+                                         options.num_threads, options.interrupts),
+        './runtest.py --randseed {} {}'.format(seed, source_file)
+    ]
+
+
+def _init_worker():
+    # The parent process handles Ctrl-C and tears down the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_program(seed, options):
+    """Generate, build, and cosimulate the program for one seed.
+
+    Returns:
+            Tuple of the seed and an error message, which is None if the
+            program passed.
+    """
+
+    work_dir = CAMPAIGN_DIR + str(seed) + '/'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    try:
+        source_file = work_dir + SOURCE_NAME
+        generate_random.generate_test(source_file, seed, options.num_instructions,
+                                      options.num_threads, options.interrupts)
+        program = test_harness.build_program([source_file], work_dir=work_dir)
+        cosim.run_cosimulation(program, work_dir, randseed=seed,
+                               timeout=options.timeout)
+    except test_harness.TestException as exc:
+        return seed, exc.args[0]
+    except Exception as exc:  # pylint: disable=W0703
+        return seed, 'Test threw exception: ' + repr(exc)
+
+    if not options.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return seed, None
+
+
+def _run_queued_program(args):
+    return run_program(*args)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--count', dest='count', type=int, default=100,
+                        help='number of random programs to run')
+    parser.add_argument('--seed', dest='seed', type=int,
+                        help='seed of the first program. The others use consecutive '
+                        'seeds. Chosen at random by default.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of programs to run concurrently')
+    parser.add_argument('-n', dest='num_instructions', type=int,
+                        default=generate_random.DEFAULT_NUM_INSTRUCTIONS,
+                        help='number of instructions to generate per thread')
+    parser.add_argument('-t', dest='num_threads', type=int,
+                        default=generate_random.DEFAULT_NUM_THREADS,
+                        help='number of threads')
+    parser.add_argument('-i', dest='interrupts', action='store_true',
+                        help='enable interrupts')
+    parser.add_argument('--timeout', dest='timeout', type=int, default=300,
+                        help='seconds to let each program run before it fails')
+    parser.add_argument('--keep', dest='keep', action='store_true',
+                        help='keep the files of programs that pass')
+    parser.add_argument('--json', dest='json_report', metavar='FILE',
+                        help='write the failing seeds and commands to reproduce '
+                        'them to a JSON file')
+    options = parser.parse_args()
+
+    first_seed = options.seed
+    if first_seed is None:
+        first_seed = random.randrange(1 << 31)
+
+    # Random programs are never built or run twice, so caching them would
+    # only evict useful entries.
+    test_harness.args.no_build_cache = True
+    test_harness.args.no_trace_cache = True
+
+    seeds = range(first_seed, first_seed + options.count)
+    print('Running {} programs with seeds {}-{}'.format(
+        options.count, first_seed, first_seed + options.count - 1))
+
+    start_time = time.monotonic()
+    failures = []
+    pool = multiprocessing.get_context('fork').Pool(options.jobs, _init_worker)
+    try:
+        results = pool.imap_unordered(_run_queued_program,
+                                      [(seed, options) for seed in seeds])
+        for completed, (seed, message) in enumerate(results, 1):
+            if message is not None:
+                print('seed {} '.format(seed) + test_harness.COLOR_RED + 'FAIL'
+                      + test_harness.COLOR_NONE)
+                failures.append({
+                    'seed': seed,
+                    'message': message,
+                    'commands': get_reproduce_commands(seed, options)
+                })
+
+            if completed % 100 == 0 or completed == options.count:
+                print('{}/{} programs complete, {} failed, {:.0f}s'.format(
+                    completed, options.count, len(failures),
+                    time.monotonic() - start_time))
+
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pool.terminate()
+        sys.exit(1)
+
+    pool.close()
+    pool.join()
+
+    failures.sort(key=lambda failure: failure['seed'])
+    if options.json_report:
+        with open(options.json_report, 'w') as outfile:
+            json.dump({'failures': failures}, outfile, indent=2, sort_keys=True)
+
+    if failures:
+        print('Failing seeds:')
+        for failure in failures:
+            print('seed {} (files in {}{}/)'.format(failure['seed'], CAMPAIGN_DIR,
+                                                   failure['seed']))
+            print(failure['message'])
+            print('To reproduce:')
+            for command in failure['commands']:
+                print('    ' + command)
+
+    print('{}/{} programs failed'.format(len(failures), options.count))
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
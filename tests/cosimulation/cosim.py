@@ -0,0 +1,434 @@
+#
+# Copyright 2011-2015 Jeff Bush
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Run a program in cosimulation. The verilator model writes the side effects
+of each instruction (with +trace, in the binary format from +binarytrace) and
+the emulator (in cosim mode) executes the same program and checks that it
+produces the same ones. Afterward, the private memory of both must match.
+
+To check memory, both sides write a hash of each cache line
+(+memdumphash/-H), which is 64 times smaller than the memory itself. If
+any hashes differ, this runs the program again, with the same verilator
+random seed, to get the contents of the lines between the first and last
+line that differ, and reports those.
+
+When the verilator random seed is known, the trace depends only on the
+program, the seed, and the hardware. This keeps the trace and the memory
+hashes from the verilator model in a cache (TRACE_CACHE_DIR), compressed,
+with a key that covers all three. If a later run finds its key there, it
+only runs the emulator, with the cached trace as its input. The cache only
+stores traces from a verilator model that was built after the last change
+to its sources, and doesn't use the cache at all otherwise.
+--no-trace-cache disables it.
+
+This is shared by runtest.py and campaign.py. The caller must import
+test_harness first.
+"""
+
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+
+import test_harness
+
+SIM_CYCLES = 2000000
+MEM_DUMP_BASE = 0x800000
+MEM_DUMP_LENGTH = 0x400000
+HASH_SIZE = 4
+
+# The verilator model may still be shutting down when the emulator sees it
+# halt, so give it this many seconds to exit.
+VERILATOR_EXIT_TIMEOUT = 10
+
+RANDOM_SEED_RE = re.compile(r'^Random seed is (\d+)$', re.MULTILINE)
+
+TRACE_CACHE_DIR = test_harness.TEST_DIR + '/obj/cosim-trace-cache/'
+TRACE_CACHE_MAX_SIZE = 0x40000000
+TRACE_NAME = 'trace.bin'
+VERILATOR_HASHES_NAME = 'vhash.bin'
+
+# Sources of the verilator model, relative to PROJECT_TOP. Directories end
+# with a slash.
+RTL_SOURCES = ['hardware/core/', 'hardware/testbench/', 'hardware/Makefile']
+
+# Computed by _get_rtl_state the first time it is needed
+_rtl_state = None
+
+
+def run_cosimulation(program, work_dir, randseed=None, timeout=300,
+                     compare_hashes=True):
+    """Run a program on the verilator model and the emulator in lock-step.
+
+    Args:
+            program: Memory image written by build_program.
+            work_dir: Directory to write memory dumps into.
+            randseed: Seed for the random initial state of the verilator
+              model. If this is None, the model picks one from the time and
+              prints it, and the trace cache is not used.
+            timeout: Seconds to wait for each simulator to finish.
+            compare_hashes: If True, compare hashes of each cache line of
+              memory, as described above. Otherwise, compare the full
+              memory contents.
+
+    Returns:
+            Nothing
+
+    Raises:
+            TestException if the side effects or final memory contents do not
+            match, or if the simulation timed out.
+    """
+
+    if not compare_hashes:
+        _run_and_compare_memory(program, work_dir, randseed, timeout,
+                                MEM_DUMP_BASE, MEM_DUMP_LENGTH)
+        return
+
+    verilator_hashes = work_dir + VERILATOR_HASHES_NAME
+    emulator_hashes = work_dir + 'mhash.bin'
+    if randseed is None or test_harness.args.no_trace_cache or not _is_model_current():
+        output = _run_pair(program, randseed, timeout, verilator_hashes, emulator_hashes,
+                           MEM_DUMP_BASE, MEM_DUMP_LENGTH, True)
+    else:
+        cache_key = _trace_cache_key(program, randseed)
+        if not _fetch_cached_trace(cache_key, work_dir):
+            _record_trace(program, randseed, timeout, work_dir + TRACE_NAME,
+                          verilator_hashes)
+            _store_cached_trace(cache_key, work_dir)
+
+        output = _replay_trace(program, timeout, work_dir + TRACE_NAME,
+                               emulator_hashes)
+
+    with open(verilator_hashes, 'rb') as infile:
+        hashes1 = infile.read()
+
+    with open(emulator_hashes, 'rb') as infile:
+        hashes2 = infile.read()
+
+    if len(hashes1) != len(hashes2):
+        raise test_harness.TestException(
+            'FAIL: memory hash files have different sizes ({} and {} bytes)'.format(
+                len(hashes1), len(hashes2)))
+
+    mismatched_lines = _find_mismatched_lines(hashes1, hashes2)
+    if not mismatched_lines:
+        return
+
+    # Get the contents of the lines that differ. This needs the same random
+    # seed to take the same path through the hardware.
+    if randseed is None:
+        match = RANDOM_SEED_RE.search(output)
+        if match:
+            randseed = int(match.group(1))
+
+    dump_base = MEM_DUMP_BASE + mismatched_lines[0] * test_harness.CACHE_LINE_SIZE
+    dump_length = ((mismatched_lines[-1] - mismatched_lines[0] + 1)
+                   * test_harness.CACHE_LINE_SIZE)
+    _run_and_compare_memory(program, work_dir, randseed, timeout, dump_base,
+                            dump_length)
+    raise test_harness.TestException(
+        'FAIL: hashes of {} cache lines did not match (first at {:08x}), but their '
+        'contents matched when run again with random seed {}'.format(
+            len(mismatched_lines), dump_base, randseed))
+
+
+def _run_and_compare_memory(program, work_dir, randseed, timeout, dump_base,
+                            dump_length):
+    verilator_mem_dump = work_dir + 'vmem.bin'
+    emulator_mem_dump = work_dir + 'mmem.bin'
+    _run_pair(program, randseed, timeout, verilator_mem_dump, emulator_mem_dump,
+              dump_base, dump_length, False)
+    test_harness.assert_files_equal(
+        verilator_mem_dump, emulator_mem_dump,
+        'final memory contents (at offsets from {:08x}) do not match'.format(dump_base))
+
+
+def _find_mismatched_lines(hashes1, hashes2):
+    """Return a sorted list of the indices of cache lines whose hashes differ.
+
+    Like test_harness._find_mismatched_words, this compares large chunks
+    first, and only compares individual hashes within chunks that differ.
+    """
+
+    chunk_size = 0x1000
+    mismatches = []
+    for chunk_start in range(0, len(hashes1), chunk_size):
+        chunk_end = min(chunk_start + chunk_size, len(hashes1))
+        if hashes1[chunk_start:chunk_end] == hashes2[chunk_start:chunk_end]:
+            continue
+
+        for offset in range(chunk_start, chunk_end, HASH_SIZE):
+            if hashes1[offset:offset + HASH_SIZE] != hashes2[offset:offset + HASH_SIZE]:
+                mismatches.append(offset // HASH_SIZE)
+
+    return mismatches
+
+
+def get_verilator_args(program, randseed=None, dump_file=None,
+                       dump_base=MEM_DUMP_BASE, dump_length=MEM_DUMP_LENGTH,
+                       dump_hashes=False):
+    """Return the command line that runs program on the verilator model and
+    writes its trace to stdout.
+
+    The trace uses the binary format (+binarytrace), which is much faster
+    for both sides than text. If dump_file is set, the model also writes
+    memory (or hashes of it) there when it finishes.
+    """
+
+    args = [
+        test_harness.BIN_DIR + 'verilator_model',
+        '+trace',
+        '+binarytrace',
+        '+simcycles=' + str(SIM_CYCLES),
+        '+autoflushl2'
+    ]
+
+    if dump_file:
+        args += [
+            '+memdumpfile=' + dump_file,
+            '+memdumpbase=' + hex(dump_base)[2:],
+            '+memdumplen=' + hex(dump_length)[2:]
+        ]
+        if dump_hashes:
+            args += ['+memdumphash']
+
+    if randseed is not None:
+        args += ['+randseed=' + str(randseed)]
+
+    return args + ['+bin=' + program]
+
+
+def get_emulator_args(program, dump_file=None, dump_base=MEM_DUMP_BASE,
+                      dump_length=MEM_DUMP_LENGTH, dump_hashes=False):
+    """Return the command line that runs program on the emulator in cosim
+    mode, checking the trace it reads from stdin."""
+
+    args = [
+        test_harness.BIN_DIR + 'emulator',
+        '-m',
+        'cosim'
+    ]
+
+    if dump_file:
+        args += ['-d', dump_file + ',' + hex(dump_base) + ',' + hex(dump_length)]
+        if dump_hashes:
+            args += ['-H']
+
+    if test_harness.DEBUG:
+        args += ['-v']
+
+    return args + [program]
+
+
+def _get_rtl_state():
+    """Return a tuple of a digest of the sources of the verilator model and
+    the latest modification time of any of them."""
+
+    global _rtl_state
+    if _rtl_state is None:
+        paths = []
+        for source in RTL_SOURCES:
+            source = os.path.join(test_harness.PROJECT_TOP, source)
+            if os.path.isdir(source):
+                for dirpath, dirnames, filenames in os.walk(source):
+                    dirnames.sort()
+                    paths += [os.path.join(dirpath, name) for name in sorted(filenames)]
+            else:
+                paths.append(source)
+
+        rtl_hash = hashlib.sha256()
+        latest_mtime = 0
+        for path in paths:
+            with open(path, 'rb') as infile:
+                rtl_hash.update(os.path.relpath(path, test_harness.PROJECT_TOP).encode())
+                rtl_hash.update(hashlib.sha256(infile.read()).digest())
+
+            latest_mtime = max(latest_mtime, os.path.getmtime(path))
+
+        _rtl_state = (rtl_hash.hexdigest(), latest_mtime)
+
+    return _rtl_state
+
+
+def _is_model_current():
+    """Return True if the verilator model was built after the last change to
+    its sources, so its traces are the ones those sources produce."""
+
+    try:
+        model_mtime = os.path.getmtime(test_harness.BIN_DIR + 'verilator_model')
+    except OSError:
+        return False
+
+    return model_mtime >= _get_rtl_state()[1]
+
+
+def _trace_cache_key(program, randseed):
+    """Compute a key that identifies the trace and memory hashes that the
+    verilator model writes for a program.
+
+    This covers the contents of the program, the sources of the model, the
+    random seed, and the command line options that affect the output.
+    """
+
+    key_hash = hashlib.sha256()
+    with open(program, 'rb') as infile:
+        key_hash.update(hashlib.sha256(infile.read()).digest())
+
+    key_hash.update(_get_rtl_state()[0].encode())
+    key_hash.update(repr((randseed, SIM_CYCLES, MEM_DUMP_BASE, MEM_DUMP_LENGTH)).encode())
+    return key_hash.hexdigest()
+
+
+def _fetch_cached_trace(key, work_dir):
+    """Decompress a cached trace and memory hashes into work_dir.
+
+    Returns:
+            True if they were in the cache, False otherwise.
+    """
+
+    entry_dir = TRACE_CACHE_DIR + key + '/'
+    try:
+        for name in (TRACE_NAME, VERILATOR_HASHES_NAME):
+            with gzip.open(entry_dir + name + '.gz', 'rb') as infile, \
+                    open(work_dir + name, 'wb') as outfile:
+                shutil.copyfileobj(infile, outfile)
+
+        os.utime(entry_dir)  # Mark as recently used
+    except (OSError, EOFError):
+        return False
+
+    return True
+
+
+def _store_cached_trace(key, work_dir):
+    """Add the trace and memory hashes in work_dir to the cache."""
+
+    entry_dir = TRACE_CACHE_DIR + key
+    temp_dir = entry_dir + '.tmp' + str(os.getpid())
+    try:
+        if not os.path.exists(temp_dir):
+            os.makedirs(temp_dir)
+
+        for name in (TRACE_NAME, VERILATOR_HASHES_NAME):
+            with open(work_dir + name, 'rb') as infile, \
+                    gzip.open(temp_dir + '/' + name + '.gz', 'wb', compresslevel=6) as outfile:
+                shutil.copyfileobj(infile, outfile)
+
+        # Renaming the directory makes the entry appear atomically to other
+        # test processes that are using the cache.
+        os.rename(temp_dir, entry_dir)
+    except OSError:
+        # Another process has already added this entry
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return
+
+    test_harness.trim_cache(TRACE_CACHE_DIR, TRACE_CACHE_MAX_SIZE)
+
+
+def _record_trace(program, randseed, timeout, trace_file, verilator_hashes):
+    """Run the verilator model alone and write its trace to a file."""
+
+    args = get_verilator_args(program, randseed, verilator_hashes, MEM_DUMP_BASE,
+                              MEM_DUMP_LENGTH, True)
+    with open(trace_file, 'wb') as outfile:
+        process = subprocess.Popen(args, stdout=outfile)
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise test_harness.TestException('FAIL: cosimulation timed out')
+
+    if process.returncode:
+        raise test_harness.TestException(
+            'FAIL: verilator model exited with code {}'.format(process.returncode))
+
+
+def _replay_trace(program, timeout, trace_file, emulator_hashes):
+    """Run the emulator with a trace recorded from the verilator model.
+
+    Returns:
+            Output of the emulator, as a string.
+    """
+
+    args = get_emulator_args(program, emulator_hashes, MEM_DUMP_BASE, MEM_DUMP_LENGTH,
+                             True)
+    with open(trace_file, 'rb') as infile:
+        process = subprocess.Popen(args, stdin=infile, stdout=subprocess.PIPE)
+        try:
+            output, _ = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise test_harness.TestException('FAIL: cosimulation timed out')
+
+    return _check_emulator_output(process, output)
+
+
+def _check_emulator_output(process, output):
+    output = output.decode(errors='replace')
+    if test_harness.DEBUG:
+        print(output)
+
+    if process.returncode:
+        raise test_harness.TestException(
+            'FAIL: cosimulation mismatch\n' + output)
+
+    return output
+
+
+def _run_pair(program, randseed, timeout, verilator_dump, emulator_dump,
+              dump_base, dump_length, dump_hashes):
+    """Run the verilator model and the emulator, with the trace of the
+    former piped into the latter, and write memory dumps (or hashes) from
+    both.
+
+    Returns:
+            Output of the emulator, as a string.
+
+    Raises:
+            TestException if the emulator detected a mismatch or the
+            simulation timed out.
+    """
+
+    verilator_args = get_verilator_args(program, randseed, verilator_dump, dump_base,
+                                        dump_length, dump_hashes)
+    emulator_args = get_emulator_args(program, emulator_dump, dump_base, dump_length,
+                                      dump_hashes)
+    verilator_process = subprocess.Popen(verilator_args, stdout=subprocess.PIPE)
+    emulator_process = subprocess.Popen(
+        emulator_args, stdin=verilator_process.stdout,
+        stdout=subprocess.PIPE)
+    try:
+        output, _ = emulator_process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        emulator_process.kill()
+        verilator_process.kill()
+        emulator_process.communicate()
+        verilator_process.wait()
+        raise test_harness.TestException('FAIL: cosimulation timed out')
+
+    try:
+        verilator_process.wait(VERILATOR_EXIT_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        verilator_process.kill()
+        verilator_process.wait()
+
+    verilator_process.stdout.close()
+    return _check_emulator_output(emulator_process, output)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+#
+# Copyright 2011-2015 Jeff Bush
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Read and write cosimulation traces, the output of the verilator model with
++trace. With +binarytrace, the model writes each event as a fixed size
+binary record (described in tools/emulator/cosimulation.c), interleaved with
+lines of text for other output.
+
+    ./cosim_trace.py print trace.bin
+    ./cosim_trace.py record trace.bin program.bin [--randseed N]
+    ./cosim_trace.py replay trace.bin program.bin
+"""
+
+import argparse
+import struct
+import subprocess
+import sys
+
+# Must match enum trace_event in tools/emulator/cosimulation.c
+EVENT_SWRITEBACK = 1
+EVENT_VWRITEBACK = 2
+EVENT_STORE = 3
+EVENT_INTERRUPT = 4
+
+EVENT_STRUCT = struct.Struct('<BBBxIIQ16I')
+NUM_VECTOR_LANES = 16
+
+
+class TraceEvent(object):
+    """One side effect from the verilator model.
+
+    values holds the lanes in the order they are printed in the text format.
+    A scalar writeback has its value in values[0].
+    """
+
+    def __init__(self, event_type, pc, thread, reg=0, address=0, mask=0,
+                 values=None):
+        self.event_type = event_type
+        self.pc = pc
+        self.thread = thread
+        self.reg = reg
+        self.address = address
+        self.mask = mask
+        self.values = values if values is not None else [0] * NUM_VECTOR_LANES
+
+    def encode(self):
+        """Return the binary record for this event."""
+
+        return EVENT_STRUCT.pack(self.event_type, self.thread, self.reg, self.pc,
+                                 self.address, self.mask, *self.values)
+
+    def __str__(self):
+        """Return the line the model prints for this event without
+        +binarytrace."""
+
+        if self.event_type == EVENT_SWRITEBACK:
+            return 'swriteback {:08x} {:x} {:02x} {:08x}'.format(
+                self.pc, self.thread, self.reg, self.values[0])
+        elif self.event_type == EVENT_INTERRUPT:
+            return 'interrupt {} {:08x}'.format(self.thread, self.pc)
+
+        data = ''.join('{:08x}'.format(value) for value in self.values)
+        if self.event_type == EVENT_VWRITEBACK:
+            return 'vwriteback {:08x} {:x} {:02x} {:016x} {}'.format(
+                self.pc, self.thread, self.reg, self.mask, data)
+
+        return 'store {:08x} {:x} {:08x} {:016x} {}'.format(
+            self.pc, self.thread, self.address, self.mask, data)
+
+
+def decode_trace(data):
+    """Split the output of the verilator model into events and text.
+
+    Args:
+            data: Bytes written by the model, in either format.
+
+    Returns:
+            Generator that yields a TraceEvent for each binary record and a
+            string (without the newline) for each line of text.
+
+    Raises:
+            ValueError if the trace ends in the middle of a binary record.
+    """
+
+    offset = 0
+    while offset < len(data):
+        if EVENT_SWRITEBACK <= data[offset] <= EVENT_INTERRUPT:
+            if offset + EVENT_STRUCT.size > len(data):
+                raise ValueError('truncated event at offset {}'.format(offset))
+
+            fields = EVENT_STRUCT.unpack_from(data, offset)
+            offset += EVENT_STRUCT.size
+            yield TraceEvent(fields[0], fields[3], fields[1], fields[2], fields[4],
+                             fields[5], list(fields[6:]))
+        else:
+            end = data.find(b'\n', offset)
+            if end < 0:
+                end = len(data)
+
+            yield data[offset:end].decode(errors='replace')
+            offset = end + 1
+
+
+def print_trace(filename):
+    with open(filename, 'rb') as infile:
+        for item in decode_trace(infile.read()):
+            print(item)
+
+
+def record_trace(filename, program, randseed):
+    """Run a program on the verilator model and save its trace."""
+
+    args = _import_cosim().get_verilator_args(program, randseed)
+    with open(filename, 'wb') as outfile:
+        return subprocess.call(args, stdout=outfile)
+
+
+def replay_trace(filename, program):
+    """Check a saved trace against the emulator. Returns its exit code."""
+
+    with open(filename, 'rb') as infile:
+        return subprocess.call(_import_cosim().get_emulator_args(program),
+                               stdin=infile)
+
+
+def _import_cosim():
+    """Import cosim (and test_harness) only when needed, so printing a
+    trace works anywhere. test_harness parses the command line when it is
+    imported, so hide the options for this script from it."""
+
+    sys.path.insert(0, '..')
+    argv = sys.argv
+    sys.argv = sys.argv[:1]
+    import cosim
+    sys.argv = argv
+    return cosim
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    print_parser = subparsers.add_parser('print', help='print a trace as text')
+    print_parser.add_argument('trace')
+    record_parser = subparsers.add_parser(
+        'record', help='run a program on the verilator model and save its trace')
+    record_parser.add_argument('trace')
+    record_parser.add_argument('program')
+    record_parser.add_argument('--randseed', type=int,
+                               help='random seed for the verilator model')
+    replay_parser = subparsers.add_parser(
+        'replay', help='check a saved trace against the emulator')
+    replay_parser.add_argument('trace')
+    replay_parser.add_argument('program')
+    options = parser.parse_args()
+
+    if options.command == 'print':
+        print_trace(options.trace)
+        result = 0
+    elif options.command == 'record':
+        result = record_trace(options.trace, options.program, options.randseed)
+    else:
+        result = replay_trace(options.trace, options.program)
+
+    sys.exit(result)
+
+if __name__ == '__main__':
+    main()
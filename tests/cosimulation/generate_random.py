@@ -35,14 +35,16 @@
 
 
 import argparse
+import itertools
+import multiprocessing
+import os
 import random
-import sys
 
 
-def generate_arith_reg():
+def generate_arith_reg(rng):
     """Return a random register number for an arithmetic operation"""
 
-    return random.randint(3, 8)
+    return rng.randint(3, 8)
 
 FP_FORMS = [
     ('s', 's', 's', ''),
@@ -86,40 +88,40 @@ BINARY_OPS = [
 ]
 
 
-def generate_binary_arith(outfile):
-    """Write a single binary arithmetic instruction to a file"""
+def generate_binary_arith(rng):
+    """Return a single binary arithmetic instruction"""
 
-    mnemonic = random.choice(BINARY_OPS)
+    mnemonic = rng.choice(BINARY_OPS)
     if mnemonic == 'shuffle':
         typed = 'v'
         typea = 'v'
         typeb = 'v'
-        suffix = '' if random.randint(0, 1) == 0 else '_mask'
+        suffix = '' if rng.randint(0, 1) == 0 else '_mask'
     elif mnemonic == 'getlane':
         typed = 's'
         typea = 'v'
-        typeb = 's' if random.randint(0, 1) == 0 else 'i'
+        typeb = 's' if rng.randint(0, 1) == 0 else 'i'
         suffix = ''
     elif mnemonic.endswith('_f'):
-        typed, typea, typeb, suffix = random.choice(FP_FORMS)
+        typed, typea, typeb, suffix = rng.choice(FP_FORMS)
     else:
-        typed, typea, typeb, suffix = random.choice(INT_FORMS)
+        typed, typea, typeb, suffix = rng.choice(INT_FORMS)
 
-    dest = generate_arith_reg()
-    rega = generate_arith_reg()
-    regb = generate_arith_reg()
-    maskreg = generate_arith_reg()
+    dest = generate_arith_reg(rng)
+    rega = generate_arith_reg(rng)
+    regb = generate_arith_reg(rng)
+    maskreg = generate_arith_reg(rng)
     opstr = '\t\t{}{} {}{}, '.format(mnemonic, suffix, typed, dest)
     if suffix != '':
         opstr += 's{}, '.format(maskreg)  # Add mask register
 
     opstr += '{}{}, '.format(typea, rega)
     if typeb == 'i':
-        opstr += str(random.randint(-0x7f, 0x7f))  # Immediate value
+        opstr += str(rng.randint(-0x7f, 0x7f))  # Immediate value
     else:
         opstr += '{}{}'.format(typeb, regb)
 
-    outfile.write(opstr + '\n')
+    return opstr + '\n'
 
 UNARY_OPS = [
     'clz',
@@ -134,38 +136,38 @@ UNARY_OPS = [
 ]
 
 
-def generate_unary_arith(outfile):
-    """Write a single unary arithmetic instruction to a file"""
+def generate_unary_arith(rng):
+    """Return a single unary arithmetic instruction"""
 
-    mnemonic = random.choice(UNARY_OPS)
-    dest = generate_arith_reg()
-    rega = generate_arith_reg()
+    mnemonic = rng.choice(UNARY_OPS)
+    dest = generate_arith_reg(rng)
+    rega = generate_arith_reg(rng)
     if mnemonic == 'movehi':
-        outfile.write('\t\tmovehi s{}, {}\n'.format(
-            dest, random.randint(0, 0x7ffff)))
+        return '\t\tmovehi s{}, {}\n'.format(
+            dest, rng.randint(0, 0x7ffff))
     else:
-        fmt = random.randint(0, 3)
-        if mnemonic == 'move' and random.randint(0, 1) == 0:
+        fmt = rng.randint(0, 3)
+        if mnemonic == 'move' and rng.randint(0, 1) == 0:
             # Move with immediate value
             if fmt == 0:
-                maskreg = generate_arith_reg()
-                outfile.write('\t\t{}_mask  v{}, s{}, {}\n'.format
-                              (mnemonic, dest, maskreg, random.randint(-0xff, 0xff)))
+                maskreg = generate_arith_reg(rng)
+                return '\t\t{}_mask  v{}, s{}, {}\n'.format(
+                    mnemonic, dest, maskreg, rng.randint(-0xff, 0xff))
             elif fmt == 1:
-                outfile.write('\t\t{} v{}, {}\n'.format(mnemonic, dest,
-                                                        random.randint(-0xff, 0xff)))
+                return '\t\t{} v{}, {}\n'.format(mnemonic, dest,
+                                                 rng.randint(-0xff, 0xff))
             else:
-                outfile.write('\t\t{} s{}, {}\n'.format(mnemonic, dest,
-                                                        random.randint(-0x1fff, 0x1fff)))
+                return '\t\t{} s{}, {}\n'.format(mnemonic, dest,
+                                                 rng.randint(-0x1fff, 0x1fff))
         else:
             if fmt == 0:
-                maskreg = generate_arith_reg()
-                outfile.write('\t\t{}_mask  v{}, s{}, v{}\n'.format
-                              (mnemonic, dest, maskreg, rega))
+                maskreg = generate_arith_reg(rng)
+                return '\t\t{}_mask  v{}, s{}, v{}\n'.format(
+                    mnemonic, dest, maskreg, rega)
             elif fmt == 1:
-                outfile.write('\t\t{} v{}, v{}\n'.format(mnemonic, dest, rega))
+                return '\t\t{} v{}, v{}\n'.format(mnemonic, dest, rega)
             else:
-                outfile.write('\t\t{} s{}, s{}\n'.format(mnemonic, dest, rega))
+                return '\t\t{} s{}, s{}\n'.format(mnemonic, dest, rega)
 
 COMPARE_FORMS = [
     ('v', 'v'),
@@ -192,21 +194,21 @@ COMPARE_OPS = [
 ]
 
 
-def generate_compare(outfile):
-    """Write a single comparison instruction to a file"""
+def generate_compare(rng):
+    """Return a single comparison instruction"""
 
-    typea, typeb = random.choice(COMPARE_FORMS)
-    dest = generate_arith_reg()
-    rega = generate_arith_reg()
-    regb = generate_arith_reg()
-    opsuffix = random.choice(COMPARE_OPS)
+    typea, typeb = rng.choice(COMPARE_FORMS)
+    dest = generate_arith_reg(rng)
+    rega = generate_arith_reg(rng)
+    regb = generate_arith_reg(rng)
+    opsuffix = rng.choice(COMPARE_OPS)
     opstr = '\t\tcmp{} s{}, {}{}, '.format(opsuffix, dest, typea, rega)
-    if random.randint(0, 1) == 0 and not opsuffix.endswith('_f'):
-        opstr += str(random.randint(-0x1ff, 0x1ff))  # Immediate value
+    if rng.randint(0, 1) == 0 and not opsuffix.endswith('_f'):
+        opstr += str(rng.randint(-0x1ff, 0x1ff))  # Immediate value
     else:
         opstr += '{}{}'.format(typeb, regb)
 
-    outfile.write(opstr + '\n')
+    return opstr + '\n'
 
 LOAD_OPS = [
     ('_32', 4),
@@ -223,44 +225,44 @@ STORE_OPS = [
 ]
 
 
-def generate_memory_access(outfile):
-    """ Write a random single memory load or store instruction to the file"""
+def generate_memory_access(rng):
+    """Return a random single memory load or store instruction"""
 
     # v0/s0 represent the shared segment, which is read only
     # v1/s1 represent the private segment, which is read/write
-    ptr_reg = random.randint(0, 1)
+    ptr_reg = rng.randint(0, 1)
 
-    opstr = 'load' if ptr_reg == 0 or random.randint(0, 1) else 'store'
+    opstr = 'load' if ptr_reg == 0 or rng.randint(0, 1) else 'store'
 
-    op_type = random.randint(0, 2)
+    op_type = rng.randint(0, 2)
     if op_type == 0:
         # Block vector
-        offset = random.randint(0, 16) * 64
-        opstr += '_v v{}, {}(s{})'.format(generate_arith_reg(),
+        offset = rng.randint(0, 16) * 64
+        opstr += '_v v{}, {}(s{})'.format(generate_arith_reg(rng),
                                           offset, ptr_reg)
     elif op_type == 1:
         # Scatter/gather
-        offset = random.randint(0, 16) * 4
+        offset = rng.randint(0, 16) * 4
         if opstr == 'load':
             opstr += '_gath'
         else:
             opstr += '_scat'
 
-        mask_type = random.randint(0, 1)
+        mask_type = rng.randint(0, 1)
         if mask_type == 1:
             opstr += '_mask'
 
-        opstr += ' v{}'.format(generate_arith_reg())
+        opstr += ' v{}'.format(generate_arith_reg(rng))
         if mask_type:
-            opstr += ', s{}'.format(generate_arith_reg())
+            opstr += ', s{}'.format(generate_arith_reg(rng))
 
         opstr += ', {}(v{})'.format(offset, ptr_reg)
     else:
         # Scalar
         if opstr == 'load':
-            suffix, align = random.choice(LOAD_OPS)
+            suffix, align = rng.choice(LOAD_OPS)
         else:
-            suffix, align = random.choice(STORE_OPS)
+            suffix, align = rng.choice(STORE_OPS)
 
         # Because we don't model the store queue in the emulator,
         # a store can invalidate a synchronized load that is issued subsequently.
@@ -268,24 +270,24 @@ def generate_memory_access(outfile):
         if opstr == 'load' and suffix == '_sync':
             opstr = 'membar\n\t\t' + opstr
 
-        offset = random.randint(0, 16) * align
-        opstr += '{} s{}, {}(s{})'.format(suffix, generate_arith_reg(),
+        offset = rng.randint(0, 16) * align
+        opstr += '{} s{}, {}(s{})'.format(suffix, generate_arith_reg(rng),
                                           offset, ptr_reg)
 
-    outfile.write('\t\t' + opstr + '\n')
+    return '\t\t' + opstr + '\n'
 
 
-def generate_device_io(outfile):
+def generate_device_io(rng):
     """
-    Write a random single memory load or store instruction that accesses
-    device space (0xffff0000-0xffffffff) to the file.
+    Return a random single memory load or store instruction that accesses
+    device space (0xffff0000-0xffffffff).
     """
 
-    if random.randint(0, 1):
-        outfile.write('\t\tload_32 s{}, {}(s9)\n'.format(
-            generate_arith_reg(), random.randint(0, 1) * 4))
+    if rng.randint(0, 1):
+        return '\t\tload_32 s{}, {}(s9)\n'.format(
+            generate_arith_reg(rng), rng.randint(0, 1) * 4)
     else:
-        outfile.write('\t\tstore_32 s{}, (s9)\n'.format(generate_arith_reg()))
+        return '\t\tstore_32 s{}, (s9)\n'.format(generate_arith_reg(rng))
 
 BRANCH_TYPES = [
     ('bz', True),
@@ -295,33 +297,33 @@ BRANCH_TYPES = [
 ]
 
 
-def generate_branch(outfile):
+def generate_branch(rng):
     """
-    Write a single branch instruction to outfile. This will use a relative
+    Return a single branch instruction. This will use a relative
     forward branch to an anonymous label 1-6 instructions away.
     """
 
-    branch_type, is_cond = random.choice(BRANCH_TYPES)
+    branch_type, is_cond = rng.choice(BRANCH_TYPES)
     if is_cond:
-        outfile.write('\t\t{} s{}, {}f\n'.format(
-            branch_type, generate_arith_reg(), random.randint(1, 6)))
+        return '\t\t{} s{}, {}f\n'.format(
+            branch_type, generate_arith_reg(rng), rng.randint(1, 6))
     else:
-        outfile.write('\t\t{} {}f\n'.format(branch_type, random.randint(1, 6)))
+        return '\t\t{} {}f\n'.format(branch_type, rng.randint(1, 6))
 
 
-def generate_computed_pointer(outfile):
+def generate_computed_pointer(rng):
     """
     Generate an arithmetic instruction that writes to one of the special
     'computed pointer' registers. These are guaranteed to be valid memory
     locations
     """
 
-    if random.randint(0, 1) == 0:
-        outfile.write('\t\tadd_i s1, s2, {}\n'.format(
-            random.randint(0, 16) * 64))
+    if rng.randint(0, 1) == 0:
+        return '\t\tadd_i s1, s2, {}\n'.format(
+            rng.randint(0, 16) * 64)
     else:
-        outfile.write('\t\tadd_i v1, v2, {}\n'.format(
-            random.randint(0, 16) * 64))
+        return '\t\tadd_i v1, v2, {}\n'.format(
+            rng.randint(0, 16) * 64)
 
 CACHE_CONTROL_INSTRS = [
     'dflush s1',
@@ -330,11 +332,12 @@ CACHE_CONTROL_INSTRS = [
 ]
 
 
-def generate_cache_control(outfile):
+def generate_cache_control(rng):
     """Generate a single cache control instruction"""
 
-    outfile.write('\t\t{}\n'.format(random.choice(CACHE_CONTROL_INSTRS)))
+    return '\t\t{}\n'.format(rng.choice(CACHE_CONTROL_INSTRS))
 
+# The last entry gets whatever probability is left over.
 GENERATE_FUNCS = [
     (0.1, generate_computed_pointer),
     (0.5, generate_binary_arith),
@@ -346,12 +349,82 @@ GENERATE_FUNCS = [
     (1.0, generate_branch),
 ]
 
+GENERATE_CUM_WEIGHTS = [min(weight, 1.0) for weight in
+                        itertools.accumulate(prob for prob, _ in GENERATE_FUNCS)]
 
-def generate_test(filename):
-    """Write a complete assembly file with a pseudorandom instruction stream"""
+# Anonymous labels of consecutive instructions. Branches jump forward to
+# one of these.
+INSTRUCTION_LABELS = ['2:', '3:', '4:', '5:', '6:', '1:']
 
-    with open(filename, 'w') as outfile:
-        outfile.write('# This file auto-generated by ' + sys.argv[0] + '''
+
+class FastRandom(random.Random):
+    """Random number generator for generating instructions.
+
+    random.Random.randint and choice handle arbitrary ranges exactly, which
+    makes them slow, and they are most of the time it takes to generate a
+    program. The ranges here are small, so these versions scale a single
+    call to random(), the same way random.Random.choices does.
+    """
+
+    def randint(self, a, b):
+        return a + int(self.random() * (b - a + 1))
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+
+def generate_instructions(rng, num_instructions):
+    """Return the random instructions for one thread, as a list of lines.
+
+    This chooses the type of every instruction up front, in one call.
+    """
+
+    funcs = rng.choices([func for _, func in GENERATE_FUNCS],
+                        cum_weights=GENERATE_CUM_WEIGHTS, k=num_instructions)
+    labels = itertools.cycle(INSTRUCTION_LABELS)
+    return [label + func(rng) for label, func in zip(labels, funcs)]
+
+
+DEFAULT_NUM_INSTRUCTIONS = 60000
+DEFAULT_NUM_THREADS = 4
+
+
+def get_command_line(filename, seed, num_instructions=DEFAULT_NUM_INSTRUCTIONS,
+                     num_threads=DEFAULT_NUM_THREADS, enable_interrupts=False):
+    """Return the command that writes the same file as generate_test does when
+    it is called with these arguments, as a string."""
+
+    command = './generate_random.py --seed {} -n {} -t {}'.format(
+        seed, num_instructions, num_threads)
+    if enable_interrupts:
+        command += ' -i'
+
+    return command + ' -o ' + filename
+
+
+def generate_test(filename, seed, num_instructions=DEFAULT_NUM_INSTRUCTIONS,
+                  num_threads=DEFAULT_NUM_THREADS, enable_interrupts=False):
+    """Write a complete assembly file with a pseudorandom instruction stream.
+
+    Args:
+            filename: Path of the assembly file to write.
+            seed: Integer seed for the random number generator. The same
+              seed and options always produce the same file.
+            num_instructions: Number of instructions to generate per thread.
+            num_threads: Number of threads that run random instructions.
+            enable_interrupts: If True, the program enables interrupts and
+              installs a handler for them.
+
+    Returns:
+            Nothing
+    """
+
+    rng = FastRandom(seed)
+    parts = []
+    parts.append('# This file auto-generated by generate_random.py with:\n# '
+                 + get_command_line(os.path.basename(filename), seed,
+                                    num_instructions, num_threads,
+                                    enable_interrupts) + '''
 
                 .include "../asm_macros.inc"
 
@@ -410,8 +483,8 @@ fill_loop:      store_32 s5, (s3)
                 move v8, 73
 ''')
 
-        if enable_interrupts:
-            outfile.write('''
+    if enable_interrupts:
+        parts.append('''
                 ###### Set up interrupt handler ###################################
                 lea s10, interrupt_handler
                 setcr s10, CR_TRAP_HANDLER
@@ -422,7 +495,7 @@ fill_loop:      store_32 s5, (s3)
 
 ''')
 
-        outfile.write('''
+    parts.append('''
                 ###### Compute address of per-thread code and branch ######
                 getcr s3, CR_CURRENT_THREAD
                 shl s3, s3, 2
@@ -449,27 +522,12 @@ interrupt_handler:
 ptrvec:         .long 0, 4, 8, 12, 16, 20, 24, 28, 32, 36, 40, 44, 48, 52, 56, 60
 branch_addrs:   .long ''')
 
-        for i in range(num_threads):
-            if i:
-                outfile.write(', ')
-
-            outfile.write('start_thread{}'.format(i))
-
-        for thread in range(num_threads):
-            outfile.write('\nstart_thread{}:\n'.format(thread))
-            label_idx = 1
-            for i in range(num_instructions):
-                outfile.write('{}:'.format(label_idx + 1))
-                label_idx = (label_idx + 1) % 6
-                inst_type = random.random()
-                cumul_prob = 0.0
-                for prob, func in GENERATE_FUNCS:
-                    cumul_prob += prob
-                    if inst_type < cumul_prob:
-                        func(outfile)
-                        break
-
-            outfile.write('''
+    parts.append(', '.join('start_thread{}'.format(thread)
+                           for thread in range(num_threads)))
+    for thread in range(num_threads):
+        parts.append('\nstart_thread{}:\n'.format(thread))
+        parts.extend(generate_instructions(rng, num_instructions))
+        parts.append('''
         1: nop
         2: nop
         3: nop
@@ -481,30 +539,57 @@ branch_addrs:   .long ''')
         halt_current_thread
         ''')
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-o', help='File to write result into',
-                    type=str, default='random.s')
-parser.add_argument('-m', help='Write multiple test files', type=int)
-parser.add_argument(
-    '-n',
-    help='number of instructions to generate per thread',
-    type=int,
-    default=60000)
-parser.add_argument('-i', help='Enable interrupts', action='store_true')
-parser.add_argument('-t', help='Number of threads', type=int, default=4)
-args = vars(parser.parse_args())
-num_instructions = args['n']
-enable_interrupts = args['i']
-num_threads = args['t']
-
-if (num_instructions + 120) * num_threads * 4 > 0x800000:
-    print('Instruction space exceeds available memory.')
-
-if args['m']:
-    for fileno in range(args['m']):
-        output_file = 'random{:04d}.s'.format(fileno)
-        print('generating ' + output_file)
-        generate_test(output_file)
-else:
-    print('generating ' + args['o'])
-    generate_test(args['o'])
+    with open(filename, 'w') as outfile:
+        outfile.write(''.join(parts))
+
+
+def _generate_queued_test(job):
+    generate_test(*job)
+    return job[0], job[1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', help='File to write result into',
+                        type=str, default='random.s')
+    parser.add_argument('-m', help='Write multiple test files', type=int)
+    parser.add_argument(
+        '-n',
+        help='number of instructions to generate per thread',
+        type=int,
+        default=DEFAULT_NUM_INSTRUCTIONS)
+    parser.add_argument('-i', help='Enable interrupts', action='store_true')
+    parser.add_argument('-t', help='Number of threads', type=int,
+                        default=DEFAULT_NUM_THREADS)
+    parser.add_argument('-j', help='With -m, number of files to generate concurrently',
+                        type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--seed', type=int,
+                        help='Random seed. With -m, the files use consecutive seeds '
+                        'starting with this one. Chosen at random by default.')
+    args = vars(parser.parse_args())
+    num_instructions = args['n']
+    enable_interrupts = args['i']
+    num_threads = args['t']
+    seed = args['seed']
+    if seed is None:
+        seed = random.randrange(1 << 31)
+
+    if (num_instructions + 120) * num_threads * 4 > 0x800000:
+        print('Instruction space exceeds available memory.')
+
+    if args['m']:
+        jobs = [('random{:04d}.s'.format(fileno), seed + fileno, num_instructions,
+                 num_threads, enable_interrupts) for fileno in range(args['m'])]
+        pool = multiprocessing.Pool(args['j'])
+        for output_file, file_seed in pool.imap(_generate_queued_test, jobs):
+            print('generated {} (seed {})'.format(output_file, file_seed))
+
+        pool.close()
+        pool.join()
+    else:
+        print('generating {} (seed {})'.format(args['o'], seed))
+        generate_test(args['o'], seed, num_instructions, num_threads,
+                      enable_interrupts)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+#
+# Copyright 2011-2015 Jeff Bush
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Shrink a program from generate_random.py that fails in cosimulation to a
+small one that fails the same way, using delta debugging.
+
+    ./minimize.py random_1234.s [-o minimized.s] [-j jobs] [--randseed N]
+
+It removes, in this order:
+ 1. The random instructions of whole threads.
+ 2. Random instructions, with the ddmin algorithm: it splits the
+    instructions of all threads into chunks and tries removing each chunk,
+    with smaller chunks each time nothing can be removed, until removing
+    any single instruction makes the failure go away.
+ 3. The interrupt handler setup (for programs generated with -i).
+
+Each step runs many candidate programs in cosimulation concurrently. A
+candidate reproduces the failure if it fails with the same kind of error as
+the original program (or with one that matches --match).
+
+Removing instructions keeps the invariants described in generate_random.py:
+ - The setup code, which initializes the pointer registers and fills private
+   memory, is never changed. Only the instructions that generate_test writes
+   after each start_threadN label are removed. Only add_i instructions from
+   generate_computed_pointer write s1/v1, and they always write valid
+   addresses, so removing any of them leaves a valid pointer.
+ - Threads are emptied rather than removed, so branch_addrs still has an
+   entry for every hardware thread. An empty thread runs the code at the end
+   of its section and halts.
+ - Branches are always forward to one of the anonymous labels 1-6. Each
+   kept instruction keeps its label, and the end of each thread defines all
+   of them, so every branch still has a target.
+
+The verilator model runs with the same random seed as the original program,
+which by default is the seed the program was generated with (from the
+header comment), the same as campaign.py.
+"""
+
+import argparse
+import multiprocessing
+import os
+import re
+import shutil
+import signal
+import sys
+import time
+
+sys.path.insert(0, '..')
+
+# test_harness parses the command line when it is imported. None of its
+# options apply here, so hide the ones for this script from it.
+_minimize_argv = sys.argv
+sys.argv = sys.argv[:1]
+import test_harness
+sys.argv = _minimize_argv
+
+import cosim
+
+MINIMIZE_DIR = test_harness.OBJ_DIR + 'minimize/'
+SOURCE_NAME = 'random.s'
+
+THREAD_START_RE = re.compile(r'^start_thread(\d+):$')
+INSTRUCTION_RE = re.compile(r'^\d:')
+INTERRUPT_SETUP_RE = re.compile(r'\n *###### Set up interrupt handler #*\n.*?CR_INTERRUPT_MASK\n',
+                                re.DOTALL)
+GENERATED_SEED_RE = re.compile(r'^# \./generate_random\.py --seed (\d+)', re.MULTILINE)
+NUMBER_RE = re.compile(r'\b[0-9a-fA-F]*[0-9][0-9a-fA-F]*\b')
+
+
+class RandomProgram(object):
+    """A program written by generate_random.generate_test, split into the
+    parts that can be removed.
+
+    Each instruction is identified by a tuple of its thread and its index in
+    that thread. The program is rendered with only the instructions in a set
+    of these.
+    """
+
+    def __init__(self, source):
+        lines = source.split('\n')
+        self.header = []
+        self.threads = []      # Instructions of each thread
+        self.trailers = []     # Lines after the instructions of each thread
+        section = self.header
+        for line in lines:
+            if THREAD_START_RE.match(line):
+                self.threads.append([])
+                self.trailers.append([line])
+                section = None
+            elif section is None and INSTRUCTION_RE.match(line):
+                self.threads[-1].append(line)
+            elif section is None and line.startswith('\t\t') and \
+                    not self.trailers[-1][1:]:
+                # Second line of an instruction (like membar before a load)
+                self.threads[-1][-1] += '\n' + line
+            elif self.threads:
+                self.trailers[-1].append(line)
+                section = self.trailers[-1]
+            else:
+                section.append(line)
+
+        if not self.threads:
+            raise test_harness.TestException(
+                'not a program from generate_random.py (no start_thread labels)')
+
+        self.header = '\n'.join(self.header)
+        self.has_interrupts = INTERRUPT_SETUP_RE.search(self.header) is not None
+
+    def all_instructions(self):
+        """Return a list of the ids of all instructions in the program."""
+
+        return [(thread, index) for thread, instructions in enumerate(self.threads)
+                for index in range(len(instructions))]
+
+    def render(self, instructions, interrupts, comment):
+        """Return the source of the program with only some instructions.
+
+        Args:
+                instructions: Set of instruction ids to keep.
+                interrupts: If False, remove the interrupt handler setup.
+                comment: Line added to the top of the file.
+        """
+
+        header = self.header
+        if not interrupts:
+            header = INTERRUPT_SETUP_RE.sub('\n', header)
+
+        parts = ['# ' + comment, header]
+        for thread, thread_instructions in enumerate(self.threads):
+            parts.append(self.trailers[thread][0])
+            parts.extend(instruction for index, instruction
+                         in enumerate(thread_instructions)
+                         if (thread, index) in instructions)
+            parts.extend(self.trailers[thread][1:])
+
+        return '\n'.join(parts)
+
+
+def get_failure_kind(message):
+    """Return the first line of an error, without any numbers, which differ
+    between runs of programs that fail in the same way."""
+
+    return NUMBER_RE.sub('N', message.split('\n', 1)[0])
+
+
+def _init_worker():
+    # The parent process handles Ctrl-C and tears down the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_candidate(job):
+    """Build and cosimulate one candidate program.
+
+    Args:
+            job: Tuple of the candidate number, its source, the verilator
+              random seed, and the timeout in seconds.
+
+    Returns:
+            Error message, or None if it passed.
+    """
+
+    candidate_num, source, randseed, timeout = job
+    work_dir = MINIMIZE_DIR + str(candidate_num) + '/'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    try:
+        source_file = work_dir + SOURCE_NAME
+        with open(source_file, 'w') as outfile:
+            outfile.write(source)
+
+        program = test_harness.build_program([source_file], work_dir=work_dir)
+        cosim.run_cosimulation(program, work_dir, randseed=randseed, timeout=timeout)
+    except test_harness.TestException as exc:
+        return exc.args[0]
+    except Exception as exc:  # pylint: disable=W0703
+        return 'Test threw exception: ' + repr(exc)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return None
+
+
+class Minimizer(object):
+    def __init__(self, program, options, randseed, failure_kind):
+        self.program = program
+        self.options = options
+        self.randseed = randseed
+        self.failure_kind = failure_kind
+        self.instructions = set(program.all_instructions())
+        self.interrupts = program.has_interrupts
+        self.candidates_run = 0
+        self.pool = multiprocessing.get_context('fork').Pool(options.jobs, _init_worker)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+
+    def render(self, instructions=None, interrupts=None):
+        return self.program.render(
+            self.instructions if instructions is None else instructions,
+            self.interrupts if interrupts is None else interrupts,
+            'Minimized by minimize.py from ' + os.path.basename(self.options.source))
+
+    def reproduces(self, message):
+        if message is None or message.startswith('Compilation failed'):
+            return False
+
+        if self.options.match:
+            return re.search(self.options.match, message) is not None
+
+        return get_failure_kind(message) == self.failure_kind
+
+    def find_failing(self, candidates):
+        """Run candidates (sets of instruction ids, or tuples of those and
+        whether interrupts are enabled) concurrently.
+
+        This runs them in batches of one per job, and stops after the first
+        batch that reproduces the failure, so no candidates are left
+        running in the pool when it returns.
+
+        Returns:
+                Index of the first candidate in the list that reproduces the
+                failure, or None if none do.
+        """
+
+        for batch_start in range(0, len(candidates), self.options.jobs):
+            jobs = []
+            for candidate in candidates[batch_start:batch_start + self.options.jobs]:
+                if isinstance(candidate, tuple):
+                    source = self.render(*candidate)
+                else:
+                    source = self.render(candidate)
+
+                jobs.append((self.candidates_run + len(jobs), source, self.randseed,
+                             self.options.timeout))
+
+            self.candidates_run += len(jobs)
+            for index, message in enumerate(self.pool.map(run_candidate, jobs)):
+                if self.reproduces(message):
+                    return batch_start + index
+
+        return None
+
+    def remove_threads(self):
+        while True:
+            nonempty = sorted(set(thread for thread, _ in self.instructions))
+            if len(nonempty) <= 1:
+                return
+
+            candidates = [set(inst for inst in self.instructions if inst[0] != thread)
+                          for thread in nonempty]
+            index = self.find_failing(candidates)
+            if index is None:
+                return
+
+            self.instructions = candidates[index]
+            self.report('emptied thread {}'.format(nonempty[index]))
+
+    def remove_instructions(self):
+        """The ddmin algorithm, from "Simplifying and Isolating
+        Failure-Inducing Input" (Zeller and Hildebrandt, 2002)."""
+
+        instructions = sorted(self.instructions)
+        granularity = 2
+        while len(instructions) >= 2:
+            chunk_size = (len(instructions) + granularity - 1) // granularity
+            chunks = [instructions[start:start + chunk_size]
+                      for start in range(0, len(instructions), chunk_size)]
+
+            # Try each chunk alone, then each chunk removed. With two chunks,
+            # these are the same.
+            subsets = [set(chunk) for chunk in chunks]
+            candidates = list(subsets)
+            if len(chunks) > 2:
+                candidates += [set(instructions) - subset for subset in subsets]
+
+            index = self.find_failing(candidates)
+            if index is None:
+                if granularity >= len(instructions):
+                    break
+
+                granularity = min(granularity * 2, len(instructions))
+                continue
+
+            self.instructions = candidates[index]
+            instructions = sorted(self.instructions)
+            if index < len(chunks):
+                granularity = 2
+            else:
+                granularity = max(granularity - 1, 2)
+
+            self.report('{} chunks'.format(len(chunks)))
+
+        if len(instructions) == 1 and self.find_failing([set()]) == 0:
+            self.instructions = set()
+            self.report('removed the last instruction')
+
+    def remove_interrupts(self):
+        if self.interrupts and self.find_failing([(self.instructions, False)]) == 0:
+            self.interrupts = False
+            self.report('removed interrupt setup')
+
+    def report(self, step):
+        print('{} instructions left ({}, {} candidates run)'.format(
+            len(self.instructions), step, self.candidates_run))
+        sys.stdout.flush()
+        with open(self.options.output, 'w') as outfile:
+            outfile.write(self.render())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', help='program written by generate_random.py')
+    parser.add_argument('-o', dest='output',
+                        help='file to write the smallest failing program into. '
+                        'Defaults to the source name with .min.s')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of candidate programs to run concurrently')
+    parser.add_argument('--randseed', dest='randseed', type=int,
+                        help='random seed for the verilator model. Defaults to the '
+                        'seed the program was generated with.')
+    parser.add_argument('--match', dest='match', metavar='REGEX',
+                        help='only count a candidate as failing if its error message '
+                        'matches this, instead of the same kind of error as the '
+                        'original program')
+    parser.add_argument('--timeout', dest='timeout', type=int, default=300,
+                        help='seconds to let each candidate run before it fails')
+    options = parser.parse_args()
+    if options.output is None:
+        options.output = os.path.splitext(options.source)[0] + '.min.s'
+
+    with open(options.source, 'r') as infile:
+        source = infile.read()
+
+    try:
+        program = RandomProgram(source)
+    except test_harness.TestException as exc:
+        print(exc.args[0])
+        sys.exit(1)
+
+    randseed = options.randseed
+    if randseed is None:
+        match = GENERATED_SEED_RE.search(source)
+        if match:
+            randseed = int(match.group(1))
+
+    # Each candidate is only built and run once
+    test_harness.args.no_build_cache = True
+    test_harness.args.no_trace_cache = True
+
+    print('Running original program ({} instructions, random seed {})'.format(
+        len(program.all_instructions()), randseed))
+    start_time = time.monotonic()
+    message = run_candidate((0, source, randseed, options.timeout))
+    if message is None:
+        print('Original program passed, nothing to minimize')
+        sys.exit(1)
+
+    print(message.split('\n', 1)[0])
+    minimizer = Minimizer(program, options, randseed, get_failure_kind(message))
+    if not minimizer.reproduces(message):
+        print('Original program does not fail with an error that matches ' +
+              options.match)
+        sys.exit(1)
+
+    try:
+        minimizer.remove_threads()
+        minimizer.remove_instructions()
+        minimizer.remove_interrupts()
+    except KeyboardInterrupt:
+        minimizer.terminate()
+        print('Interrupted. The smallest failing program so far is in ' + options.output)
+        sys.exit(1)
+
+    minimizer.close()
+    minimizer.report('done')
+    print('Wrote {} ({:.0f}s)'.format(options.output, time.monotonic() - start_time))
+    print('To reproduce:')
+    if randseed is not None:
+        print('    ./runtest.py --randseed {} {}'.format(randseed, options.output))
+    else:
+        print('    ./runtest.py ' + options.output)
+
+if __name__ == '__main__':
+    main()
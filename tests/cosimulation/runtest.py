@@ -15,70 +15,19 @@
 # limitations under the License.
 #
 
-import os
-import subprocess
 import sys
-import time
 
 sys.path.insert(0, '..')
 import test_harness
-
-
-VERILATOR_MEM_DUMP = 'obj/vmem.bin'
-EMULATOR_MEM_DUMP = 'obj/mmem.bin'
+import cosim
 
 
 def run_cosimulation_test(source_file, target):
-    verilator_args = [
-        '../../bin/verilator_model',
-        '+trace',
-        '+simcycles=2000000',
-        '+memdumpfile=' + VERILATOR_MEM_DUMP,
-        '+memdumpbase=800000',
-        '+memdumplen=400000',
-        '+autoflushl2'
-    ]
-
-    # XXX this should probably be a command line option in test_harness.py
-    if 'RANDSEED' in os.environ:
-        verilator_args += ['+randseed=' + os.environ['RANDSEED']]
-
-    emulator_args = [
-        '../../bin/emulator',
-        '-m',
-        'cosim',
-        '-d',
-        'obj/mmem.bin,0x800000,0x400000'
-    ]
-
-    if test_harness.DEBUG:
-        emulator_args += ['-v']
-
-    hexfile = test_harness.build_program([source_file])
-    p1 = subprocess.Popen(
-        verilator_args + ['+bin=' + hexfile], stdout=subprocess.PIPE)
-    p2 = subprocess.Popen(
-        emulator_args + [hexfile], stdin=p1.stdout, stdout=subprocess.PIPE)
-    output = ''
-    while True:
-        got = p2.stdout.read(0x1000)
-        if not got:
-            break
-
-        if test_harness.DEBUG:
-            print(got.decode())
-        else:
-            output += got.decode()
-
-    p2.wait()
-    time.sleep(1)  # Give verilator a chance to clean up
-    p1.kill() 	# Make sure verilator has exited
-    if p2.returncode:
-        raise test_harness.TestException(
-            'FAIL: cosimulation mismatch\n' + output)
-
-    test_harness.assert_files_equal(VERILATOR_MEM_DUMP, EMULATOR_MEM_DUMP,
-                                    'final memory contents to not match')
+    test_harness.add_dependency('cosim.py')
+    test_harness.add_dependency(test_harness.PROJECT_TOP + '/tools/emulator')
+    program = test_harness.build_program([source_file])
+    cosim.run_cosimulation(program, test_harness.get_work_dir(),
+                           test_harness.args.randseed)
 
 test_harness.register_tests(run_cosimulation_test,
                             test_harness.find_files(('.s', '.S')), ['verilator'])
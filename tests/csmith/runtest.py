@@ -58,9 +58,10 @@ def run_csmith_test(_, target):
                                '--no-packed-struct'])
 
         # Compile and run on host
+        host_executable = test_harness.get_work_dir() + 'a.out'
         subprocess.check_call(
-            ['cc', '-w', source_file, '-o', 'obj/a.out', csmith_include])
-        result = subprocess.check_output('obj/a.out').decode()
+            ['cc', '-w', source_file, '-o', host_executable, csmith_include])
+        result = subprocess.check_output(host_executable).decode()
 
         got = CHECKSUM_RE.search(result)
         if not got:
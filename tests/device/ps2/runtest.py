@@ -26,7 +26,7 @@ import test_harness
 @test_harness.test(['verilator'])
 def ps2(_, target):
     test_harness.build_program(['ps2.c'])
-    result = test_harness.run_program(target)
+    result = test_harness.run_program(target, sentinels=['PASS', 'FAIL'])
     if 'PASS' not in result:
         raise test_harness.TestException(
             'program did not indicate pass\n' + result)
@@ -24,25 +24,26 @@ sys.path.insert(0, '../..')
 import test_harness
 
 FILE_SIZE = 8192
-SOURCE_BLOCK_DEV = 'bdevimage.bin'
-MEMDUMP = 'memory.bin'
 
 
 @test_harness.test
 def sdmmc_read(name, target):
+    source_block_dev = test_harness.get_work_dir() + 'bdevimage.bin'
+    memdump = test_harness.get_work_dir() + 'memory.bin'
+
     # Create random file
-    with open(SOURCE_BLOCK_DEV, 'wb') as randfile:
+    with open(source_block_dev, 'wb') as randfile:
         randfile.write(os.urandom(FILE_SIZE))
 
     test_harness.build_program(['sdmmc_read.c'])
     test_harness.run_program(
         target=target,
-        block_device=SOURCE_BLOCK_DEV,
-        dump_file=MEMDUMP,
+        block_device=source_block_dev,
+        dump_file=memdump,
         dump_base=0x200000,
         dump_length=FILE_SIZE,
         flush_l2=True)
 
-    test_harness.assert_files_equal(SOURCE_BLOCK_DEV, MEMDUMP, 'file mismatch')
+    test_harness.assert_files_equal(source_block_dev, memdump, 'file mismatch')
 
 test_harness.execute_tests()
@@ -31,6 +31,9 @@ from threading import Thread
 sys.path.insert(0, '..')
 import test_harness
 
+# These tests use fixed network ports
+test_harness.require_serial_execution()
+
 CONTROL_PORT = 8541
 INSTRUCTION_LENGTH = 4
 EXPECTED_IDCODE = 0x4d20dffb  # Derived from settings in hardware/core/config.sv
@@ -62,8 +65,8 @@ class JTAGTestFixture(object):
     construct to automatically clean up after itself.
     """
 
-    def __init__(self, hexfile):
-        self.hexfile = hexfile
+    def __init__(self, binfile):
+        self.binfile = binfile
         self.process = None
         self.sock = None
         self.output = ''
@@ -73,9 +76,9 @@ class JTAGTestFixture(object):
     def __enter__(self):
         verilator_args = [
             test_harness.BIN_DIR + 'verilator_model',
-            '+bin=' + self.hexfile,
+            '+bin=' + self.binfile,
             '+jtag_port=' + str(CONTROL_PORT),
-            self.hexfile
+            self.binfile
         ]
 
         self.process = subprocess.Popen(verilator_args, stdout=subprocess.PIPE,
@@ -205,8 +208,8 @@ def jtag_idcode(_, target):
     """
     Validate response to IDCODE request
     """
-    hexfile = test_harness.build_program(['test_program.S'])
-    with JTAGTestFixture(hexfile) as fixture:
+    binfile = test_harness.build_program(['test_program.S'])
+    with JTAGTestFixture(binfile) as fixture:
         # Ensure the default instruction after reset is IDCODE
         fixture.jtag_transfer(INST_SAME, 32, 0xffffffff)
         fixture.expect_data(EXPECTED_IDCODE)
@@ -222,8 +225,8 @@ def jtag_reset(_, target):
     """
     Test transition to reset state
     """
-    hexfile = test_harness.build_program(['test_program.S'])
-    with JTAGTestFixture(hexfile) as fixture:
+    binfile = test_harness.build_program(['test_program.S'])
+    with JTAGTestFixture(binfile) as fixture:
         # Load a different instruction
         fixture.jtag_transfer(INST_TRANSFER_DATA, 32, 0x3b643e9a)
 
@@ -243,8 +246,8 @@ def jtag_bypass(_, target):
     Validate BYPASS instruction, which is a single bit data register
     We should get what we send, shifted by one bit.
     """
-    hexfile = test_harness.build_program(['test_program.S'])
-    with JTAGTestFixture(hexfile) as fixture:
+    binfile = test_harness.build_program(['test_program.S'])
+    with JTAGTestFixture(binfile) as fixture:
         value = 0x267521cf
         fixture.jtag_transfer(INST_BYPASS, 32, value)
         fixture.expect_data(value << 1)
@@ -256,8 +259,8 @@ def test_instruction_shift(_, target):
     Ensure instruction bits shifted into TDI come out TDO. This is necessary
     to properly chain JTAG devices together.
     """
-    hexfile = test_harness.build_program(['test_program.S'])
-    with JTAGTestFixture(hexfile) as fixture:
+    binfile = test_harness.build_program(['test_program.S'])
+    with JTAGTestFixture(binfile) as fixture:
         fixture.test_instruction_shift(0xf)
         fixture.test_instruction_shift(0xa)
         fixture.test_instruction_shift(0x5)
@@ -274,8 +277,8 @@ def jtag_data_transfer(_, target):
     one in, so we should see the previous value come out each time
     we write a new one.
     """
-    hexfile = test_harness.build_program(['test_program.S'])
-    with JTAGTestFixture(hexfile) as fixture:
+    binfile = test_harness.build_program(['test_program.S'])
+    with JTAGTestFixture(binfile) as fixture:
         fixture.jtag_transfer(INST_TRANSFER_DATA, 32, 0x4be49e7c)
         fixture.jtag_transfer(INST_SAME, 32, 0xb282dc16)
         fixture.expect_data(0x4be49e7c)
@@ -288,8 +291,8 @@ def jtag_inject(_, target):
     """
     Test instruction injection, with multiple threads
     """
-    hexfile = test_harness.build_program(['test_program.S'])
-    with JTAGTestFixture(hexfile) as fixture:
+    binfile = test_harness.build_program(['test_program.S'])
+    with JTAGTestFixture(binfile) as fixture:
         # Halt
         fixture.jtag_transfer(INST_CONTROL, 7, 0x1)
 
@@ -337,8 +340,8 @@ def jtag_read_write_pc(_, target):
     update the PC of the selected thread. This then resumes the thread
     to ensure it operates properly.
     """
-    hexfile = test_harness.build_program(['test_program.S'])
-    with JTAGTestFixture(hexfile) as fixture:
+    binfile = test_harness.build_program(['test_program.S'])
+    with JTAGTestFixture(binfile) as fixture:
         # Switch to thread 1, branch to new address
         fixture.jtag_transfer(INST_CONTROL, 7, 0x3)
         fixture.jtag_transfer(INST_TRANSFER_DATA, 32, 0x10e4)   # `jump_target`
@@ -24,7 +24,6 @@ import test_harness
 @test_harness.test
 def kernel_panic(_, target):
     test_harness.build_program(['panic.c'], image_type='user')
-    result = test_harness.run_kernel(target=target, timeout=240)
-    test_harness.check_result('panic.c', result)
+    test_harness.run_kernel(target=target, timeout=240, check_file='panic.c')
 
 test_harness.execute_tests()
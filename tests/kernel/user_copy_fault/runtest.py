@@ -24,7 +24,6 @@ import test_harness
 @test_harness.test
 def kernel_ucf(_, target):
     test_harness.build_program(['user_copy_fault.c'], image_type='user')
-    result = test_harness.run_kernel(target=target, timeout=240)
-    test_harness.check_result('user_copy_fault.c', result)
+    test_harness.run_kernel(target=target, timeout=240, check_file='user_copy_fault.c')
 
 test_harness.execute_tests()
@@ -15,7 +15,6 @@
 # limitations under the License.
 #
 
-import subprocess
 import sys
 
 sys.path.insert(0, '..')
@@ -30,26 +29,29 @@ def filesystem(_, target):
     will print 'PASS' if it is successful.
     '''
 
+    fs_image = test_harness.get_work_dir() + 'fsimage.bin'
     test_harness.build_program(['fs.c'])
-    subprocess.check_output(
-        [test_harness.PROJECT_TOP + '/bin/mkfs', 'obj/fsimage.bin',
-         'fstest.txt'], stderr=subprocess.STDOUT)
+    test_harness.build_filesystem(fs_image, ['fstest.txt'])
     result = test_harness.run_program(target='emulator',
-                                      block_device='obj/fsimage.bin')
+                                      block_device=fs_image,
+                                      sentinels=['PASS', 'FAIL'])
     if 'PASS' not in result or 'FAIL' in result:
         raise test_harness.TestException(
             'test program did not indicate pass\n' + result)
 
 
+def build_test(source_file):
+    test_harness.build_program([source_file])
+
+
 def run_test(source_file, target):
     test_harness.build_program([source_file])
-    result = test_harness.run_program(target)
-    test_harness.check_result(source_file, result)
+    test_harness.run_program(target, check_file=source_file)
 
 # hack: register all source files in this directory except for fs test,
 # which has special handling.
 test_list = [fname for fname in test_harness.find_files(
     ('.c', '.cpp')) if not fname.startswith('_')]
 test_list.remove('fs.c')
-test_harness.register_tests(run_test, test_list, ['emulator', 'fpga'])
+test_harness.register_tests(run_test, test_list, ['emulator', 'fpga'], build_test)
 test_harness.execute_tests()
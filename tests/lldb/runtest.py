@@ -23,6 +23,10 @@ import sys
 sys.path.insert(0, '..')
 import test_harness
 
+# This test uses a fixed network port
+test_harness.require_serial_execution()
+
+
 class EmulatorProcess(object):
 
     """
@@ -32,9 +36,9 @@ class EmulatorProcess(object):
     construct so it will automatically be torn down when the test is done.
     """
 
-    def __init__(self, hexfile):
-        self.hexfile = hexfile
-        self.elf_file = os.path.splitext(hexfile)[0] + '.elf'
+    def __init__(self, binfile):
+        self.binfile = binfile
+        self.elf_file = os.path.splitext(binfile)[0] + '.elf'
         self.output = None
         self.emulator_proc = None
         self.lldb_proc = None
@@ -47,7 +51,7 @@ class EmulatorProcess(object):
             '-m',
             'gdb',
             '-v',
-            self.hexfile
+            self.binfile
         ]
 
         if test_harness.DEBUG:
@@ -145,10 +149,10 @@ def parse_stack_crawl(response):
 def lldb(_, target):
     """This mainly validates that LLDB is reading symbols correctly."""
 
-    hexfile = test_harness.build_program(
+    binfile = test_harness.build_program(
         ['test_program.c'], opt_level='-O0', cflags=['-g'])
-    with EmulatorProcess(hexfile) as conn:
-        conn.send_command('file "obj/program.elf"')
+    with EmulatorProcess(binfile) as conn:
+        conn.send_command('file "' + test_harness.get_work_dir() + 'program.elf"')
         conn.send_command('gdb-remote 8000\n')
         response = conn.send_command(
             'breakpoint set --file test_program.c --line 27')
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# Copyright 2011-2015 Jeff Bush
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Combine the JSON reports written with --json by several test runs (usually
+the shards of a run split with --shard) into one report. This exits with a
+non-zero status if any test failed, if the same test/target pair appears
+in more than one report, or if a shard was supposed to run a test/target pair
+that isn't in any report.
+
+    ./merge_reports.py --json all.json --junit all.xml shard*.json
+"""
+
+import argparse
+import sys
+
+import test_report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json', dest='json_report', metavar='FILE',
+                        help='write the combined results to a JSON file')
+    parser.add_argument('--junit', dest='junit_report', metavar='FILE',
+                        help='write the combined results to a JUnit XML file')
+    parser.add_argument('--durations', metavar='FILE',
+                        help='update the test durations in this file with the results')
+    parser.add_argument('reports', nargs='+', help='JSON reports to combine')
+    args = parser.parse_args()
+
+    results = []
+    sources = {}
+    duplicates = []
+    expected = set()
+    for filename in args.reports:
+        expected.update(test_report.read_expected_results(filename))
+        for result in test_report.read_json_report(filename):
+            key = test_report.duration_key(result['directory'], result['name'],
+                                           result['target'])
+            if key in sources:
+                duplicates.append(key + ' is in ' + sources[key] + ' and ' + filename)
+            else:
+                sources[key] = filename
+                results.append(result)
+
+    if args.json_report:
+        test_report.write_json_report(args.json_report, results)
+
+    if args.junit_report:
+        test_report.write_junit_report(args.junit_report, 'all', results)
+
+    if args.durations:
+        test_report.save_durations(args.durations, results)
+
+    for message in duplicates:
+        print('Duplicate result: ' + message)
+
+    missing = sorted(expected - set(sources))
+    for key in missing:
+        print('Missing result: ' + key)
+
+    failing_tests = [result for result in results if not result['passed']]
+    if failing_tests:
+        print('Failing tests:')
+        for result in failing_tests:
+            print(result['directory'] + '/' + result['name'] + ' (' +
+                  result['target'] + ')')
+
+    print(str(len(failing_tests)) + '/' + str(len(results)) + ' tests failed')
+    if failing_tests or duplicates or missing:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -28,6 +28,9 @@ import time
 sys.path.insert(0, '..')
 import test_harness
 
+# These tests use fixed network ports
+test_harness.require_serial_execution()
+
 
 class DebugConnection(object):
 
@@ -126,8 +129,8 @@ class EmulatorProcess(object):
     can be used in the 'with' construct.
     """
 
-    def __init__(self, hexfile, num_cores=1):
-        self.hexfile = hexfile
+    def __init__(self, binfile, num_cores=1):
+        self.binfile = binfile
         self.num_cores = num_cores
         self.process = None
         self.output = None
@@ -139,7 +142,7 @@ class EmulatorProcess(object):
             'gdb',
             '-p',
             str(self.num_cores),
-            self.hexfile
+            self.binfile
         ]
 
         if test_harness.DEBUG:
@@ -164,8 +167,8 @@ def gdb_breakpoint(_, target):
     This sets two breakpoints
     """
 
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         # Set breakpoint
         conn.expect('Z0,0000000c', 'OK')
 
@@ -197,8 +200,8 @@ def gdb_breakpoint(_, target):
 
 @test_harness.test(['emulator'])
 def gdb_remove_breakpoint(_, target):
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         # Set breakpoint
         conn.expect('Z0,0000000c', 'OK')
 
@@ -220,8 +223,8 @@ def gdb_remove_breakpoint(_, target):
 
 @test_harness.test(['emulator'])
 def gdb_breakpoint_errors(_, target):
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         # Set invalid breakpoint (memory out of range)
         conn.expect('Z0,20000000', '')
 
@@ -238,8 +241,8 @@ def gdb_breakpoint_errors(_, target):
 
 @test_harness.test(['emulator'])
 def gdb_single_step(_, target):
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         # Read PC register
         conn.expect('g40', '00000000')
 
@@ -268,8 +271,8 @@ def gdb_single_step_breakpoint(_, target):
     Ensure that if you single step through a breakpoint, it doesn't
     trigger and get stuck
     """
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         # Set breakpoint at second instruction (address 0x8)
         conn.expect('Z0,00000004', 'OK')
 
@@ -289,8 +292,8 @@ def gdb_single_step_breakpoint(_, target):
 
 @test_harness.test(['emulator'])
 def gdb_read_write_memory(_, target):
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         # Read program code at address 0. This should match values
         # in count.hex
         conn.expect('m0,10', '0004000f0008000f000c000f0010000f')
@@ -329,8 +332,8 @@ def gdb_read_write_memory(_, target):
 
 @test_harness.test(['emulator'])
 def gdb_read_write_register(_, target):
-    hexfile = test_harness.build_program(['register_values.S'])
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['register_values.S'])
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         # Run code to load registers
         conn.expect('C', 'S05')
 
@@ -367,8 +370,8 @@ def gdb_read_write_register(_, target):
 
 @test_harness.test(['emulator'])
 def gdb_register_info(_, target):
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         # Scalar registers
         for idx in range(28):
             regid = str(idx + 1)
@@ -400,8 +403,8 @@ def gdb_register_info(_, target):
 
 @test_harness.test(['emulator'])
 def gdb_select_thread(_, target):
-    hexfile = test_harness.build_program(['multithreaded.S'], image_type='raw')
-    with EmulatorProcess(hexfile, num_cores=2), DebugConnection() as conn:
+    binfile = test_harness.build_program(['multithreaded.S'], image_type='raw')
+    with EmulatorProcess(binfile, num_cores=2), DebugConnection() as conn:
         # Read thread ID
         conn.expect('qC', 'QC01')
 
@@ -461,19 +464,19 @@ def gdb_select_thread(_, target):
 @test_harness.test(['emulator'])
 def gdb_thread_info(_, target):
     # Run with one core, four threads
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         conn.expect('qfThreadInfo', 'm1,2,3,4')
 
     # Run with two cores, eight threads
-    with EmulatorProcess(hexfile, num_cores=2), DebugConnection() as conn:
+    with EmulatorProcess(binfile, num_cores=2), DebugConnection() as conn:
         conn.expect('qfThreadInfo', 'm1,2,3,4,5,6,7,8')
 
 
 @test_harness.test(['emulator'])
 def gdb_invalid_command(_, target):
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         # As far as I know, this is not a valid commanconn...
         # An error response returns nothing in the body
         conn.expect('@', '')
@@ -482,8 +485,8 @@ def gdb_invalid_command(_, target):
 @test_harness.test(['emulator'])
 def gdb_big_command(_, target):
     """ Check for buffer overflows by sending a very large command"""
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         # Big, invalid command. this should return an error (empty response)
         conn.expect('x' * 0x10000, '')
 
@@ -495,8 +498,8 @@ def gdb_big_command(_, target):
 def gdb_queries(_, target):
     """Miscellaneous query commands not covered in other tests"""
 
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         conn.expect('qLaunchSuccess', 'OK')
         conn.expect('qHostInfo', 'triple:nyuzi;endian:little;ptrsize:4')
         conn.expect('qProcessInfo', 'pid:1')
@@ -510,8 +513,8 @@ def gdb_queries(_, target):
 
 @test_harness.test(['emulator'])
 def gdb_vcont(_, target):
-    hexfile = test_harness.build_program(['count.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['count.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         # Set breakpoint
         conn.expect('Z0,00000010', 'OK')
 
@@ -526,8 +529,8 @@ def gdb_vcont(_, target):
 
 @test_harness.test(['emulator'])
 def gdb_crash(_, target):
-    hexfile = test_harness.build_program(['crash.S'], image_type='raw')
-    with EmulatorProcess(hexfile), DebugConnection() as conn:
+    binfile = test_harness.build_program(['crash.S'], image_type='raw')
+    with EmulatorProcess(binfile), DebugConnection() as conn:
         conn.expect('c', 'S05')
         conn.expect('g40', '10000000')
 
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# Copyright 2011-2015 Jeff Bush
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Run the tests from every directory that has a runtest.py script in a single
+process, with one scheduler and one combined report. This accepts the same
+flags as runtest.py. Directory names on the command line select which
+directories to run (including ones skipped by default); other names select
+individual tests, either by name or by path relative to this directory.
+
+    ./runall.py -j 8
+    ./runall.py -j 8 core/isa core/mmu
+    ./runall.py --target emulator compiler/hello.c
+"""
+
+import os
+
+import test_harness
+
+# These are not run by default. See README.md for the reasons.
+SKIP_DIRS = [
+    'core/multicore',
+    'csmith',
+    'fail',
+    'fpga',
+    'kernel',
+    'lldb',
+    'stress/mmu'
+]
+
+# By default, only run the tests in these directories on some targets, to
+# keep the run time down. Maps a directory to a function that takes the name
+# and target of a test and returns whether to run it.
+DEFAULT_TARGETS = {
+    # Tests with 'noverilator' in the name take too long to run on the
+    # verilator model, so they run on the emulator instead. The others only
+    # run on the verilator model, which covers the hardware as well.
+    'compiler': lambda name, target: target == (
+        'emulator' if 'noverilator' in name else 'verilator')
+}
+
+
+def find_test_dirs():
+    """Return the paths of all directories under the tests directory that
+    contain a runtest.py script, relative to it, in sorted order."""
+
+    test_dirs = []
+    for dirpath, dirnames, filenames in os.walk(test_harness.TEST_DIR):
+        dirnames[:] = sorted(name for name in dirnames if name != 'obj')
+        if 'runtest.py' in filenames:
+            test_dirs.append(os.path.relpath(dirpath, test_harness.TEST_DIR))
+
+    return test_dirs
+
+
+def is_skipped(test_dir):
+    return any(test_dir == skip or test_dir.startswith(skip + '/')
+               for skip in SKIP_DIRS)
+
+
+def is_default_target(test_dir, name, target):
+    select = DEFAULT_TARGETS.get(test_dir)
+    return select is None or select(name, target)
+
+
+def main():
+    all_dirs = find_test_dirs()
+    selected_dirs = []
+    test_names = []
+    for name in test_harness.args.names:
+        path = os.path.normpath(name)
+        matching = [test_dir for test_dir in all_dirs
+                    if test_dir == path or test_dir.startswith(path + '/')]
+        if matching:
+            selected_dirs += [test_dir for test_dir in matching
+                              if test_dir not in selected_dirs]
+        else:
+            test_names.append(name)
+
+    if not selected_dirs:
+        selected_dirs = [test_dir for test_dir in all_dirs
+                         if not is_skipped(test_dir)]
+
+    # Only limit the targets for a full run. Naming tests, directories, or a
+    # target on the command line runs everything that matches.
+    target_filter = None
+    if not test_harness.args.names and not test_harness.args.target:
+        target_filter = is_default_target
+
+    test_harness.args.names = test_names
+    test_harness.execute_test_directories(
+        [os.path.join(test_harness.TEST_DIR, test_dir) for test_dir in selected_dirs],
+        target_filter)
+
+if __name__ == '__main__':
+    main()
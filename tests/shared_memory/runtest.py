@@ -69,12 +69,12 @@ def sharedmem_transact(memory, value):
 def shared_memory(_, target):
     """See coprocessor.c for an explanation of this test"""
 
-    test_harness.build_program(['coprocessor.c'])
+    binfile = test_harness.build_program(['coprocessor.c'])
 
     # Start the emulator
     memory_file = tempfile.NamedTemporaryFile()
     args = [test_harness.BIN_DIR + 'emulator', '-s',
-            memory_file.name, test_harness.HEX_FILE]
+            memory_file.name, binfile]
     process = subprocess.Popen(args, stdout=subprocess.PIPE,
                                stderr=subprocess.STDOUT)
 
@@ -20,7 +20,6 @@ Test load_sync/store_sync instructions by having four threads update
 variables round-robin.
 """
 
-import struct
 import sys
 
 sys.path.insert(0, '../..')
@@ -29,23 +28,15 @@ import test_harness
 
 @test_harness.test(['verilator'])
 def atomic(_, target):
+    dump_file = test_harness.get_work_dir() + 'vmem.bin'
     test_harness.build_program(['atomic.S'])
     test_harness.run_program(
         target=target,
-        dump_file='obj/vmem.bin',
+        dump_file=dump_file,
         dump_base=0x100000,
         dump_length=0x800,
         flush_l2=True)
 
-    with open('obj/vmem.bin', 'rb') as memfile:
-        for _ in range(512):
-            val = memfile.read(4)
-            if len(val) < 4:
-                raise test_harness.TestException('output file is truncated')
-
-            num_val, = struct.unpack('<L', val)
-            if num_val != 10:
-                raise test_harness.TestException(
-                    'FAIL: mismatch: ' + str(num_val))
+    test_harness.check_memory_dump(dump_file, [10] * 512, 0x100000)
 
 test_harness.execute_tests()
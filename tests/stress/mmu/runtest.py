@@ -21,7 +21,6 @@ to memory, then reading back the values to see if they match what is expected.
 More details are in random_access.S
 """
 
-import struct
 import sys
 
 sys.path.insert(0, '../..')
@@ -35,32 +34,24 @@ DUMP_BASE = 0x10000     # Physical address, is 4k in virtual address space
 
 @test_harness.test(['verilator'])
 def random_access_mmu_stress(_, target):
+    dump_file = test_harness.get_work_dir() + 'vmem.bin'
     test_harness.build_program(['random_access.S'])
     test_harness.run_program(
         target=target,
-        dump_file='obj/vmem.bin',
+        dump_file=dump_file,
         dump_base=DUMP_BASE,
         dump_length=MEMORY_SIZE * NUM_THREADS,
         timeout=240,
         flush_l2=True)
 
-    # Check that threads have written proper values
-    with open('obj/vmem.bin', 'rb') as memfile:
-        for page_num in range(int(MEMORY_SIZE / PAGE_SIZE)):
-            for thread_id in range(NUM_THREADS):
-                for page_offset in range(0, PAGE_SIZE, 4):
-                    val = memfile.read(4)
-                    if len(val) < 4:
-                        raise test_harness.TestException(
-                            'output file is truncated')
-
-                    num_val, = struct.unpack('<L', val)
-                    va = page_num * PAGE_SIZE + \
-                        page_offset + int(DUMP_BASE / 4)
-                    expected = (thread_id << 24) | va
-                    if num_val != expected:
-                        raise test_harness.TestException(
-                            'FAIL: mismatch @{:x} : got {:x} expected {:x}'.format((page_num * 4 + thread_id) * PAGE_SIZE,
-                                                                                   num_val, expected))
+    # Check that threads have written proper values. Each thread writes
+    # its ID and the virtual address into each word. Physical pages are
+    # interleaved between threads.
+    expected = ((thread_id << 24) | (page_num * PAGE_SIZE + page_offset
+                                     + DUMP_BASE // 4)
+                for page_num in range(MEMORY_SIZE // PAGE_SIZE)
+                for thread_id in range(NUM_THREADS)
+                for page_offset in range(0, PAGE_SIZE, 4))
+    test_harness.check_memory_dump(dump_file, expected, DUMP_BASE)
 
 test_harness.execute_tests()
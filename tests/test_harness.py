@@ -21,22 +21,47 @@ in subdirectories under this one.
 
 from __future__ import print_function
 import argparse
-import binascii
+import array
+import asyncio
+import codecs
+import collections
+import contextlib
+import functools
+import hashlib
+import importlib.util
+import io
+import mmap
+import multiprocessing
 import os
 import re
+import shutil
+import signal
 import subprocess
+import struct
 import sys
-import threading
+import time
 import traceback
 
+import test_report
+
 COMPILER_DIR = '/usr/local/llvm-nyuzi/bin/'
-PROJECT_TOP = os.path.normpath(
-    os.path.dirname(os.path.abspath(__file__)) + '/../')
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_TOP = os.path.normpath(TEST_DIR + '/../')
 LIB_DIR = PROJECT_TOP + '/software/libs/'
 BIN_DIR = PROJECT_TOP + '/bin/'
 OBJ_DIR = 'obj/'
-ELF_FILE = OBJ_DIR + 'program.elf'
-HEX_FILE = OBJ_DIR + 'program.hex'
+ELF_NAME = 'program.elf'
+HEX_NAME = 'program.hex'
+BIN_NAME = 'program.bin'
+BUILD_CACHE_DIR = TEST_DIR + '/obj/build-cache/'
+BUILD_CACHE_MAX_SIZE = 0x20000000
+
+# Change this when the harness changes how it builds programs (like the
+# conversion to a raw image), so older cache entries aren't reused.
+BUILD_CACHE_VERSION = 2
+DURATION_DB_FILE = TEST_DIR + '/obj/test-durations.json'
+DEPENDENCY_DB_FILE = TEST_DIR + '/obj/test-dependencies.json'
+KERNEL_SNAPSHOT_DIR = TEST_DIR + '/obj/kernel-snapshots/'
 ALL_TARGETS = ['verilator', 'emulator']
 DEFAULT_TARGETS = ['verilator', 'emulator']
 DEBUG = False
@@ -46,22 +71,335 @@ class TestException(Exception):
     """This exception is raised for test failures"""
     pass
 
+
+def _parse_shard(value):
+    """Parse the argument to --shard, which is of the form K/N"""
+
+    match = re.match(r'^(\d+)/(\d+)$', value)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(
+            'shard must be K/N, where 1 <= K <= N: ' + value)
+
+    return int(match.group(1)), int(match.group(2))
+
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--target', dest='target',
                     help='restrict to only executing tests on this target',
                     nargs=1)
 parser.add_argument('--debug', action='store_true',
                     help='enable verbose output to debug test failures')
+parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                    help='number of tests to run concurrently')
+parser.add_argument('--no-build-cache', dest='no_build_cache', action='store_true',
+                    help='always recompile programs instead of reusing cached builds')
+parser.add_argument('--no-trace-cache', dest='no_trace_cache', action='store_true',
+                    help='always run the verilator model in cosimulation tests instead of '
+                    'replaying cached traces')
+parser.add_argument('--no-emulator-server', dest='no_emulator_server', action='store_true',
+                    help='start a new emulator process for each program instead of '
+                    'reusing a server process')
+parser.add_argument('--no-kernel-snapshot', dest='no_kernel_snapshot', action='store_true',
+                    help='boot the kernel for every kernel test on the emulator instead of '
+                    'resuming from a snapshot')
+parser.add_argument('--randseed', dest='randseed', type=int,
+                    default=os.environ.get('RANDSEED'),
+                    help='seed for the random initial state of the verilator model '
+                    '(defaults to the RANDSEED environment variable, or the time)')
+parser.add_argument('--show-schedule', dest='show_schedule', action='store_true',
+                    help='print the predicted run time and critical path before running tests')
+parser.add_argument('--shard', dest='shard', metavar='K/N', type=_parse_shard,
+                    help='only run the Kth of N roughly equal parts of the selected tests')
+parser.add_argument('--durations', dest='durations', metavar='FILE',
+                    help='read and update test durations in this file (default '
+                    'obj/test-durations.json)')
+parser.add_argument('--dependencies', dest='dependencies', metavar='FILE',
+                    default=DEPENDENCY_DB_FILE,
+                    help='read and update test dependencies in this file')
+parser.add_argument('--changed-since', dest='changed_since', metavar='REV',
+                    help='only run tests that depend on files changed since this git revision')
+parser.add_argument('--json', dest='json_report', metavar='FILE',
+                    help='write test results and timing to a JSON file')
+parser.add_argument('--junit', dest='junit_report', metavar='FILE',
+                    help='write test results and timing to a JUnit XML file')
 parser.add_argument('names', nargs=argparse.REMAINDER,
                     help='names of specific tests to run')
 args = parser.parse_args()
 
-def build_program(source_files, image_type='bare-metal', opt_level='-O3', cflags=None):
+# Directory that holds intermediate files for the test that is currently
+# running. execute_tests points this at a unique subdirectory of OBJ_DIR for
+# each test/target pair.
+_work_dir = OBJ_DIR
+
+
+def get_work_dir():
+    """Return the directory that the current test should write files into.
+
+    Each (test, target) invocation gets its own directory, so tests can run
+    concurrently without overwriting each other's files, and the files from
+    a failed run remain available for inspection afterward.
+
+    Returns:
+            Relative path, with a trailing slash. The directory exists.
+    """
+
+    if not os.path.exists(_work_dir):
+        os.makedirs(_work_dir)
+
+    return _work_dir
+
+
+def _new_test_stats():
+    """Return a dictionary of statistics for a test invocation.
+
+    - compile_time: Seconds spent in build_program
+    - sim_time: Seconds spent waiting for simulator (or other) processes
+      supervised by supervise_process (run_test_with_timeout, etc.)
+    - peak_rss_kb: Largest peak resident set size of those processes, in KiB
+    - exit_status: Exit status of the last such process
+    - output_bytes: Total size of output from those processes
+    - stopped_early: True if run_program stopped the program because of a
+      sentinel or check_file, instead of waiting for it to exit
+    """
+
+    return {
+        'compile_time': 0.0,
+        'sim_time': 0.0,
+        'peak_rss_kb': 0,
+        'exit_status': None,
+        'output_bytes': 0,
+        'stopped_early': False
+    }
+
+# Statistics for the test that is currently running. execute_tests resets
+# this before each test.
+_test_stats = _new_test_stats()
+
+
+def _set_work_dir(param, target):
+    """Create an empty work directory for a test invocation and make it current"""
+
+    global _work_dir
+
+    # Characters that can't be in a file name are replaced, so different
+    # names (like a/b and a_b) can map to the same string. Add a hash of the
+    # original name to keep the directories separate.
+    name_hash = hashlib.sha256((param + '\0' + target).encode()).hexdigest()[:8]
+    _work_dir = OBJ_DIR + re.sub(r'[^\w.-]', '_', param + '_' + target) + '-' + \
+        name_hash + '/'
+    shutil.rmtree(_work_dir, ignore_errors=True)
+    os.makedirs(_work_dir)
+
+# Parts of the project that tests on each target use, in addition to the
+# files recorded while the test runs.
+TARGET_DEPENDENCIES = {
+    'emulator': ['tools/emulator/'],
+    'verilator': ['hardware/'],
+    'fpga': ['hardware/', 'tools/serial_boot/']
+}
+
+# Files and directories (relative to PROJECT_TOP, directories ending with a
+# slash) that the currently running test used. execute_tests records these
+# so --changed-since can tell which tests a change can affect.
+_test_dependencies = set()
+
+
+def add_dependency(path):
+    """Record that the result of the current test depends on a file or
+    directory, so it will be run with --changed-since when that changes.
+
+    build_program, run_program, and run_kernel record the files they use,
+    so this is only needed for other inputs.
+
+    Args:
+            path: Path to a file or directory. Files outside the project
+               (like the compiler) are ignored.
+
+    Returns:
+            Nothing
+
+    Raises:
+            Nothing
+    """
+
+    full_path = os.path.abspath(path)
+    rel_path = os.path.relpath(full_path, PROJECT_TOP)
+    if rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+        return
+
+    if os.path.isdir(full_path):
+        rel_path += '/'
+
+    _test_dependencies.add(rel_path)
+
+
+# Matches both C preprocessor and assembler include directives
+INCLUDE_RE = re.compile(rb'^\s*(?:#\s*include|\.include)\s+["<]([^">]+)[">]',
+                        re.MULTILINE)
+
+# Maps (path, modification time, size) to the SHA-256 digest of the file
+# contents, so files that many tests use (like libc.a) are only read once.
+_file_digests = {}
+
+
+def _file_digest(path):
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return 'missing'
+
+    key = (os.path.abspath(path), stat_result.st_mtime_ns, stat_result.st_size)
+    if key not in _file_digests:
+        with open(path, 'rb') as infile:
+            _file_digests[key] = hashlib.sha256(infile.read()).hexdigest()
+
+    return _file_digests[key]
+
+
+def _find_included_files(source_files, include_dirs):
+    """Return a sorted list of files that are transitively included by the
+    source files. Includes that can't be found in the directory of the
+    including file or include_dirs (for example, compiler builtin headers)
+    are ignored."""
+
+    found = set()
+    to_scan = list(source_files)
+    while to_scan:
+        path = to_scan.pop()
+        try:
+            with open(path, 'rb') as infile:
+                contents = infile.read()
+        except OSError:
+            continue
+
+        for match in INCLUDE_RE.finditer(contents):
+            name = match.group(1).decode(errors='replace')
+            for search_dir in [os.path.dirname(path)] + include_dirs:
+                candidate = os.path.normpath(os.path.join(search_dir, name))
+                if os.path.isfile(candidate):
+                    if candidate not in found:
+                        found.add(candidate)
+                        to_scan.append(candidate)
+
+                    break
+
+    return sorted(found)
+
+
+def _build_cache_key(compiler_args, input_files, link_files, tools):
+    """Compute a key that identifies the output of a build.
+
+    This covers the command line, the contents of source files and any
+    local files they include (input_files), the contents of libraries that
+    are linked in, and the size and timestamp of the toolchain executables
+    (which are too big to hash on every run).
+    """
+
+    key_hash = hashlib.sha256(str(BUILD_CACHE_VERSION).encode())
+    key_hash.update(os.getcwd().encode())  # Debug info records the build directory
+    key_hash.update(repr(compiler_args).encode())
+    for path in input_files + link_files:
+        key_hash.update((path + _file_digest(path)).encode())
+
+    for path in tools:
+        try:
+            stat_result = os.stat(path)
+            key_hash.update('{}{}{}'.format(path, stat_result.st_size,
+                                            stat_result.st_mtime_ns).encode())
+        except OSError:
+            key_hash.update((path + 'missing').encode())
+
+    return key_hash.hexdigest()
+
+
+def _fetch_cached_build(key, file_names, work_dir):
+    """Copy the files for a previous build into work_dir.
+
+    Returns:
+            True if the build was in the cache, False otherwise.
+    """
+
+    entry_dir = BUILD_CACHE_DIR + key + '/'
+    try:
+        for name in file_names:
+            shutil.copyfile(entry_dir + name, work_dir + name)
+
+        os.utime(entry_dir)  # Mark as recently used
+    except OSError:
+        return False
+
+    return True
+
+
+def _store_cached_build(key, file_names, work_dir):
+    """Add build output files in work_dir to the cache."""
+
+    entry_dir = BUILD_CACHE_DIR + key
+    temp_dir = entry_dir + '.tmp' + str(os.getpid())
+    try:
+        if not os.path.exists(temp_dir):
+            os.makedirs(temp_dir)
+
+        for name in file_names:
+            shutil.copyfile(work_dir + name, temp_dir + '/' + name)
+
+        # Renaming the directory makes the entry appear atomically to other
+        # test processes that are using the cache.
+        os.rename(temp_dir, entry_dir)
+    except OSError:
+        # Another process has already added this entry
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return
+
+    trim_cache(BUILD_CACHE_DIR, BUILD_CACHE_MAX_SIZE)
+
+
+def trim_cache(cache_dir, max_size):
+    """Delete the least recently used entries of a cache until its total
+    size is below max_size bytes.
+
+    Each entry is a directory of files in cache_dir. Using an entry must
+    update the modification time of its directory. Directories with .tmp
+    in their names are entries that are still being written.
+    """
+
+    entries = []
+    total_size = 0
+    for name in os.listdir(cache_dir):
+        if '.tmp' in name:
+            continue
+
+        entry_dir = cache_dir + name + '/'
+        try:
+            size = sum(os.path.getsize(entry_dir + filename)
+                       for filename in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+        except OSError:
+            continue    # Removed by another process
+
+        total_size += size
+
+    entries.sort()
+    for _, size, entry_dir in entries:
+        if total_size <= max_size:
+            break
+
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
+
+
+def build_program(source_files, image_type='bare-metal', opt_level='-O3', cflags=None,
+                  work_dir=None):
     """Compile/assemble one or more files.
 
     If there are .c files in the list, this will link in crt0, libc,
-    and libos. It converts the binary to a hex file that can be loaded
-    into memory.
+    and libos. It converts the program to a raw binary memory image that
+    the emulator and verilator model load directly (see elf_to_binary).
+
+    If the same program has been built before with identical sources,
+    flags, libraries, and compiler, this copies the previous output from
+    a cache in BUILD_CACHE_DIR instead of compiling again (unless
+    --no-build-cache was passed).
 
     Args:
             source_files: List of files, which can be C/C++ or assembly
@@ -72,113 +410,459 @@ def build_program(source_files, image_type='bare-metal', opt_level='-O3', cflags
                 - 'user', ELF binary linked at 0x1000, linked against kernel libs
             opt_level: Optimization level (-O0-3)
             cflags: Additional command line flags to pass to C compiler.
+            work_dir: Directory to write output files into. Defaults to
+              the work directory of the current test.
 
     Returns:
-            Name of hex file created
+            Name of memory image file created (ELF file for 'user' images)
 
     Raises:
             TestException if compilation failed, will contain compiler output
     """
     assert isinstance(source_files, list)
 
-    if not os.path.exists(OBJ_DIR):
-        os.makedirs(OBJ_DIR)
+    start_time = time.monotonic()
+    try:
+        return _compile_program(source_files, image_type, opt_level, cflags,
+                                work_dir or get_work_dir())
+    finally:
+        _test_stats['compile_time'] += time.monotonic() - start_time
 
-    compiler_args = [COMPILER_DIR + 'clang',
-                     '-o', ELF_FILE,
-                     '-w',
-                     opt_level]
 
+def _compile_program(source_files, image_type, opt_level, cflags, work_dir):
+    elf_file = work_dir + ELF_NAME
+    bin_file = work_dir + BIN_NAME
+    compiler_args = ['-w', opt_level]
     if cflags:
         compiler_args += cflags
 
+    link_files = []
     if image_type == 'raw':
         compiler_args += ['-Wl,--script,../one-segment.ld,--oformat,binary']
+        link_files += ['../one-segment.ld']
     elif image_type == 'user':
         compiler_args += ['-Wl,--image-base=0x1000']
 
     compiler_args += source_files
 
+    include_dirs = ['.'] + [flag[2:] for flag in compiler_args
+                            if flag.startswith('-I')]
     if any(name.endswith(('.c', '.cpp')) for name in source_files):
-        compiler_args += ['-I' + LIB_DIR + 'libc/include',
-                          '-I' + LIB_DIR + 'libos',
-                          LIB_DIR + 'libc/libc.a',
-                          LIB_DIR + 'compiler-rt/compiler-rt.a']
+        include_dirs += [LIB_DIR + 'libc/include', LIB_DIR + 'libos']
+        link_files += [LIB_DIR + 'libc/libc.a',
+                       LIB_DIR + 'compiler-rt/compiler-rt.a']
         if image_type == 'user':
-            compiler_args += [LIB_DIR + 'libos/crt0-kern.o',
-                              LIB_DIR + 'libos/libos-kern.a']
+            link_files += [LIB_DIR + 'libos/crt0-kern.o',
+                           LIB_DIR + 'libos/libos-kern.a']
         else:
-            compiler_args += [LIB_DIR + 'libos/crt0-bare.o',
-                              LIB_DIR + 'libos/libos-bare.a']
+            link_files += [LIB_DIR + 'libos/crt0-bare.o',
+                           LIB_DIR + 'libos/libos-bare.a']
 
-    try:
-        subprocess.check_output(compiler_args, stderr=subprocess.STDOUT)
-        if image_type == 'raw':
-            dump_hex(input_file=ELF_FILE, output_file=HEX_FILE)
-            return HEX_FILE
+        compiler_args += ['-I' + LIB_DIR + 'libc/include',
+                          '-I' + LIB_DIR + 'libos'] + link_files
 
-        if image_type == 'bare-metal':
-            subprocess.check_output([COMPILER_DIR + 'elf2hex', '-o', HEX_FILE, ELF_FILE],
-                                    stderr=subprocess.STDOUT)
-            return HEX_FILE
+    if image_type == 'user':
+        output_files = [ELF_NAME]
+    else:
+        output_files = [ELF_NAME, BIN_NAME]
+
+    included_files = _find_included_files(source_files, include_dirs)
+    for path in source_files + included_files:
+        add_dependency(path)
+
+    # Libraries are build products, so depend on their source directories.
+    # Linker scripts are source files.
+    for path in link_files:
+        if path.endswith('.ld'):
+            add_dependency(path)
+        else:
+            add_dependency(os.path.dirname(path))
 
-        return ELF_FILE
+    cache_key = None
+    if not args.no_build_cache:
+        cache_key = _build_cache_key(compiler_args, source_files + included_files,
+                                     link_files, [COMPILER_DIR + 'clang'])
+        if _fetch_cached_build(cache_key, output_files, work_dir):
+            if DEBUG:
+                print('Using cached build ' + cache_key)
+
+            return work_dir + output_files[-1]
+
+    try:
+        subprocess.check_output([COMPILER_DIR + 'clang', '-o', elf_file] + compiler_args,
+                                stderr=subprocess.STDOUT)
+        if image_type == 'raw':
+            shutil.copyfile(elf_file, bin_file)  # Already a flat binary
+        elif image_type == 'bare-metal':
+            elf_to_binary(input_file=elf_file, output_file=bin_file)
     except subprocess.CalledProcessError as exc:
         raise TestException('Compilation failed:\n' + exc.output.decode())
 
+    if cache_key:
+        _store_cached_build(cache_key, output_files, work_dir)
+
+    return work_dir + output_files[-1]
+
+
+ProcessResult = collections.namedtuple('ProcessResult', [
+    'output', 'returncode', 'timed_out', 'stopped'])
+
+
+def _kill_process_group(process):
+    """Kill a process and, if it is the leader of a process group (it was
+    started with start_new_session=True), everything else in the group, so
+    programs it started don't outlive it."""
+
+    try:
+        if os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass  # Already exited
+
+
+async def supervise_process(process, timeout, output_callback=None):
+    """Wait for a process to finish, collecting its output as it arrives.
 
-class TimedProcessRunner(threading.Thread):
+    This runs in an asyncio event loop, so one loop can supervise many
+    processes at once (for example, with asyncio.gather). The process must
+    have been started with stdout=subprocess.PIPE and must not have been
+    waited for already.
 
+    Args:
+            process: subprocess.Popen object.
+            timeout: Seconds to wait before killing the process.
+            output_callback: Optional function that is called with each
+              chunk of output (bytes) as it is read. If it returns True, the
+              process is killed without waiting for it to finish.
+
+    Returns:
+            ProcessResult with all of the output (bytes), the exit status
+            (negative if killed by a signal), whether the process timed out,
+            and whether output_callback stopped it.
+
+    Raises:
+            Any exception raised by output_callback, after the process has
+            been killed.
     """
-    Wrapper calls communicate on a process, but throws exception if it
-    takes too long
+
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    deadline = start_time + timeout
+    output = bytearray()
+    output_done = loop.create_future()
+    stopped = False
+    timed_out = False
+    callback_error = None
+
+    def read_output():
+        nonlocal stopped, callback_error
+        try:
+            chunk = os.read(output_fd, 0x10000)
+        except BlockingIOError:
+            return
+
+        if not chunk:
+            loop.remove_reader(output_fd)
+            output_done.set_result(None)
+            return
+
+        output.extend(chunk)
+        if output_callback and not stopped:
+            try:
+                stopped = bool(output_callback(chunk))
+            except Exception as exc:  # pylint: disable=W0703
+                # Re-raised once the process has been cleaned up
+                callback_error = exc
+                stopped = True
+
+            if stopped:
+                _kill_process_group(process)
+
+    output_fd = process.stdout.fileno()
+    os.set_blocking(output_fd, False)
+    loop.add_reader(output_fd, read_output)
+    try:
+        await asyncio.wait([output_done], timeout=timeout)
+        if not output_done.done():
+            timed_out = True
+            _kill_process_group(process)
+            await output_done
+    finally:
+        if not output_done.done():
+            loop.remove_reader(output_fd)
+
+    # Reap the process here rather than letting asyncio do it, so the
+    # resource usage is available. A process can close its output before
+    # exiting, so this still needs to enforce the timeout.
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            break
+
+        if not timed_out and loop.time() > deadline:
+            timed_out = True
+            _kill_process_group(process)
+
+        await asyncio.sleep(0.01)
+
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+
+    process.stdout.close()
+    _test_stats['sim_time'] += loop.time() - start_time
+    _test_stats['peak_rss_kb'] = max(_test_stats['peak_rss_kb'], usage.ru_maxrss)
+    _test_stats['exit_status'] = process.returncode
+    _test_stats['output_bytes'] += len(output)
+    if callback_error:
+        raise callback_error
+
+    return ProcessResult(bytes(output), process.returncode, timed_out, stopped)
+
+
+async def run_process(args, timeout, output_callback=None):
+    """Start a program in a new process group and wait for it with
+    supervise_process. Its standard error is combined with its output.
+
+    Returns:
+            ProcessResult (see supervise_process)
     """
 
-    def __init__(self):
-        threading.Thread.__init__(self)
-        self.finished = threading.Event()
-        self.daemon = True  # Kill watchdog if we exit
-        self.process = None
-        self.timeout = 0
-
-    def communicate(self, process, timeout):
-        """Call process.communicate(), but throw exception if it has not completed
-        before 'timeout' seconds have elapsed"""
-
-        self.timeout = timeout
-        self.process = process
-        self.start()  # Start watchdog
-        result = self.process.communicate()
-        if self.finished.is_set():
-            raise TestException('Test timed out')
-        else:
-            self.finished.set()  # Stop watchdog
+    process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT,
+                               start_new_session=True)
+    return await supervise_process(process, timeout, output_callback)
 
-        if self.process.poll():
-            # Non-zero return code. Probably target program crash.
-            raise TestException(
-                'Process returned error: ' + result[0].decode())
 
-        return result
+def _check_process_result(result):
+    if result.timed_out:
+        raise TestException('Test timed out')
+
+    if result.returncode and not result.stopped:
+        # Non-zero return code. Probably target program crash.
+        raise TestException(
+            'Process returned error: ' + result.output.decode())
+
 
-    # Watchdog thread kills process if it runs too long
-    def run(self):
-        if not self.finished.wait(self.timeout):
-            # Timed out
-            self.finished.set()
-            self.process.kill()
+def wait_for_process(process, timeout, output_callback=None):
+    """Wait for a process started with stdout=subprocess.PIPE to finish. If
+    it does not complete in 'timeout' seconds, kill it and throw a
+    TestException.
 
+    Returns:
+            Output from the process, as bytes.
 
-def run_test_with_timeout(args, timeout):
+    Raises:
+            TestException if the process timed out or returned a non-zero
+            status.
+    """
+
+    result = asyncio.run(supervise_process(process, timeout, output_callback))
+    _check_process_result(result)
+    return result.output
+
+
+def run_test_with_timeout(args, timeout, output_callback=None):
     """
     Run the program specified by args. If it does not complete
-    in 'timeout' seconds, throw a TestException.
+    in 'timeout' seconds, throw a TestException. If output_callback is
+    passed, it is called with output as it arrives, and can stop the
+    program by returning True (see supervise_process).
     """
 
-    process = subprocess.Popen(args, stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT)
-    output, _ = TimedProcessRunner().communicate(process, timeout)
-    return output.decode()
+    result = asyncio.run(run_process(args, timeout, output_callback))
+    _check_process_result(result)
+    return result.output.decode()
+
+
+class EmulatorServer(object):
+    """An emulator process running in server mode (emulator -m server),
+    which runs one program after another on request.
+
+    Starting an emulator process and initializing its memory takes longer
+    than running most test programs. The server does that once, then forks
+    a copy of its initial state for each program, so every program still
+    starts from a clean processor. See tools/emulator/server.c for the
+    protocol.
+    """
+
+    # Extra time to wait for a response after asking the server to kill a
+    # program, before giving up on the server.
+    KILL_TIMEOUT = 5
+
+    def __init__(self):
+        self.process = subprocess.Popen([BIN_DIR + 'emulator', '-m', 'server'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        start_new_session=True)
+        self.pid = os.getpid()
+        self.input = bytearray()
+        self.failed = False
+
+    def is_usable(self):
+        """Return False if the server has failed or was started by another
+        process (this process was forked from it)."""
+
+        return (not self.failed and self.pid == os.getpid()
+                and self.process.poll() is None)
+
+    def close(self):
+        """Shut down the server, and any program it is running."""
+
+        _kill_process_group(self.process)
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+    def _send(self, line):
+        self.process.stdin.write(line.encode() + b'\n')
+        self.process.stdin.flush()
+
+    async def run(self, args, timeout, output_callback=None):
+        """Run a program, like supervise_process.
+
+        Args:
+                args: Arguments for the emulator, not including the executable
+                  name. Only the options -a, -b, -d, and -v are supported.
+                  Paths must be absolute.
+                timeout: Seconds to wait before killing the program.
+                output_callback: See supervise_process.
+
+        Returns:
+                ProcessResult
+
+        Raises:
+                TestException if the server stopped responding. The server
+                is shut down and is no longer usable.
+        """
+
+        if any(('\t' in arg or '\n' in arg) for arg in args):
+            raise TestException('Invalid emulator server argument')
+
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        output = bytearray()
+        exit_info = loop.create_future()
+        stopped = False
+        timed_out = False
+        callback_error = None
+
+        def stop_program():
+            try:
+                self._send('kill')
+            except OSError:
+                pass  # Server exited, handled below
+
+        def read_responses():
+            nonlocal stopped, callback_error
+            try:
+                data = os.read(output_fd, 0x10000)
+            except BlockingIOError:
+                return
+
+            if not data:
+                loop.remove_reader(output_fd)
+                if not exit_info.done():
+                    exit_info.set_exception(TestException(
+                        'Emulator server exited unexpectedly'))
+
+                return
+
+            self.input.extend(data)
+            while not exit_info.done():
+                header_end = self.input.find(b'\n')
+                if header_end < 0:
+                    break
+
+                fields = self.input[:header_end].split() or [b'']
+                if fields[0] == b'output':
+                    chunk_end = header_end + 1 + int(fields[1])
+                    if len(self.input) < chunk_end:
+                        break
+
+                    chunk = bytes(self.input[header_end + 1:chunk_end])
+                    del self.input[:chunk_end]
+                    output.extend(chunk)
+                    if output_callback and not stopped:
+                        try:
+                            stopped = bool(output_callback(chunk))
+                        except Exception as exc:  # pylint: disable=W0703
+                            # Re-raised once the program has been stopped
+                            callback_error = exc
+                            stopped = True
+
+                        if stopped:
+                            stop_program()
+                elif fields[0] == b'exit':
+                    del self.input[:header_end + 1]
+                    exit_info.set_result((int(fields[1]), int(fields[2])))
+                else:
+                    exit_info.set_exception(TestException(
+                        'Bad response from emulator server: ' +
+                        fields[0].decode(errors='replace')))
+
+        output_fd = self.process.stdout.fileno()
+        os.set_blocking(output_fd, False)
+        loop.add_reader(output_fd, read_responses)
+        try:
+            self._send('run\t' + '\t'.join(args))
+            await asyncio.wait([exit_info], timeout=timeout)
+            if not exit_info.done():
+                timed_out = True
+                stop_program()
+                await asyncio.wait([exit_info], timeout=self.KILL_TIMEOUT)
+                if not exit_info.done():
+                    raise TestException('Emulator server is not responding')
+
+            returncode, peak_rss_kb = exit_info.result()
+        except OSError as exc:
+            self.failed = True
+            self.close()
+            raise TestException('Emulator server failed: ' + str(exc))
+        except TestException:
+            self.failed = True
+            self.close()
+            raise
+        finally:
+            loop.remove_reader(output_fd)
+
+        _test_stats['sim_time'] += loop.time() - start_time
+        _test_stats['peak_rss_kb'] = max(_test_stats['peak_rss_kb'], peak_rss_kb)
+        _test_stats['exit_status'] = returncode
+        _test_stats['output_bytes'] += len(output)
+        if callback_error:
+            raise callback_error
+
+        return ProcessResult(bytes(output), returncode, timed_out, stopped)
+
+
+# Emulator server for this process, started the first time it is needed.
+# Each pool worker has its own.
+_emulator_server = None
+
+
+def _use_emulator_server():
+    return not args.no_emulator_server
+
+
+def _run_on_emulator_server(emulator_args, timeout, output_callback):
+    """Like _run_target_program, but run the program on the emulator server
+    for this process."""
+
+    global _emulator_server
+
+    if _emulator_server is None or not _emulator_server.is_usable():
+        _emulator_server = EmulatorServer()
+
+    result = asyncio.run(_emulator_server.run(emulator_args, timeout, output_callback))
+    _check_process_result(result)
+    if result.stopped:
+        _test_stats['stopped_early'] = True
+
+    return result.output.decode(), result.stopped
 
 
 def reset_fpga():
@@ -191,6 +875,16 @@ def reset_fpga():
     input('\nReset FPGA board and press enter')
 
 
+def get_verilator_seed_args():
+    """Return the command line arguments that set the random seed of the
+    verilator model to the one passed with --randseed, if any."""
+
+    if args.randseed is None:
+        return []
+
+    return ['+randseed=' + str(args.randseed)]
+
+
 def run_program(
         target='emulator',
         block_device=None,
@@ -200,10 +894,14 @@ def run_program(
         timeout=60,
         flush_l2=False,
         trace=False,
-        executable=None):
+        executable=None,
+        work_dir=None,
+        check_file=None,
+        sentinels=None):
     """Run test program.
 
-    This uses the hex file produced by build_program.
+    This uses the raw binary image (program.bin) produced by build_program.
+    The FPGA target converts it to a hex file for the serial boot loader.
 
     Args:
             target: Which target will run the program. Can be 'verilator'
@@ -215,6 +913,19 @@ def run_program(
             dump_base: if dump_file is specified, base physical memory address to start
                writing mempry from.
             dump_length: number of bytes of memory to write to dump_file
+            executable: Path of the image to run. Defaults to the binary
+               image that build_program wrote into work_dir.
+            work_dir: Directory containing the program built by
+               build_program. Defaults to the work directory of the current
+               test.
+            check_file: Source file with CHECK: patterns (see check_result)
+               to match the output against while the program runs. The
+               program is stopped as soon as all of them have been found.
+            sentinels: List of regular expressions (str or bytes) that mark
+               the end of the test, like ['PASS', 'FAIL']. The program is
+               stopped as soon as a line of output matches one of them,
+               rather than waiting for it to halt. The caller still needs
+               to check the output for the result.
 
     Returns:
             Output from program, anything written to virtual serial device,
@@ -222,23 +933,42 @@ def run_program(
 
     Raises:
             TestException if emulated program crashes or the program cannot
-              execute for some other reason.
+              execute for some other reason, or if the output doesn't match
+              check_file.
     """
+    matcher = CheckMatcher(check_file) if check_file else None
+    watcher = _SentinelWatcher(sentinels) if sentinels else None
+    def check_output(chunk):
+        # Evaluate both, so the matcher sees all output
+        matched = matcher.feed(chunk) if matcher else False
+        if watcher and watcher.feed(chunk):
+            matched = True
+
+        # Memory is dumped when the program exits, so don't stop it early
+        return matched and not dump_file
+
+    output_callback = check_output if matcher or watcher else None
+
     if not executable:
-        executable = HEX_FILE
+        executable = (work_dir or get_work_dir()) + BIN_NAME
 
     if target == 'emulator':
+        # Paths are absolute because the emulator server may have been
+        # started in a different directory.
         args = [BIN_DIR + 'emulator']
         args += ['-a']  # Enable thread scheduling randomization by default
         if block_device:
-            args += ['-b', block_device]
+            args += ['-b', os.path.abspath(block_device)]
 
         if dump_file:
-            args += ['-d', dump_file + ',' +
+            args += ['-d', os.path.abspath(dump_file) + ',' +
                      hex(dump_base) + ',' + hex(dump_length)]
 
-        args += [executable]
-        output = run_test_with_timeout(args, timeout)
+        args += [os.path.abspath(executable)]
+        if _use_emulator_server():
+            output, _ = _run_on_emulator_server(args[1:], timeout, output_callback)
+        else:
+            output, _ = _run_target_program(args, timeout, output_callback)
     elif target == 'verilator':
         args = [BIN_DIR + 'verilator_model']
         if block_device:
@@ -255,9 +985,10 @@ def run_program(
         if trace:
             args += ['+trace']
 
+        args += get_verilator_seed_args()
         args += ['+bin=' + executable]
-        output = run_test_with_timeout(args, timeout)
-        if '***HALTED***' not in output:
+        output, stopped = _run_target_program(args, timeout, output_callback)
+        if not stopped and '***HALTED***' not in output:
             raise TestException(output + '\nProgram did not halt normally')
     elif target == 'fpga':
         if block_device:
@@ -273,6 +1004,12 @@ def run_program(
             raise TestException(
                 'Need to set SERIAL_PORT to device path in environment')
 
+        # The serial boot loader only reads hex files
+        if executable.endswith('.bin'):
+            hex_file = os.path.splitext(executable)[0] + '.hex'
+            dump_hex(input_file=executable, output_file=hex_file)
+            executable = hex_file
+
         args = [
             BIN_DIR + 'serial_boot',
             os.environ['SERIAL_PORT'],
@@ -281,42 +1018,95 @@ def run_program(
 
         reset_fpga()
 
-        output = run_test_with_timeout(args, timeout)
+        output, _ = _run_target_program(args, timeout, output_callback)
     else:
         raise TestException('Unknown execution target')
 
     if DEBUG:
         print('Program Output:\n' + output)
 
+    if matcher:
+        matcher.finish()
+
     return output
 
 
+def _run_target_program(args, timeout, output_callback):
+    """Like run_test_with_timeout, but also returns whether output_callback
+    stopped the program."""
+
+    result = asyncio.run(run_process(args, timeout, output_callback))
+    _check_process_result(result)
+    if result.stopped:
+        _test_stats['stopped_early'] = True
+
+    return result.output.decode(), result.stopped
+
+
+class _SentinelWatcher(object):
+
+    """Output callback that reports when a complete line of output matches
+    one of a list of regular expressions."""
+
+    def __init__(self, sentinels):
+        self.regexps = [re.compile(pattern.encode() if isinstance(pattern, str)
+                                   else pattern) for pattern in sentinels]
+        self.partial_line = b''
+
+    def feed(self, chunk):
+        text = self.partial_line + chunk
+        line_end = text.rfind(b'\n') + 1
+        self.partial_line = text[line_end:]
+        return any(regexp.search(text, 0, line_end) for regexp in self.regexps)
+
+
 def run_kernel(
         target='emulator',
-        timeout=60):
+        timeout=60,
+        work_dir=None,
+        check_file=None):
     """Run test program as a user space program under the kernel.
 
     This uses the elf file produced by build_program. The kernel reads
     the file 'program.elf' from the filesystem. This will build a filesystem
     with that image automatically.
 
+    On the emulator, this resumes from a snapshot of the booted kernel
+    (see _get_kernel_snapshot) rather than booting it each time, unless
+    --no-kernel-snapshot was passed.
+
     Args:
             target: Which target to execute on. Can be 'verilator'
                or 'emulator'.
+            work_dir: Directory containing the program built by
+               build_program. The filesystem image is also written here.
+               Defaults to the work directory of the current test.
+            check_file: Source file with CHECK: patterns to match the output
+               against while it runs (see run_program).
 
     Returns:
             Output from program, anything written to virtual serial device
 
     Raises:
             TestException if emulated program crashes or the program cannot
-              execute for some other reason.
+              execute for some other reason, or if the output doesn't match
+              check_file.
     """
-    block_file = OBJ_DIR + 'fsimage.bin'
-    subprocess.check_output([BIN_DIR + 'mkfs', block_file, ELF_FILE],
-                            stderr=subprocess.STDOUT)
+    if not work_dir:
+        work_dir = get_work_dir()
 
-    output = run_program(target=target, block_device=block_file,
-                       timeout=timeout, executable=PROJECT_TOP + '/software/kernel/kernel.hex')
+    add_dependency(PROJECT_TOP + '/software/kernel')
+    block_file = work_dir + 'fsimage.bin'
+    build_filesystem(block_file, [work_dir + ELF_NAME])
+
+    executable = PROJECT_TOP + '/software/kernel/kernel.hex'
+    boot_output = ''
+    if target == 'emulator' and not args.no_kernel_snapshot:
+        executable, boot_output = _get_kernel_snapshot(executable, timeout)
+
+    output = boot_output + run_program(target=target, block_device=block_file,
+                                       timeout=timeout, executable=executable,
+                                       check_file=check_file)
 
     if DEBUG:
         print('Program Output:\n' + output)
@@ -324,6 +1114,126 @@ def run_kernel(
     return output
 
 
+FS_MAGIC = b'spfs'
+FS_BLOCK_SIZE = 512
+FS_NAME_LENGTH = 32
+FS_HEADER = struct.Struct('<4sI')
+FS_DIRECTORY_ENTRY = struct.Struct('<II{}s'.format(FS_NAME_LENGTH))
+
+
+def build_filesystem(output_file, source_files):
+    """Create a filesystem image that contains the given files, which the
+    kernel and libos can read from the block device. This is the same format
+    that tools/mkfs creates: a directory followed by the file contents, each
+    starting on a block boundary. Files are stored under their base names.
+
+    Like build_program, this reuses an identical image from the build cache
+    if one exists (unless --no-build-cache was passed). The key is the names
+    and contents of the files.
+    """
+
+    for path in source_files:
+        add_dependency(path)
+
+    cache_key = None
+    out_dir, out_name = os.path.split(os.path.abspath(output_file))
+    out_dir += '/'
+    if not args.no_build_cache:
+        key_hash = hashlib.sha256(b'filesystem')
+        for path in source_files:
+            key_hash.update((os.path.basename(path) + _file_digest(path)).encode())
+
+        cache_key = key_hash.hexdigest()
+        if _fetch_cached_build(cache_key, [out_name], out_dir):
+            return
+
+    offset = _round_up(FS_HEADER.size + FS_DIRECTORY_ENTRY.size * len(source_files),
+                       FS_BLOCK_SIZE)
+    directory = FS_HEADER.pack(FS_MAGIC, len(source_files))
+    contents = []
+    for path in source_files:
+        with open(path, 'rb') as infile:
+            data = infile.read()
+
+        # Names that are too long keep the last characters, like mkfs
+        name = os.path.basename(path).encode()[-FS_NAME_LENGTH:]
+        directory += FS_DIRECTORY_ENTRY.pack(offset, len(data), name)
+        contents.append((offset, data))
+        offset = _round_up(offset + len(data), FS_BLOCK_SIZE)
+
+    with open(output_file, 'wb') as outfile:
+        outfile.write(directory)
+        for offset, data in contents:
+            outfile.write(bytes(offset - outfile.tell()))
+            outfile.write(data)
+
+    if cache_key:
+        _store_cached_build(cache_key, [out_name], out_dir)
+
+
+def _round_up(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def _get_kernel_snapshot(kernel_image, timeout):
+    """Return a snapshot of the emulator state after booting the kernel,
+    just before it first reads the filesystem, creating it if needed.
+
+    Since the kernel hasn't read the block device at that point, the same
+    snapshot works with the filesystem image for any test. Snapshots are
+    kept in KERNEL_SNAPSHOT_DIR, keyed by the contents of the kernel image
+    and the emulator version. Only the most recent one is kept.
+
+    Returns:
+            Tuple of the snapshot file name and the output of the kernel
+            up to that point.
+    """
+
+    emulator = BIN_DIR + 'emulator'
+    key_hash = hashlib.sha256()
+    key_hash.update(_file_digest(kernel_image).encode())
+    stat_result = os.stat(emulator)
+    key_hash.update('{}{}'.format(stat_result.st_size, stat_result.st_mtime_ns).encode())
+    key = key_hash.hexdigest()
+    snapshot_file = KERNEL_SNAPSHOT_DIR + key + '.snap'
+    output_file = os.path.splitext(snapshot_file)[0] + '.out'
+    try:
+        with open(output_file, 'r') as infile:
+            if os.path.exists(snapshot_file):
+                return snapshot_file, infile.read()
+    except OSError:
+        pass
+
+    if not os.path.exists(KERNEL_SNAPSHOT_DIR):
+        os.makedirs(KERNEL_SNAPSHOT_DIR, exist_ok=True)
+
+    # Concurrent tests may create the same snapshot. Write to temporary
+    # files and rename them, so none sees a partially written one.
+    temp_suffix = '.tmp' + str(os.getpid())
+    output = run_test_with_timeout([emulator, '-w', snapshot_file + temp_suffix,
+                                    kernel_image], timeout)
+    with open(output_file + temp_suffix, 'w') as outfile:
+        outfile.write(output)
+
+    for filename in os.listdir(KERNEL_SNAPSHOT_DIR):
+        if '.tmp' not in filename and not filename.startswith(key):
+            try:
+                os.remove(KERNEL_SNAPSHOT_DIR + filename)
+            except OSError:
+                pass    # Removed by another process
+
+    os.replace(snapshot_file + temp_suffix, snapshot_file)
+    os.replace(output_file + temp_suffix, output_file)
+    return snapshot_file, output
+
+
+# Granularity of assert_files_equal mismatch reports
+WORD_SIZE = 4
+CACHE_LINE_SIZE = 64
+MAX_MISMATCH_RANGES = 16
+MAX_MISMATCH_CONTEXT = 4
+
+
 def assert_files_equal(file1, file2, error_msg='file mismatch'):
     """Read two files and throw a TestException if they are not the same
 
@@ -336,59 +1246,196 @@ def assert_files_equal(file1, file2, error_msg='file mismatch'):
             Nothing
 
     Raises:
-            TestException if the files don't match. Exception test contains
-            details about where the mismatch occurred.
+            TestException if the files don't match. The exception text
+            contains the number of 32-bit words and cache lines that differ,
+            the ranges of differing words, and a hex dump of the first few
+            differences.
     """
 
-    bufsize = 0x1000
-    block_offset = 0
-    with open(file1, 'rb') as fp1, open(file2, 'rb') as fp2:
-        while True:
-            block1 = bytearray(fp1.read(bufsize))
-            block2 = bytearray(fp2.read(bufsize))
-            if len(block1) < len(block2):
-                raise TestException(error_msg + ': file1 shorter than file2')
-            elif len(block1) > len(block2):
-                raise TestException(error_msg + ': file1 longer than file2')
-
-            if block1 != block2:
-                for offset, (val1, val2) in enumerate(zip(block1, block2)):
-                    if val1 != val2:
-                        # Show the difference
-                        exception_text = error_msg + ':\n'
-                        rounded_offset = offset & ~15
-                        exception_text += '{:08x} '.format(block_offset +
-                                                           rounded_offset)
-                        for lineoffs in range(16):
-                            exception_text += '{:02x}'.format(
-                                block1[rounded_offset + lineoffs])
-
-                        exception_text += '\n{:08x} '.format(
-                            block_offset + rounded_offset)
-                        for lineoffs in range(16):
-                            exception_text += '{:02x}'.format(
-                                block2[rounded_offset + lineoffs])
-
-                        exception_text += '\n         '
-                        for lineoffs in range(16):
-                            if block1[rounded_offset + lineoffs] \
-                                    != block2[rounded_offset + lineoffs]:
-                                exception_text += '^^'
-                            else:
-                                exception_text += '  '
-
-                        raise TestException(exception_text)
-
-            if not block1:
-                return
+    size1 = os.path.getsize(file1)
+    size2 = os.path.getsize(file2)
+    if size1 < size2:
+        raise TestException(error_msg + ': file1 shorter than file2')
+    elif size1 > size2:
+        raise TestException(error_msg + ': file1 longer than file2')
+    elif size1 == 0:
+        return  # Can't mmap an empty file
+
+    with open(file1, 'rb') as fp1, open(file2, 'rb') as fp2, \
+            mmap.mmap(fp1.fileno(), 0, access=mmap.ACCESS_READ) as data1, \
+            mmap.mmap(fp2.fileno(), 0, access=mmap.ACCESS_READ) as data2:
+        mismatches = _find_mismatched_words(data1, data2)
+        if mismatches:
+            raise TestException(_describe_mismatches(data1, data2, mismatches,
+                                                     error_msg))
+
+
+def _find_mismatched_words(data1, data2):
+    """Return a sorted list of the offsets of words that differ between two
+    buffers of the same length.
+
+    Comparing slices is done in C, so this narrows the search down by
+    comparing large chunks, then cache lines within chunks that differ, and
+    only compares individual words within cache lines that differ.
+    """
+
+    chunk_size = 0x100000
+    length = len(data1)
+    mismatches = []
+    for chunk_start in range(0, length, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, length)
+        if data1[chunk_start:chunk_end] == data2[chunk_start:chunk_end]:
+            continue
+
+        for line_start in range(chunk_start, chunk_end, CACHE_LINE_SIZE):
+            line_end = min(line_start + CACHE_LINE_SIZE, chunk_end)
+            if data1[line_start:line_end] == data2[line_start:line_end]:
+                continue
+
+            for word_start in range(line_start, line_end, WORD_SIZE):
+                word_end = word_start + WORD_SIZE
+                if data1[word_start:word_end] != data2[word_start:word_end]:
+                    mismatches.append(word_start)
+
+    return mismatches
+
+
+def _describe_mismatches(data1, data2, mismatches, error_msg):
+    num_lines = len(set(offset // CACHE_LINE_SIZE for offset in mismatches))
+    text = error_msg + ': {} words differ in {} cache lines\n'.format(
+        len(mismatches), num_lines)
+
+    # Combine adjacent words into ranges
+    ranges = []
+    for offset in mismatches:
+        if ranges and ranges[-1][1] == offset:
+            ranges[-1][1] = offset + WORD_SIZE
+        else:
+            ranges.append([offset, offset + WORD_SIZE])
+
+    text += 'differing ranges:\n'
+    for start, end in ranges[:MAX_MISMATCH_RANGES]:
+        text += '  {:08x}-{:08x} ({} words)\n'.format(
+            start, min(end, len(data1)) - 1, (end - start) // WORD_SIZE)
+
+    if len(ranges) > MAX_MISMATCH_RANGES:
+        text += '  ...{} more\n'.format(len(ranges) - MAX_MISMATCH_RANGES)
+
+    # Show the first few differences
+    rows = sorted(set(offset & ~15 for offset in mismatches))
+    for row_offset in rows[:MAX_MISMATCH_CONTEXT]:
+        row1 = data1[row_offset:row_offset + 16]
+        row2 = data2[row_offset:row_offset + 16]
+        text += '{:08x} {}\n'.format(row_offset, row1.hex())
+        text += '{:08x} {}\n'.format(row_offset, row2.hex())
+        text += '         ' + ''.join('^^' if val1 != val2 else '  '
+                                      for val1, val2 in zip(row1, row2)) + '\n'
+
+    return text.rstrip('\n')
+
+
+def read_memory_dump(dump_file, num_words=None):
+    """Read a memory dump (from the dump_file parameter of run_program) as
+    32-bit little-endian words.
+
+    Args:
+            dump_file: Path to the dump file
+            num_words: If set, only read this many words.
+
+    Returns:
+            array.array of unsigned 32-bit values
+
+    Raises:
+            TestException if the file has fewer than num_words words.
+    """
+
+    words = array.array('I')
+    assert words.itemsize == 4
+    with open(dump_file, 'rb') as memfile:
+        data = memfile.read() if num_words is None else memfile.read(num_words * 4)
+
+    if num_words is not None and len(data) < num_words * 4:
+        raise TestException('output file is truncated')
+
+    words.frombytes(data[:len(data) & ~3])
+    if sys.byteorder == 'big':
+        words.byteswap()
+
+    return words
+
 
-            block_offset += len(block1)
+def find_memory_mismatches(dump_file, expected, base_address=0):
+    """Compare the words at the beginning of a memory dump with expected
+    values.
 
+    Args:
+            dump_file: Path to the dump file
+            expected: Sequence or iterable (like a generator expression) of
+               expected 32-bit values, starting at the beginning of the file.
+            base_address: Address of the start of the dump, which is added to
+               the reported addresses.
+
+    Returns:
+            List of (address, actual value, expected value) tuples for each
+            word that differs. Empty if they all match.
+
+    Raises:
+            TestException if the file is shorter than expected.
+    """
+
+    expected = array.array('I', expected)
+    actual = read_memory_dump(dump_file, len(expected))
+    if actual == expected:
+        return []
+
+    # Narrow down the differences by comparing slices, which is done in C
+    mismatches = []
+    chunk_size = CACHE_LINE_SIZE // 4
+    for chunk_start in range(0, len(expected), chunk_size):
+        chunk_end = chunk_start + chunk_size
+        if actual[chunk_start:chunk_end] != expected[chunk_start:chunk_end]:
+            for index in range(chunk_start, min(chunk_end, len(expected))):
+                if actual[index] != expected[index]:
+                    mismatches.append((base_address + index * 4, actual[index],
+                                       expected[index]))
+
+    return mismatches
+
+
+def check_memory_dump(dump_file, expected, base_address=0,
+                      error_msg='FAIL: mismatch'):
+    """Throw a TestException if a memory dump doesn't contain the expected
+    values. The arguments are the same as find_memory_mismatches. The
+    exception lists the number of mismatches and the first few of them."""
+
+    mismatches = find_memory_mismatches(dump_file, expected, base_address)
+    if mismatches:
+        text = error_msg + ': {} words differ'.format(len(mismatches))
+        for address, actual, expected_value in mismatches[:MAX_MISMATCH_RANGES]:
+            text += '\n@{:x}: got {:x} expected {:x}'.format(address, actual,
+                                                            expected_value)
+
+        if len(mismatches) > MAX_MISMATCH_RANGES:
+            text += '\n...{} more'.format(len(mismatches) - MAX_MISMATCH_RANGES)
+
+        raise TestException(text)
 
+
+RegisteredTest = collections.namedtuple('RegisteredTest',
+                                        ['func', 'name', 'targets', 'build_func',
+                                         'directory'])
 registered_tests = []
 
+# Directories whose tests cannot run concurrently with each other. See
+# require_serial_execution.
+_serial_directories = set()
+
+# Set while execute_test_directories is importing runtest.py scripts, so
+# execute_tests only collects tests instead of running them.
+_collecting_tests = False
 
-def register_tests(func, names, targets=None):
+
+def register_tests(func, names, targets=None, build_func=None):
     """Add a list of tests to be run when execute_tests is called.
 
     This function can be called multiple times, it will append passed
@@ -398,6 +1445,13 @@ def register_tests(func, names, targets=None):
             func: A function that will be called for each of the elements
                     in the names list.
             names: List of tests to run.
+            targets: List of targets the tests can run on.
+            build_func: Optional function that takes a test name and
+                    builds the program for it with build_program. If this
+                    is specified, execute_tests calls it once per test before
+                    running any tests (concurrently if -j is passed). When
+                    func later calls build_program for each target, it will
+                    get the result from the build cache.
 
     Returns:
             Nothing
@@ -410,7 +1464,27 @@ def register_tests(func, names, targets=None):
     if not targets:
         targets = ALL_TARGETS[:]
 
-    registered_tests += [(func, name, targets) for name in names]
+    directory = os.getcwd()
+    registered_tests += [RegisteredTest(func, name, targets, build_func, directory)
+                         for name in names]
+
+
+def require_serial_execution():
+    """Don't run tests from the current directory concurrently with other
+    tests that called this, even with -j. This is for tests that use fixed
+    resources like network ports.
+
+    Args:
+            None
+
+    Returns:
+            Nothing
+
+    Raises:
+            Nothing
+    """
+
+    _serial_directories.add(os.getcwd())
 
 
 def test(param=None):
@@ -454,6 +1528,354 @@ COLOR_NONE = '\x1b[0m]'
 OUTPUT_ALIGN = 50
 
 
+def _test_label(name, target, directory):
+    """Return the name of a test/target pair to display. This includes the
+    directory if the test is not in the current one."""
+
+    path = os.path.relpath(os.path.join(directory, name))
+    return path + ' (' + target + ')'
+
+
+def _print_test_result(result):
+    label = _test_label(result['name'], result['target'],
+                        os.path.join(TEST_DIR, result['directory']))
+    print(label + (' ' * (OUTPUT_ALIGN - len(label))), end='')
+    if result['passed']:
+        print(COLOR_GREEN + 'PASS' + COLOR_NONE)
+    else:
+        print(COLOR_RED + 'FAIL' + COLOR_NONE)
+
+
+def _run_test(func, param, target, directory):
+    """Call a single test function and measure it. The function runs with
+    the directory it was registered from as the current directory.
+
+    Returns:
+            Dictionary with the name, target, and 'directory' (relative to
+            TEST_DIR) of the test, whether it 'passed', an error 'message' if
+            it did not (otherwise None), the total 'duration' in seconds, the
+            statistics described in _new_test_stats, and the files it used
+            ('dependencies', see add_dependency).
+    """
+
+    global _test_stats
+
+    _test_stats = _new_test_stats()
+    _test_dependencies.clear()
+    start_time = time.monotonic()
+    old_dir = os.getcwd()
+    try:
+        os.chdir(directory)
+        add_dependency('runtest.py')
+        add_dependency(TEST_DIR + '/test_harness.py')
+        if os.path.isfile(param):
+            add_dependency(param)
+
+        for path in TARGET_DEPENDENCIES.get(target, []):
+            add_dependency(os.path.join(PROJECT_TOP, path))
+
+        _set_work_dir(param, target)
+        func(param, target)
+        message = None
+    except TestException as exc:
+        message = exc.args[0]
+    except Exception:  # pylint: disable=W0703
+        message = 'Test threw exception:\n' + traceback.format_exc()
+    finally:
+        os.chdir(old_dir)
+
+    result = dict(_test_stats)
+    result.update(name=param, target=target,
+                  directory=os.path.relpath(directory, TEST_DIR),
+                  passed=message is None, message=message,
+                  duration=time.monotonic() - start_time,
+                  dependencies=sorted(_test_dependencies))
+    return result
+
+
+def _run_serial(work_items):
+    """Run each (func, param, target, directory) tuple in order in this process.
+
+    Returns:
+            List of results from _run_test.
+    """
+
+    results = []
+    for func, param, target, directory in work_items:
+        label = _test_label(param, target, directory)
+        print(label + (' ' * (OUTPUT_ALIGN - len(label))), end='')
+        sys.stdout.flush()
+        try:
+            result = _run_test(func, param, target, directory)
+        except KeyboardInterrupt:
+            sys.exit(1)
+
+        if result['passed']:
+            print(COLOR_GREEN + 'PASS' + COLOR_NONE)
+        else:
+            print(COLOR_RED + 'FAIL' + COLOR_NONE)
+
+        results += [result]
+
+    return results
+
+# Worker processes are forked from the main process, so they inherit this
+# list. Only the index of each test is sent to the workers, which avoids
+# pickling test functions (which usually live in a runtest.py __main__ module).
+_queued_tests = []
+
+
+def _init_worker():
+    """Called in each worker process when the pool starts."""
+
+    # The parent process handles Ctrl-C and tears down the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_queued_test(index):
+    """Worker process entry point. Runs one test and captures its output."""
+
+    func, param, target, directory = _queued_tests[index]
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        result = _run_test(func, param, target, directory)
+
+    return index, result, output.getvalue()
+
+
+def _run_build_step(build_func, name, _):
+    build_func(name)
+
+
+def _run_build_phase(tests, num_jobs):
+    """Build the programs for all tests that have a build function.
+
+    Each program is built once. The output goes into the build cache, where
+    the test functions will find it when they build the same program for
+    each target.
+
+    Returns:
+            Dictionary mapping (directory, name) of each test to the result of
+            its build step (in the format returned by _run_test)
+    """
+
+    global _queued_tests
+
+    build_items = [(functools.partial(_run_build_step, test.build_func),
+                    test.name, 'build', test.directory) for test in tests]
+    if num_jobs > 1:
+        _queued_tests = build_items
+        pool = multiprocessing.get_context('fork').Pool(num_jobs, _init_worker)
+        try:
+            results = pool.map(_run_queued_test, range(len(build_items)))
+        except KeyboardInterrupt:
+            pool.terminate()
+            sys.exit(1)
+
+        pool.close()
+        pool.join()
+    else:
+        try:
+            results = [(index, _run_test(*item), '')
+                       for index, item in enumerate(build_items)]
+        except KeyboardInterrupt:
+            sys.exit(1)
+
+    build_results = {}
+    for test, (_, result, output) in zip(tests, results):
+        if output:
+            # Show which test this came from, since the builds ran concurrently
+            print(_test_label(test.name, 'build', test.directory))
+            print(output, end='')
+
+        build_results[(test.directory, test.name)] = result
+
+    return build_results
+
+
+def _run_parallel(work_items, num_jobs):
+    """Run (func, param, target, directory) tuples concurrently in a pool of
+    processes.
+
+    Results are printed as tests complete. Anything a test prints is
+    buffered and printed together with its result, so output from
+    different tests is not interleaved.
+
+    Returns:
+            List of results from _run_test.
+    """
+
+    global _queued_tests
+
+    _queued_tests = work_items
+    results = []
+    pool = multiprocessing.get_context('fork').Pool(num_jobs, _init_worker)
+    try:
+        for _, result, output in pool.imap_unordered(_run_queued_test,
+                                                     range(len(work_items))):
+            _print_test_result(result)
+            if output:
+                print(output, end='')
+
+            sys.stdout.flush()
+            results += [result]
+    except KeyboardInterrupt:
+        pool.terminate()
+        sys.exit(1)
+
+    pool.close()
+    pool.join()
+    return results
+
+
+def _duration_key(directory, name, target):
+    """Return the key in the duration database for a test in directory"""
+
+    return test_report.duration_key(os.path.relpath(directory, TEST_DIR), name,
+                                    target)
+
+
+def _estimate_durations(work_items, durations):
+    """Return a list with the expected duration of each work item tuple.
+    Tests that haven't run before are assumed to take the average time of
+    the ones that have."""
+
+    keys = [_duration_key(directory, param, target)
+            for _, param, target, directory in work_items]
+    known = [durations[key] for key in keys if key in durations]
+    default = sum(known) / len(known) if known else 0.0
+    return [durations.get(key, default) for key in keys]
+
+
+def _print_schedule(work_items, estimates, num_jobs):
+    """Print the predicted total run time and critical path.
+
+    This simulates the scheduler: work items are started longest first,
+    each on whichever worker becomes free first. The critical path is the
+    sequence of tests on the worker that finishes last.
+    """
+
+    lanes = [(0.0, []) for _ in range(num_jobs)]
+    for (_, param, target, directory), estimate in zip(work_items, estimates):
+        lanes.sort(key=lambda lane: lane[0])
+        end_time, lane_tests = lanes[0]
+        lanes[0] = (end_time + estimate,
+                    lane_tests + [(_test_label(param, target, directory), estimate)])
+
+    end_time, critical_path = max(lanes, key=lambda lane: lane[0])
+    print('Predicted run time {:.1f}s with {} jobs, critical path:'.format(
+        end_time, num_jobs))
+    for label, estimate in critical_path:
+        print('  {:7.1f}s {}'.format(estimate, label))
+
+
+def _select_shard(tests, targets_to_run, durations, shard_index, num_shards):
+    """Return the subset of tests that shard number shard_index (starting
+    at 1) of num_shards should run.
+
+    Whole tests, rather than test/target pairs, are assigned to shards so each
+    program is only built on one machine. If durations is None, each test is
+    assigned by a hash of its directory and name, which every machine computes
+    the same way. Otherwise tests are assigned longest first, each to the
+    shard with the lowest total expected duration, so the shards take about
+    the same amount of time. Every machine computes the same partition, as
+    long as they have the same list of tests and the same duration database.
+    """
+
+    if durations is None:
+        return [test for test in tests if _shard_hash(test) % num_shards
+                == shard_index - 1]
+
+    keys = [[_duration_key(test.directory, test.name, target)
+             for target in test.targets if target in targets_to_run]
+            for test in tests]
+    known = [durations[key] for test_keys in keys for key in test_keys
+             if key in durations]
+    default = sum(known) / len(known) if known else 1.0
+    weights = [sum(durations.get(key, default) for key in test_keys)
+               for test_keys in keys]
+
+    # Sort by name to break ties, so the order of registration doesn't matter
+    order = sorted(range(len(tests)), key=lambda index: (
+        -weights[index], os.path.relpath(tests[index].directory, TEST_DIR),
+        tests[index].name))
+    shard_loads = [0.0] * num_shards
+    selected = set()
+    for index in order:
+        shard = shard_loads.index(min(shard_loads))
+        shard_loads[shard] += weights[index]
+        if shard == shard_index - 1:
+            selected.add(index)
+
+    return [test for index, test in enumerate(tests) if index in selected]
+
+
+def _shard_hash(test):
+    """Return a number that identifies a test and is the same on every
+    machine (unlike hash(), which is randomized for each process)."""
+
+    name = os.path.relpath(test.directory, TEST_DIR) + '/' + test.name
+    return int(hashlib.sha256(name.encode()).hexdigest()[:8], 16)
+
+
+def _get_changed_files(revision):
+    """Return the set of files (relative to PROJECT_TOP) that are different
+    in the working tree than in a git revision, including untracked files."""
+
+    try:
+        changed = subprocess.check_output(
+            ['git', 'diff', '--name-only', '--no-renames', revision, '--'],
+            cwd=PROJECT_TOP, stderr=subprocess.STDOUT)
+        untracked = subprocess.check_output(
+            ['git', 'ls-files', '--others', '--exclude-standard'],
+            cwd=PROJECT_TOP, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError) as exc:
+        print('Unable to get files changed since ' + revision + ': ' +
+              str(getattr(exc, 'output', b'').decode() or exc))
+        sys.exit(1)
+
+    return set((changed + untracked).decode().split())
+
+
+def _find_affected_tests(tests, targets_to_run, revision):
+    """Determine which test/target pairs can be affected by changes since a
+    git revision, using the dependencies recorded when they last passed.
+
+    A test is affected if a changed file is one of its dependencies or is
+    inside a directory that is. Tests that haven't passed before, or that
+    failed last time, are always affected. A changed file in a test
+    directory that no test recorded as a dependency (like a data file that
+    is read by the test program) affects all tests in that directory.
+
+    Returns:
+            Set of (directory, name, target) tuples.
+    """
+
+    changed_files = _get_changed_files(revision)
+    dependencies = test_report.load_dependencies(args.dependencies)
+    all_dependencies = set(path for paths in dependencies.values() for path in paths)
+    unrecorded_changes = [path for path in changed_files
+                          if path not in all_dependencies]
+    affected = set()
+    for test in tests:
+        test_dir = os.path.relpath(test.directory, PROJECT_TOP) + '/'
+        dir_changed = any(path.startswith(test_dir) and
+                          not path.startswith(test_dir + OBJ_DIR)
+                          for path in unrecorded_changes)
+        for target in test.targets:
+            if target not in targets_to_run:
+                continue
+
+            paths = dependencies.get(_duration_key(test.directory, test.name, target))
+            if paths is None or dir_changed or any(
+                    path in changed_files or (path.endswith('/') and any(
+                        changed.startswith(path) for changed in changed_files))
+                    for path in paths):
+                affected.add((test.directory, test.name, target))
+
+    return affected
+
+
 def execute_tests():
     """
     *All tests are called from here*
@@ -472,19 +1894,24 @@ def execute_tests():
 
     global DEBUG
 
+    if _collecting_tests:
+        return
+
     DEBUG = args.debug
     if args.target:
         targets_to_run = args.target
     else:
         targets_to_run = DEFAULT_TARGETS
 
-    # Filter based on names and targets
+    # Filter based on names and targets. A test in another directory can
+    # also be selected by its path relative to the current directory.
     if args.names:
         tests_to_run = []
         for requested in args.names:
-            for func, param, targets in registered_tests:
-                if param == requested:
-                    tests_to_run += [(func, param, targets)]
+            for test in registered_tests:
+                if requested in (test.name, os.path.relpath(
+                        os.path.join(test.directory, test.name))):
+                    tests_to_run += [test]
                     break
             else:
                 print('Unknown test ' + requested)
@@ -492,42 +1919,353 @@ def execute_tests():
     else:
         tests_to_run = registered_tests
 
-    failing_tests = []
-    for func, param, targets in tests_to_run:
-        for target in targets:
+    if args.changed_since:
+        affected = _find_affected_tests(tests_to_run, targets_to_run,
+                                        args.changed_since)
+        tests_to_run = [test for test in tests_to_run if any(
+            (test.directory, test.name, target) in affected
+            for target in test.targets)]
+        print(str(len(affected)) + ' test/target pairs may be affected by changes since '
+              + args.changed_since)
+
+    durations = test_report.load_durations(args.durations or DURATION_DB_FILE)
+    expected_results = []
+    if args.shard:
+        # Record every test/target pair that some shard should run, so
+        # merge_reports.py can check that none are missing.
+        expected_results = [_duration_key(test.directory, test.name, target)
+                            for test in tests_to_run for target in test.targets
+                            if target in targets_to_run and (
+                                not args.changed_since or
+                                (test.directory, test.name, target) in affected)]
+
+        # The local duration database can be different on each machine, so
+        # only partition by duration if one was passed explicitly.
+        tests_to_run = _select_shard(tests_to_run, targets_to_run,
+                                     durations if args.durations else None,
+                                     *args.shard)
+
+    # Build phase: compile each program once, regardless of how many targets
+    # it will run on. This relies on the build cache to hand the result to
+    # the run phase, so skip it if the cache is disabled. The 'host' target
+    # runs a natively compiled program, so it doesn't need this.
+    build_results = {}
+    if not args.no_build_cache:
+        to_build = [test for test in tests_to_run if test.build_func and any(
+            target in targets_to_run and target != 'host' for target in test.targets)]
+        build_results = _run_build_phase(to_build, args.jobs)
+
+    # Run phase
+    work_items = []
+    results = []
+    for test in tests_to_run:
+        for target in test.targets:
             if target not in targets_to_run:
                 continue
 
-            label = param + ' (' + target + ')'
-            print(label + (' ' * (OUTPUT_ALIGN - len(label))), end='')
-            try:
-                sys.stdout.flush()
-                func(param, target)
-                print(COLOR_GREEN + 'PASS' + COLOR_NONE)
-            except KeyboardInterrupt:
-                sys.exit(1)
-            except TestException as exc:
-                print(COLOR_RED + 'FAIL' + COLOR_NONE)
-                failing_tests += [(param, exc.args[0])]
-            except Exception as exc:  # pylint: disable=W0703
-                print(COLOR_RED + 'FAIL' + COLOR_NONE)
-                failing_tests += [(param, 'Test threw exception:\n' +
-                                   traceback.format_exc())]
+            if args.changed_since and (test.directory, test.name, target) not in affected:
+                continue
 
+            build_result = build_results.get((test.directory, test.name))
+            if build_result and not build_result['passed'] and target != 'host':
+                result = _new_test_stats()
+                result.update(name=test.name, target=target,
+                              directory=build_result['directory'], passed=False,
+                              message=build_result['message'], duration=0.0)
+                _print_test_result(result)
+                results += [result]
+            else:
+                work_items += [(test.func, test.name, target, test.directory)]
+
+    # Start the longest tests first, based on previous runs. Otherwise a slow
+    # test that happens to be near the end of the list will hold up the
+    # whole run after everything else has finished.
+    estimates = _estimate_durations(work_items, durations)
+    if args.jobs > 1:
+        order = sorted(range(len(work_items)), key=lambda index: -estimates[index])
+        work_items = [work_items[index] for index in order]
+        estimates = [estimates[index] for index in order]
+
+    if args.show_schedule:
+        _print_schedule(work_items, estimates, args.jobs)
+
+    if args.jobs > 1:
+        # Tests that must not overlap with each other run afterward, in
+        # this process.
+        serial_items = [item for item in work_items
+                        if item[3] in _serial_directories]
+        results += _run_parallel([item for item in work_items
+                                  if item[3] not in _serial_directories],
+                                 args.jobs)
+        results += _run_serial(serial_items)
+    else:
+        results += _run_serial(work_items)
+
+    dependencies = {}
+    for result in results:
+        key = test_report.duration_key(result['directory'], result['name'],
+                                       result['target'])
+        paths = result.pop('dependencies', None)
+        dependencies[key] = paths if result['passed'] else None
+
+    test_report.save_dependencies(args.dependencies, dependencies)
+
+    # Shards must all partition the tests using the same durations, so they
+    # don't update them. merge_reports.py can do that with the combined results.
+    if not args.shard:
+        test_report.save_durations(args.durations or DURATION_DB_FILE, results)
+
+    # The build phase time is shared by all targets of a test
+    for result in results:
+        build_result = build_results.get((os.path.join(TEST_DIR, result['directory']),
+                                          result['name']))
+        if build_result and result['target'] != 'host':
+            result['build_time'] = build_result['compile_time']
+
+    if args.json_report:
+        test_report.write_json_report(args.json_report, results, expected_results)
+
+    if args.junit_report:
+        test_report.write_junit_report(args.junit_report,
+                            os.path.relpath(os.getcwd(), TEST_DIR), results)
+
+    stopped_early = [result for result in results if result['stopped_early']]
+    if stopped_early:
+        # This can only be estimated, since the programs didn't run to the end.
+        # Compare with the durations from previous runs.
+        time_saved = 0.0
+        for result in stopped_early:
+            key = test_report.duration_key(result['directory'], result['name'],
+                                           result['target'])
+            time_saved += max(durations.get(key, 0.0) - result['duration'], 0.0)
+
+        print('{} programs were stopped after printing their result, {:.1f}s faster '
+              'than previous runs'.format(len(stopped_early), time_saved))
+
+    failing_tests = [result for result in results if not result['passed']]
     if failing_tests:
         print('Failing tests:')
-        for name, output in failing_tests:
-            print(name)
-            print(output)
+        for result in failing_tests:
+            print(_test_label(result['name'], result['target'],
+                              os.path.join(TEST_DIR, result['directory'])))
+            print(result['message'])
 
     print(str(len(failing_tests)) + '/' +
           str(len(tests_to_run)) + ' tests failed')
     if failing_tests != []:
         sys.exit(1)
 
+
+def execute_test_directories(directories, target_filter=None):
+    """Run the tests from several directories together, as if they were
+    registered by a single runtest.py script.
+
+    This imports the runtest.py script in each directory, which registers
+    its tests, then runs them all with one scheduler (so tests from
+    different directories can run concurrently with -j), and writes one
+    combined report. If any test fails, it will call sys.exit with a
+    non-zero status.
+
+    Args:
+            directories: List of paths to directories containing runtest.py
+            target_filter: Optional function that takes the directory
+                    (relative to the tests directory), name, and target of
+                    a test, and returns False to not run it on that target.
+
+    Returns:
+            None
+
+    Raises:
+            Nothing
+    """
+
+    global _collecting_tests
+    global registered_tests
+
+    _collecting_tests = True
+    start_dir = os.getcwd()
+    for index, directory in enumerate(directories):
+        # The script may import other modules from its own directory, and
+        # expects relative paths to be relative to it.
+        os.chdir(directory)
+        sys.path.insert(0, os.getcwd())
+        try:
+            spec = importlib.util.spec_from_file_location(
+                'runtest' + str(index), 'runtest.py')
+            spec.loader.exec_module(importlib.util.module_from_spec(spec))
+        finally:
+            sys.path.remove(os.getcwd())
+            os.chdir(start_dir)
+
+    _collecting_tests = False
+    if target_filter:
+        registered_tests = [test._replace(targets=[
+            target for target in test.targets if target_filter(
+                os.path.relpath(test.directory, TEST_DIR), test.name, target)])
+            for test in registered_tests]
+
+    execute_tests()
+
 CHECK_PREFIX = 'CHECK: '
 CHECKN_PREFIX = 'CHECKN: '
 
+CheckPattern = collections.namedtuple('CheckPattern', [
+    'negative', 'line_num', 'text', 'regexp'])
+
+# Maps (path, modification time, size) of a source file to the list of
+# CheckPatterns in it, so each file is only parsed once per process.
+_check_patterns = {}
+
+
+def _read_check_patterns(source_file):
+    stat_result = os.stat(source_file)
+    key = (os.path.abspath(source_file), stat_result.st_mtime_ns,
+           stat_result.st_size)
+    if key not in _check_patterns:
+        patterns = []
+        with open(source_file, 'r') as infile:
+            for line_num, line in enumerate(infile, 1):
+                chkoffs = line.find(CHECK_PREFIX)
+                if chkoffs != -1:
+                    text = line[chkoffs + len(CHECK_PREFIX):].strip()
+                    patterns.append(CheckPattern(False, line_num, text,
+                                                 re.compile(text)))
+                else:
+                    chkoffs = line.find(CHECKN_PREFIX)
+                    if chkoffs != -1:
+                        text = line[chkoffs + len(CHECKN_PREFIX):].strip()
+                        patterns.append(CheckPattern(True, line_num, text,
+                                                     re.compile(text)))
+
+        _check_patterns[key] = patterns
+
+    return _check_patterns[key]
+
+
+class CheckMatcher(object):
+
+    """
+    Matches program output against the CHECK: and CHECKN: patterns in a
+    source file (see check_result) as the output arrives, so a test can
+    stop the program as soon as the result is known.
+
+    Output is only matched once a complete line has arrived, so a pattern
+    can't match part of a line that is still being printed. A CHECK: match
+    that extends to the end of the output so far is not accepted until more
+    output arrives, because a pattern that ends with $ or a greedy repeat
+    could match differently once it does. Call feed with each chunk of
+    output, then finish when the program has exited.
+    """
+
+    def __init__(self, source_file):
+        self.patterns = _read_check_patterns(source_file)
+        if not self.patterns:
+            raise TestException('FAIL: no lines with CHECK: were found')
+
+        self.output = ''
+        self.next_pattern = 0
+        self.output_offset = 0  # Where to search for the next CHECK:
+        self.scanned_offset = 0  # End of the output that has been matched
+        self.active_negative = []  # (CheckPattern, offset) for CHECKN:
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    def feed(self, chunk):
+        """Match more output against the patterns.
+
+        Args:
+                chunk: Output from the program, as str or bytes.
+
+        Returns:
+                True if all CHECK: patterns have been found, and there are no
+                CHECKN: patterns that later output could match, which means
+                the program can be stopped.
+
+        Raises:
+                TestException if the output matches a CHECKN: pattern.
+        """
+
+        if isinstance(chunk, bytes):
+            chunk = self.decoder.decode(chunk)
+
+        self.output += chunk
+        line_end = self.output.rfind('\n') + 1
+        if line_end > self.scanned_offset:
+            self._match(line_end)
+
+        return self.next_pattern == len(self.patterns) and not self.active_negative
+
+    def finish(self, chunk=''):
+        """Match the remaining output after the program has exited.
+
+        Args:
+                chunk: Output that has not been passed to feed, as a str.
+
+        Raises:
+                TestException if a CHECK: pattern was not found or the output
+                matches a CHECKN: pattern.
+        """
+
+        self.output += chunk + self.decoder.decode(b'', True)
+        self._match(len(self.output), True)
+        if self.next_pattern < len(self.patterns):
+            pattern = self.patterns[self.next_pattern]
+            error = 'FAIL: line ' + \
+                str(pattern.line_num) + ' expected string ' + \
+                pattern.text + ' was not found\n'
+            error += 'searching here:' + self.output[self.output_offset:]
+            raise TestException(error)
+
+    def _match(self, end, final=False):
+        # Check for CHECKN: patterns that were active before, in the new output
+        for pattern, offset in self.active_negative:
+            self._check_absent(pattern, max(offset, self.scanned_offset), end)
+
+        while self.next_pattern < len(self.patterns):
+            pattern = self.patterns[self.next_pattern]
+            if pattern.negative:
+                # This can't occur anywhere after the previous CHECK: match,
+                # including output that hasn't arrived yet.
+                print('ensuring absence of pattern "' + pattern.text +
+                      '", line ' + str(pattern.line_num))
+                self._check_absent(pattern, self.output_offset, end)
+                self.active_negative.append((pattern, self.output_offset))
+            else:
+                if DEBUG:
+                    print('searching for pattern "' + pattern.text + '", line '
+                          + str(pattern.line_num))
+
+                # Search all of the output, like a search after the program
+                # has exited would, so $ only matches at the end of it.
+                got = pattern.regexp.search(self.output, self.output_offset)
+                if not got or (not final and not self._is_final_match(pattern, got, end)):
+                    break
+
+                self.output_offset = got.end()
+
+            self.next_pattern += 1
+
+        self.scanned_offset = end
+
+    def _is_final_match(self, pattern, got, end):
+        """Return True if more output can't change where a CHECK: pattern
+        matches. The match must end before the end of the complete lines,
+        and be the same with a character appended to the output (which
+        catches $ and greedy repeats that reach the end)."""
+
+        if got.end() >= end:
+            return False
+
+        probe = pattern.regexp.search(self.output + '\0', self.output_offset)
+        return probe is not None and probe.span() == got.span()
+
+    def _check_absent(self, pattern, start, end):
+        if pattern.regexp.search(self.output, start, end):
+            error = 'FAIL: line ' + \
+                str(pattern.line_num) + ' string ' + \
+                pattern.text + ' should not be here:\n'
+            error += self.output
+            raise TestException(error)
+
 
 def check_result(source_file, program_output):
     """Check output of a program based on embedded comments in source code.
@@ -538,6 +2276,9 @@ def check_result(source_file, program_output):
     If there is a pattern 'CHECKN: ', the test will fail if the string *does*
     occur in the output.
 
+    To check output while the program is running instead, pass check_file
+    to run_program or run_kernel.
+
     Args:
             source_file: relative path to a source file that contains patterns
 
@@ -548,51 +2289,8 @@ def check_result(source_file, program_output):
             TestException if a string is not found.
     """
 
-    output_offset = 0
-    line_num = 1
-    found_check_lines = False
-    with open(source_file, 'r') as infile:
-        for line in infile:
-            chkoffs = line.find(CHECK_PREFIX)
-            if chkoffs != -1:
-                found_check_lines = True
-                expected = line[chkoffs + len(CHECK_PREFIX):].strip()
-                if DEBUG:
-                    print('searching for pattern "' + expected + '", line '
-                          + str(line_num))
-
-                regexp = re.compile(expected)
-                got = regexp.search(program_output, output_offset)
-                if got:
-                    output_offset = got.end()
-                else:
-                    error = 'FAIL: line ' + \
-                        str(line_num) + ' expected string ' + \
-                        expected + ' was not found\n'
-                    error += 'searching here:' + program_output[output_offset:]
-                    raise TestException(error)
-            else:
-                chkoffs = line.find(CHECKN_PREFIX)
-                if chkoffs != -1:
-                    found_check_lines = True
-                    nexpected = line[chkoffs + len(CHECKN_PREFIX):].strip()
-                    print('ensuring absence of pattern "' + nexpected +
-                          '", line ' + str(line_num))
-
-                    regexp = re.compile(nexpected)
-                    got = regexp.search(program_output, output_offset)
-                    if got:
-                        error = 'FAIL: line ' + \
-                            str(line_num) + ' string ' + \
-                            nexpected + ' should not be here:\n'
-                        error += program_output
-                        raise TestException(error)
-
-            line_num += 1
-
-    if not found_check_lines:
-        raise TestException('FAIL: no lines with CHECK: were found')
-
+    matcher = CheckMatcher(source_file)
+    matcher.finish(program_output)
     return True
 
 
@@ -604,12 +2302,64 @@ def dump_hex(output_file, input_file):
 
     with open(input_file, 'rb') as ifile, open(output_file, 'wb') as ofile:
         while True:
-            word = ifile.read(4)
-            if not word:
+            # Convert a large block (a multiple of the word size) at a time
+            chunk = ifile.read(0x100000)
+            if not chunk:
                 break
 
-            ofile.write(binascii.hexlify(word))
-            ofile.write(b'\n')
+            ofile.write(chunk.hex('\n', -4).encode() + b'\n')
+
+
+ELF_HEADER = struct.Struct('<16sHHIIIIIHHHHHH')
+ELF_PROGRAM_HEADER = struct.Struct('<IIIIIIII')
+ELF_PT_LOAD = 1
+
+
+def elf_to_binary(output_file, input_file, base_address=0):
+    """
+    Reads an ELF executable and writes a raw memory image, which the emulator
+    and verilator model can load directly without parsing hex. Each loadable
+    segment is copied to its virtual address minus base_address. The rest of
+    the segment past the data in the file (uninitialized data like .bss) and
+    gaps between segments are filled with zeroes. The startup code doesn't
+    clear .bss, and the emulator and verilator model start with random memory
+    contents, so it must be in the image.
+
+    Raises:
+            TestException if the input file isn't a 32-bit little endian ELF file.
+    """
+
+    with open(input_file, 'rb') as ifile:
+        elf_data = ifile.read()
+
+    if len(elf_data) < ELF_HEADER.size or elf_data[:6] != b'\x7fELF\x01\x01':
+        raise TestException(input_file + ' is not a 32-bit little endian ELF file')
+
+    header = ELF_HEADER.unpack_from(elf_data)
+    phoff, phentsize, phnum = header[5], header[9], header[10]
+    image = bytearray()
+    for index in range(phnum):
+        p_type, p_offset, p_vaddr, _, p_filesz, p_memsz, _, _ = \
+            ELF_PROGRAM_HEADER.unpack_from(elf_data, phoff + index * phentsize)
+        if p_type != ELF_PT_LOAD or p_memsz == 0:
+            continue
+
+        start = p_vaddr - base_address
+        end = start + p_memsz
+        if start < 0:
+            raise TestException('{}: segment at {:#x} is below base address {:#x}'
+                                .format(input_file, p_vaddr, base_address))
+
+        if len(image) < end:
+            image.extend(bytes(end - len(image)))
+
+        image[start:start + p_filesz] = elf_data[p_offset:p_offset + p_filesz]
+        image[start + p_filesz:end] = bytes(p_memsz - p_filesz)
+
+    # Pad to a whole number of words
+    image.extend(bytes(-len(image) % 4))
+    with open(output_file, 'wb') as ofile:
+        ofile.write(image)
 
 
 def endian_swap(value):
@@ -619,6 +2369,10 @@ def endian_swap(value):
             | ((value << 8) & 0xff0000) | (value << 24))
 
 
+def _build_generic_test(name):
+    build_program([name])
+
+
 def _run_generic_test(name, target):
     """
     Name is the filename of a source file. This will compile it, run it,
@@ -627,8 +2381,7 @@ def _run_generic_test(name, target):
     """
 
     build_program([name])
-    result = run_program(target)
-    check_result(name, result)
+    run_program(target, check_file=name)
 
 
 def register_generic_test(name, targets=None):
@@ -649,12 +2402,12 @@ def register_generic_test(name, targets=None):
     if not targets:
         targets = ALL_TARGETS[:]
 
-    register_tests(_run_generic_test, name, targets)
+    register_tests(_run_generic_test, name, targets, _build_generic_test)
 
 
 def _run_generic_assembly_test(name, target):
     build_program([name])
-    result = run_program(target)
+    result = run_program(target, sentinels=['PASS', 'FAIL'])
     if 'PASS' not in result or 'FAIL' in result:
         raise TestException('Test failed ' + result)
 
@@ -679,4 +2432,5 @@ def register_generic_assembly_tests(tests, targets=None):
     if not targets:
         targets = ALL_TARGETS[:]
 
-    register_tests(_run_generic_assembly_test, tests, targets)
+    register_tests(_run_generic_assembly_test, tests, targets,
+                   _build_generic_test)
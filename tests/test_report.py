@@ -0,0 +1,201 @@
+#
+# Copyright 2011-2015 Jeff Bush
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Functions to read and write test results and the databases of test
+durations and dependencies.
+
+Each result is a dictionary in the format returned by test_harness._run_test.
+These are separate from test_harness so tools like merge_reports.py can use
+them without importing test_harness, which parses the command line.
+"""
+
+import json
+import os
+import re
+from xml.etree import ElementTree
+
+
+def duration_key(directory, name, target):
+    """Return the key for a test in the duration database.
+
+    Args:
+            directory: Directory of the test, relative to the tests directory.
+                    This is part of the key because tests in different
+                    directories can have the same name.
+            name: Name of the test
+            target: Target it ran on
+
+    Returns:
+            String key
+    """
+
+    return directory + '/' + name + ':' + target
+
+
+def load_durations(filename):
+    """Read a duration database.
+
+    Returns:
+            Dictionary mapping the result of duration_key to the expected
+            duration in seconds. This is empty if the file doesn't exist.
+    """
+
+    return _read_database(filename)
+
+
+def save_durations(filename, results):
+    """Update a duration database with the results of passing tests.
+
+    The stored value is a moving average of the last few runs, so one
+    unusually slow or fast run doesn't change the schedule too much.
+    """
+
+    durations = load_durations(filename)  # Reload in case another run updated it
+    for result in results:
+        if result['passed']:
+            key = duration_key(result['directory'], result['name'], result['target'])
+            if key in durations:
+                durations[key] = (durations[key] + result['duration']) / 2
+            else:
+                durations[key] = result['duration']
+
+    _write_database(filename, durations)
+
+
+def load_dependencies(filename):
+    """Read a dependency database.
+
+    Returns:
+            Dictionary mapping the result of duration_key to a list of
+            paths relative to the top of the project. Paths that end with a
+            slash are directories. This is empty if the file doesn't exist.
+    """
+
+    return _read_database(filename)
+
+
+def save_dependencies(filename, dependencies):
+    """Update a dependency database.
+
+    Args:
+            dependencies: Dictionary mapping the result of duration_key to
+                a list of paths, or to None to remove the entry.
+    """
+
+    database = load_dependencies(filename)  # Reload in case another run updated it
+    for key, paths in dependencies.items():
+        if paths is None:
+            database.pop(key, None)
+        else:
+            database[key] = paths
+
+    _write_database(filename, database)
+
+
+def _read_database(filename):
+    try:
+        with open(filename, 'r') as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_database(filename, contents):
+    """Atomically replace a JSON database file, so a concurrent run never
+    sees a partially written one."""
+
+    db_dir = os.path.dirname(filename)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+
+    temp_file = filename + '.tmp' + str(os.getpid())
+    with open(temp_file, 'w') as outfile:
+        json.dump(contents, outfile, indent=2, sort_keys=True)
+
+    os.replace(temp_file, filename)
+
+
+def read_json_report(filename):
+    """Return the list of results from a file written by write_json_report."""
+
+    with open(filename, 'r') as infile:
+        return json.load(infile)['tests']
+
+
+def read_expected_results(filename):
+    """Return the list of duration_key values that a file written by
+    write_json_report says the run was split from (empty if it wasn't)."""
+
+    with open(filename, 'r') as infile:
+        return json.load(infile).get('expected', [])
+
+
+def write_json_report(filename, results, expected=None):
+    """Write test results to a JSON file.
+
+    Args:
+            results: List of results.
+            expected: For one shard of a run, the duration_key of every
+                test/target pair in all of the shards.
+    """
+
+    report = {'tests': results}
+    if expected:
+        report['expected'] = expected
+
+    with open(filename, 'w') as outfile:
+        json.dump(report, outfile, indent=2, sort_keys=True)
+
+# Characters that are not allowed in XML 1.0 documents
+INVALID_XML_CHARS_RE = re.compile('[^\t\n\r\x20-\ud7ff\ue000-\ufffd]')
+
+
+def write_junit_report(filename, suite_name, results):
+    """Write test results to a JUnit XML file.
+
+    Each test/target pair is a testcase, with the target as the class name.
+    Timing and resource statistics are stored as testcase properties.
+    """
+
+    suite = ElementTree.Element('testsuite', {
+        'name': suite_name,
+        'tests': str(len(results)),
+        'failures': str(len([result for result in results if not result['passed']])),
+        'time': '{:.3f}'.format(sum(result['duration'] for result in results))
+    })
+    for result in results:
+        case = ElementTree.SubElement(suite, 'testcase', {
+            'classname': result['target'],
+            'name': os.path.join(result['directory'], result['name']),
+            'time': '{:.3f}'.format(result['duration'])
+        })
+        properties = ElementTree.SubElement(case, 'properties')
+        for key in sorted(result):
+            if key not in ('name', 'target', 'directory', 'passed', 'message',
+                           'duration'):
+                ElementTree.SubElement(properties, 'property', {
+                    'name': key,
+                    'value': str(result[key])
+                })
+
+        if not result['passed']:
+            failure = ElementTree.SubElement(case, 'failure',
+                                             {'message': 'test failed'})
+            failure.text = INVALID_XML_CHARS_RE.sub('?', result['message'])
+
+    ElementTree.ElementTree(suite).write(filename, encoding='utf-8',
+                                         xml_declaration=True)
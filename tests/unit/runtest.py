@@ -23,12 +23,10 @@ each one separately, then look for the string 'PASS' in the output.
 import os
 import subprocess
 import sys
-import shutil
 
 sys.path.insert(0, '..')
 import test_harness
 
-DRIVER_PATH = 'obj/driver.cpp'
 DRIVER_SRC = '''
 #include <iostream>
 #include <stdlib.h>
@@ -101,7 +99,8 @@ int main(int argc, char **argv, char **env)
 
 
 def run_unit_test(filename, _):
-    shutil.rmtree(path='obj/', ignore_errors=True)
+    work_dir = test_harness.get_work_dir()
+    driver_path = work_dir + 'driver.cpp'
 
     filestem, _ = os.path.splitext(filename)
     modulename = os.path.basename(filestem)
@@ -113,9 +112,9 @@ def run_unit_test(filename, _):
         '--assert',
         '-I' + test_harness.PROJECT_TOP + '/hardware/core',
         '-DSIMULATION=1',
-        '-Mdir', 'obj',
+        '-Mdir', work_dir,
         '-cc', filename,
-        '--exe', DRIVER_PATH
+        '--exe', driver_path
     ]
 
     if test_harness.DEBUG:
@@ -127,13 +126,13 @@ def run_unit_test(filename, _):
         raise test_harness.TestException(
             'Verilation failed:\n' + exc.output.decode())
 
-    with open(DRIVER_PATH, 'w') as output_file:
+    with open(driver_path, 'w') as output_file:
         output_file.write(DRIVER_SRC.replace('$MODULE$', modulename))
 
     make_args = [
         'make',
         'CXXFLAGS=-Wno-parentheses-equality',
-        '-C', 'obj/',
+        '-C', work_dir,
         '-f', 'V' + modulename + '.mk',
         'V' + modulename
     ]
@@ -145,7 +144,7 @@ def run_unit_test(filename, _):
             'Build failed:\n' + exc.output.decode())
 
     model_args = [
-        'obj/V' + modulename
+        work_dir + 'V' + modulename
     ]
 
     try:
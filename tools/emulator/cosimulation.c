@@ -60,17 +60,158 @@ static uint32_t expected_thread;
 static bool cosim_mismatch;
 static bool cosim_event_triggered;
 
+// Side effects and other events read from the hardware model.
+enum trace_event
+{
+    TRACE_UNKNOWN,  // Unrecognized line of text
+    TRACE_SCALAR_WRITEBACK,
+    TRACE_VECTOR_WRITEBACK,
+    TRACE_STORE,
+    TRACE_INTERRUPT,
+    TRACE_HALTED,
+    TRACE_ERROR
+};
+
+//
+// If the verilator model is started with +binarytrace, it writes events in
+// a fixed size binary format instead of as text, which is much faster to
+// read. Each event is BINARY_EVENT_LENGTH bytes, little endian:
+//
+//   offset  size
+//    0      1   Type (TRACE_SCALAR_WRITEBACK through TRACE_INTERRUPT)
+//    1      1   Thread
+//    2      1   Register
+//    3      1   (unused)
+//    4      4   Program counter
+//    8      4   Store address
+//   12      8   Mask
+//   20     64   Values, one per lane, in the same order as in the text
+//               format. A scalar writeback has its value in the first.
+//
+// Other output from the model (like ***HALTED***) is still text, so events
+// and lines of text are interleaved. Because the type values are control
+// characters, they can't be confused with the start of a line of text.
+// tests/cosimulation/cosim_trace.py can decode and print these.
+//
+#define BINARY_EVENT_LENGTH 84
+
+static uint32_t read_le32(const uint8_t *ptr)
+{
+    return (uint32_t) ptr[0] | ((uint32_t) ptr[1] << 8) | ((uint32_t) ptr[2] << 16)
+           | ((uint32_t) ptr[3] << 24);
+}
+
+// The type byte has already been read.
+static enum trace_event read_binary_event(int type, uint32_t *pc, uint32_t *thread_id,
+        uint32_t *reg, uint32_t *address, uint64_t *mask, uint32_t *values)
+{
+    uint8_t event[BINARY_EVENT_LENGTH];
+    int lane;
+
+    event[0] = (uint8_t) type;
+    if (fread(event + 1, BINARY_EVENT_LENGTH - 1, 1, stdin) != 1)
+    {
+        printf("Truncated binary cosimulation event\n");
+        return TRACE_ERROR;
+    }
+
+    *thread_id = event[1];
+    *reg = event[2];
+    *pc = read_le32(event + 4);
+    *address = read_le32(event + 8);
+    *mask = read_le32(event + 12) | ((uint64_t) read_le32(event + 16) << 32);
+    for (lane = 0; lane < NUM_VECTOR_LANES; lane++)
+    {
+        values[lane] = read_le32(event + 20 + lane * 4);
+        if (type == TRACE_STORE)
+            values[lane] = endian_swap32(values[lane]);
+    }
+
+    return (enum trace_event) type;
+}
+
+// Print a binary event the way the verilator model would print it as text
+static void print_binary_event(enum trace_event type, uint32_t pc, uint32_t thread_id,
+                               uint32_t reg, uint32_t address, uint64_t mask,
+                               const uint32_t *values)
+{
+    int lane;
+
+    switch (type)
+    {
+        case TRACE_SCALAR_WRITEBACK:
+            printf("swriteback %08x %x %02x %08x\n", pc, thread_id, reg, values[0]);
+            return;
+
+        case TRACE_VECTOR_WRITEBACK:
+            printf("vwriteback %08x %x %02x %016" PRIx64 " ", pc, thread_id, reg, mask);
+            break;
+
+        case TRACE_STORE:
+            printf("store %08x %x %08x %016" PRIx64 " ", pc, thread_id, address, mask);
+            break;
+
+        case TRACE_INTERRUPT:
+            printf("interrupt %u %08x\n", thread_id, pc);
+            return;
+
+        default:
+            return;
+    }
+
+    for (lane = 0; lane < NUM_VECTOR_LANES; lane++)
+        printf("%08x", type == TRACE_STORE ? endian_swap32(values[lane]) : values[lane]);
+
+    printf("\n");
+}
+
+static enum trace_event parse_text_event(const char *line, uint32_t *pc,
+        uint32_t *thread_id, uint32_t *reg, uint32_t *address, uint64_t *mask,
+        uint32_t *values)
+{
+    char value_str[256];
+
+    if (sscanf(line, "store %x %x %x %" PRIx64 " %s", pc, thread_id, address, mask, value_str) == 5)
+    {
+        if (parse_hex_vector(value_str, values, true) < 0)
+        {
+            printf("Error parsing cosimulation event\n");
+            return TRACE_ERROR;
+        }
+
+        return TRACE_STORE;
+    }
+    else if (sscanf(line, "vwriteback %x %x %x %" PRIx64 " %s", pc, thread_id, reg, mask, value_str) == 5)
+    {
+        if (parse_hex_vector(value_str, values, false) < 0)
+        {
+            printf("Error parsing cosimulation event\n");
+            return TRACE_ERROR;
+        }
+
+        return TRACE_VECTOR_WRITEBACK;
+    }
+    else if (sscanf(line, "swriteback %x %x %x %x", pc, thread_id, reg, &values[0]) == 4)
+        return TRACE_SCALAR_WRITEBACK;
+    else if (strcmp(line, "***HALTED***") == 0)
+        return TRACE_HALTED;
+    else if (sscanf(line, "interrupt %u %x", thread_id, pc) == 2)
+        return TRACE_INTERRUPT;
+    else
+        return TRACE_UNKNOWN;
+}
+
 int run_cosimulation(struct processor *proc, bool verbose)
 {
-    char line[1024];
-    uint32_t thread_id;
-    uint32_t address;
-    uint32_t pc;
-    uint64_t write_mask;
+    char line[1024] = "";
+    int type_byte;
+    enum trace_event event;
+    uint32_t thread_id = 0;
+    uint32_t address = 0;
+    uint32_t pc = 0;
+    uint64_t write_mask = 0;
     uint32_t vector_values[NUM_VECTOR_LANES];
-    char value_str[256];
-    uint32_t reg;
-    uint32_t scalar_value;
+    uint32_t reg = 0;
     bool verilog_model_halted = false;
     size_t len;
 
@@ -78,71 +219,93 @@ int run_cosimulation(struct processor *proc, bool verbose)
     if (verbose)
         enable_tracing(proc);
 
-    while (fgets(line, sizeof(line), stdin))
+    while (!verilog_model_halted)
     {
-        if (verbose)
-            printf("%s", line);
-
-        len = strlen(line);
-        if (len > 0)
-            line[len - 1] = '\0';	// Strip off newline
+        type_byte = getchar();
+        if (type_byte == EOF)
+            break;
 
-        if (sscanf(line, "store %x %x %x %" PRIx64 " %s", &pc, &thread_id, &address, &write_mask, value_str) == 5)
+        if (type_byte >= TRACE_SCALAR_WRITEBACK && type_byte <= TRACE_INTERRUPT)
         {
-            // Memory Store
-            if (parse_hex_vector(value_str, vector_values, true) < 0)
+            event = read_binary_event(type_byte, &pc, &thread_id, &reg, &address,
+                                      &write_mask, vector_values);
+            if (verbose)
             {
-                printf("Error parsing cosimulation event\n");
-                return -1;
+                print_binary_event(event, pc, thread_id, reg, address, write_mask,
+                                   vector_values);
             }
-
-            expected_event = EVENT_MEM_STORE;
-            expected_pc = pc;
-            expected_thread = thread_id;
-            expected_address = address;
-            expected_mask = write_mask;
-            memcpy(expected_values, vector_values, sizeof(uint32_t) * NUM_VECTOR_LANES);
-            if (!run_until_next_event(proc, thread_id))
-                return -1;
         }
-        else if (sscanf(line, "vwriteback %x %x %x %" PRIx64 " %s", &pc, &thread_id, &reg, &write_mask, value_str) == 5)
+        else
         {
-            // Vector writeback
-            if (parse_hex_vector(value_str, vector_values, false) < 0)
-            {
-                printf("Error parsing cosimulation event\n");
-                return -1;
-            }
+            ungetc(type_byte, stdin);
+            if (fgets(line, sizeof(line), stdin) == NULL)
+                break;
 
-            expected_event = EVENT_VECTOR_WRITEBACK;
-            expected_pc = pc;
-            expected_thread = thread_id;
-            expected_register = reg;
-            expected_mask = write_mask;
-            memcpy(expected_values, vector_values, sizeof(uint32_t) * NUM_VECTOR_LANES);
-            if (!run_until_next_event(proc, thread_id))
-                return -1;
+            if (verbose)
+                printf("%s", line);
+
+            len = strlen(line);
+            if (len > 0)
+                line[len - 1] = '\0';	// Strip off newline
+
+            event = parse_text_event(line, &pc, &thread_id, &reg, &address,
+                                     &write_mask, vector_values);
         }
-        else if (sscanf(line, "swriteback %x %x %x %x", &pc, &thread_id, &reg, &scalar_value) == 4)
+
+        switch (event)
         {
-            // Scalar Writeback
-            expected_event = EVENT_SCALAR_WRITEBACK;
-            expected_pc = pc;
-            expected_thread = thread_id;
-            expected_register = reg;
-            expected_values[0] = scalar_value;
-            if (!run_until_next_event(proc, thread_id))
+            case TRACE_STORE:
+                expected_event = EVENT_MEM_STORE;
+                expected_pc = pc;
+                expected_thread = thread_id;
+                expected_address = address;
+                expected_mask = write_mask;
+                memcpy(expected_values, vector_values, sizeof(uint32_t) * NUM_VECTOR_LANES);
+                if (!run_until_next_event(proc, thread_id))
+                    return -1;
+
+                break;
+
+            case TRACE_VECTOR_WRITEBACK:
+                expected_event = EVENT_VECTOR_WRITEBACK;
+                expected_pc = pc;
+                expected_thread = thread_id;
+                expected_register = reg;
+                expected_mask = write_mask;
+                memcpy(expected_values, vector_values, sizeof(uint32_t) * NUM_VECTOR_LANES);
+                if (!run_until_next_event(proc, thread_id))
+                    return -1;
+
+                break;
+
+            case TRACE_SCALAR_WRITEBACK:
+                expected_event = EVENT_SCALAR_WRITEBACK;
+                expected_pc = pc;
+                expected_thread = thread_id;
+                expected_register = reg;
+                expected_values[0] = vector_values[0];
+                if (!run_until_next_event(proc, thread_id))
+                    return -1;
+
+                break;
+
+            case TRACE_INTERRUPT:
+                cosim_interrupt(proc, thread_id, pc);
+                break;
+
+            case TRACE_HALTED:
+                verilog_model_halted = true;
+                break;
+
+            case TRACE_ERROR:
                 return -1;
+
+            case TRACE_UNKNOWN:
+                if (!verbose)
+                    printf("%s\n", line);	// Echo unrecognized lines to stdout (verbose already does this for all lines)
+
+                break;
         }
-        else if (strcmp(line, "***HALTED***") == 0)
-        {
-            verilog_model_halted = true;
-            break;
-        }
-        else if (sscanf(line, "interrupt %u %x", &thread_id, &pc) == 2)
-            cosim_interrupt(proc, thread_id, pc);
-        else if (!verbose)
-            printf("%s\n", line);	// Echo unrecognized lines to stdout (verbose already does this for all lines)
     }
 
     if (!verilog_model_halted)
@@ -32,6 +32,7 @@
 #include "instruction-set.h"
 #include "remote-gdb.h"
 #include "sdmmc.h"
+#include "server.h"
 #include "util.h"
 
 extern void check_interrupt_pipe(struct processor*);
@@ -41,15 +42,19 @@ static int send_interrupt_fd = -1;
 
 static void usage(void)
 {
-    fprintf(stderr, "usage: emulator [options] <hex image file>\n");
+    fprintf(stderr, "usage: emulator [options] <image file>\n");
+    fprintf(stderr, "  (raw binary if the name ends with .bin, snapshot if it ends with .snap,\n");
+    fprintf(stderr, "  otherwise hex)\n");
     fprintf(stderr, "options:\n");
     fprintf(stderr, "  -v Verbose, will print register transfer traces to stdout\n");
     fprintf(stderr, "  -m Mode, one of:\n");
     fprintf(stderr, "     normal  Run to completion (default)\n");
     fprintf(stderr, "     cosim   Cosimulation validation mode\n");
     fprintf(stderr, "     gdb     Start GDB listener on port 8000\n");
+    fprintf(stderr, "     server  Run programs requested on stdin (no image file)\n");
     fprintf(stderr, "  -f <width>x<height> Display frame buffer output in window\n");
     fprintf(stderr, "  -d <filename>,<start>,<length>  Dump memory\n");
+    fprintf(stderr, "  -H With -d, write a hash of each cache line instead of the contents\n");
     fprintf(stderr, "  -b <filename> Load file into a virtual block device\n");
     fprintf(stderr, "  -t <num> Threads per core (default 4)\n");
     fprintf(stderr, "  -p <num> Number of cores (default 1)\n");
@@ -58,15 +63,9 @@ static void usage(void)
     fprintf(stderr, "  -s <file> Memory map file as shared memory\n");
     fprintf(stderr, "  -i <file> Named pipe to receive interrupts. Pipe must already be created.\n");
     fprintf(stderr, "  -o <file> Named pipe to send interrupts. Pipe must already be created\n");
-    fprintf(stderr, "  -a Enable random thread scheduling (slower)");
-}
-
-static uint32_t parse_num_arg(const char *argval)
-{
-    if (argval[0] == '0' && argval[1] == 'x')
-        return (uint32_t) strtoul(argval + 2, NULL, 16);
-    else
-        return (uint32_t) strtoul(argval, NULL, 10);
+    fprintf(stderr, "  -a Enable random thread scheduling (slower)\n");
+    fprintf(stderr, "  -w <file> Save a snapshot to this file just before the program first\n");
+    fprintf(stderr, "     accesses the block device, then exit\n");
 }
 
 // An external process can send interrupts to the emulator by writing to a
@@ -128,6 +127,7 @@ int main(int argc, char *argv[])
     uint32_t mem_dump_length = 0;
     char *mem_dump_filename = NULL;
     size_t mem_dump_filename_len = 0;
+    bool mem_dump_hashes = false;
     bool verbose = false;
     uint32_t fb_width = 640;
     uint32_t fb_height = 480;
@@ -140,15 +140,17 @@ int main(int argc, char *argv[])
     const char *shared_memory_file = NULL;
     struct stat st;
     bool random_thread_sched = false;
+    const char *snapshot_file = NULL;
 
     enum
     {
         MODE_NORMAL,
         MODE_COSIMULATION,
-        MODE_GDB_REMOTE_DEBUG
+        MODE_GDB_REMOTE_DEBUG,
+        MODE_SERVER
     } mode = MODE_NORMAL;
 
-    while ((option = getopt(argc, argv, "f:d:vm:b:t:p:c:r:s:i:o:a")) != -1)
+    while ((option = getopt(argc, argv, "f:d:Hvm:b:t:p:c:r:s:i:o:aw:")) != -1)
     {
         switch (option)
         {
@@ -180,6 +182,8 @@ int main(int argc, char *argv[])
                     mode = MODE_COSIMULATION;
                 else if (strcmp(optarg, "gdb") == 0)
                     mode = MODE_GDB_REMOTE_DEBUG;
+                else if (strcmp(optarg, "server") == 0)
+                    mode = MODE_SERVER;
                 else
                 {
                     fprintf(stderr, "Unkown execution mode %s\n", optarg);
@@ -217,6 +221,10 @@ int main(int argc, char *argv[])
                 enable_memory_dump = true;
                 break;
 
+            case 'H':
+                mem_dump_hashes = true;
+                break;
+
             case 'b':
                 if (open_block_device(optarg) < 0)
                     return 1;
@@ -301,13 +309,17 @@ int main(int argc, char *argv[])
                 random_thread_sched = true;
                 break;
 
+            case 'w':
+                snapshot_file = optarg;
+                break;
+
             case '?':
                 usage();
                 return 1;
         }
     }
 
-    if (optind == argc)
+    if (optind == argc && mode != MODE_SERVER)
     {
         fprintf(stderr, "No image filename specified\n");
         usage();
@@ -317,13 +329,22 @@ int main(int argc, char *argv[])
     seed_random(current_time_us());
 
     // Don't randomize memory for cosimulation mode, because
-    // memory is checked against the hardware model to ensure a match
+    // memory is checked against the hardware model to ensure a match. The
+    // server randomizes memory separately for each program it runs.
     proc = init_processor(memory_size, num_cores, threads_per_core,
-                          mode != MODE_COSIMULATION, shared_memory_file);
+                          mode != MODE_COSIMULATION && mode != MODE_SERVER,
+                          shared_memory_file);
     if (proc == NULL)
         return 1;
 
-    if (load_hex_file(proc, argv[optind]) < 0)
+    if (mode == MODE_SERVER)
+    {
+        // Each request loads its own image into a copy of this processor
+        init_device(proc);
+        return run_server(proc, shared_memory_file == NULL) < 0 ? 1 : 0;
+    }
+
+    if (load_image_file(proc, argv[optind]) < 0)
     {
         fprintf(stderr, "Error reading image %s\n", argv[optind]);
         return 1;
@@ -340,6 +361,9 @@ int main(int argc, char *argv[])
     if (random_thread_sched)
         enable_random_thread_sched(proc);
 
+    if (snapshot_file)
+        stop_before_block_device_access(proc);
+
     switch (mode)
     {
         case MODE_NORMAL:
@@ -375,10 +399,37 @@ int main(int argc, char *argv[])
             dbg_set_stop_on_fault(proc, true);
             remote_gdb_main_loop(proc, enable_fb_window);
             break;
+
+        case MODE_SERVER:
+            break;  // Handled above
+    }
+
+    if (snapshot_file)
+    {
+        if (!is_stopped_before_block_device_access(proc))
+        {
+            fprintf(stderr, "Program finished without accessing the block device, "
+                    "no snapshot saved\n");
+            return 1;
+        }
+
+        if (save_snapshot(proc, snapshot_file) < 0)
+            return 1;
+
+        // The program hasn't finished, so skip the rest
+        return 0;
     }
 
     if (enable_memory_dump)
-        write_memory_to_file(proc, mem_dump_filename, mem_dump_base, mem_dump_length);
+    {
+        if (mem_dump_hashes)
+        {
+            write_memory_hashes_to_file(proc, mem_dump_filename, mem_dump_base,
+                                        mem_dump_length);
+        }
+        else
+            write_memory_to_file(proc, mem_dump_filename, mem_dump_base, mem_dump_length);
+    }
 
     free(mem_dump_filename);
 
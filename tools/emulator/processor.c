@@ -22,6 +22,7 @@
 #include <stdlib.h>
 #include <string.h>
 #include <sys/mman.h>
+#include <sys/stat.h>
 #include <unistd.h>
 #include "processor.h"
 #include "cosimulation.h"
@@ -35,6 +36,8 @@
 #define ROUND_TO_PAGE(addr) ((addr) & ~(PAGE_SIZE - 1u))
 #define PAGE_OFFSET(addr) ((addr) & (PAGE_SIZE - 1u))
 #define TRAP_LEVELS 2
+#define FNV_OFFSET_BASIS 2166136261u
+#define FNV_PRIME 16777619u
 
 #ifdef DUMP_INSTRUCTION_STATS
 #define TALLY_INSTRUCTION(type) thread->core->proc->stat ## type++
@@ -44,6 +47,8 @@
 
 #define INVALID_ADDR 0xfffffffful
 
+#define SNAPSHOT_MAGIC 0x70616e73   // 'snap'
+
 // When a breakpoint is set, this instruction replaces the one at the
 // breakpoint address. It is invalid, because it uses a reserved format
 // type. The interpreter only performs a breakpoint lookup when it sees
@@ -118,6 +123,8 @@ struct processor
     uint32_t interrupt_levels;
     bool random_thread_sched;
     bool crashed;
+    bool stop_before_block_access;
+    bool stopped_before_block_access;
     bool single_stepping;
     bool stop_on_fault;
     bool enable_tracing;
@@ -134,6 +141,18 @@ struct processor
     int64_t total_instructions;
 };
 
+// Stored at the beginning of a snapshot file. Since the thread state is saved
+// as a copy of the structure, its size is included to detect snapshots from an
+// incompatible build.
+struct snapshot_header
+{
+    uint32_t magic;
+    uint32_t num_cores;
+    uint32_t threads_per_core;
+    uint32_t memory_size;
+    uint32_t thread_state_size;
+};
+
 struct breakpoint
 {
     struct breakpoint *next;
@@ -182,7 +201,6 @@ struct processor *init_processor(uint32_t memory_size, uint32_t num_cores,
                                  uint32_t threads_per_core, bool randomize_memory,
                                  const char *shared_memory_file)
 {
-    uint32_t address;
     uint32_t thread_id;
     uint32_t core_id;
     struct processor *proc;
@@ -232,10 +250,7 @@ struct processor *init_processor(uint32_t memory_size, uint32_t num_cores,
         }
 
         if (randomize_memory)
-        {
-            for (address = 0; address < memory_size / 4; address++)
-                proc->memory[address] = (uint32_t) next_random();
-        }
+            randomize_memory_contents(proc);
         else
             memset(proc->memory, 0, proc->memory_size);
     }
@@ -275,6 +290,14 @@ struct processor *init_processor(uint32_t memory_size, uint32_t num_cores,
     return proc;
 }
 
+void randomize_memory_contents(struct processor *proc)
+{
+    uint32_t address;
+
+    for (address = 0; address < proc->memory_size / 4; address++)
+        proc->memory[address] = (uint32_t) next_random();
+}
+
 void enable_tracing(struct processor *proc)
 {
     proc->enable_tracing = true;
@@ -314,6 +337,195 @@ int load_hex_file(struct processor *proc, const char *filename)
     return 0;
 }
 
+int load_raw_file(struct processor *proc, const char *filename)
+{
+    FILE *file;
+    struct stat st;
+
+    file = fopen(filename, "rb");
+    if (file == NULL)
+    {
+        perror("load_raw_file: error opening image file");
+        return -1;
+    }
+
+    if (fstat(fileno(file), &st) < 0)
+    {
+        fclose(file);
+        perror("load_raw_file: error getting file size");
+        return -1;
+    }
+
+    if ((uint64_t) st.st_size > proc->memory_size)
+    {
+        fclose(file);
+        fprintf(stderr, "load_raw_file: image file too big to fit in memory\n");
+        return -1;
+    }
+
+    // The file contains memory contents byte for byte, which is also how
+    // they are stored here.
+    if (fread(proc->memory, 1, (size_t) st.st_size, file) != (size_t) st.st_size)
+    {
+        fclose(file);
+        perror("load_raw_file: fread failed");
+        return -1;
+    }
+
+    fclose(file);
+
+    return 0;
+}
+
+void stop_before_block_device_access(struct processor *proc)
+{
+    proc->stop_before_block_access = true;
+}
+
+bool is_stopped_before_block_device_access(const struct processor *proc)
+{
+    return proc->stopped_before_block_access;
+}
+
+// The snapshot contains the state of the processor and memory. It doesn't
+// include peripherals or the block device. The point to save it is just before
+// the program first accesses the block device (stop_before_block_device_access),
+// when its state can't depend on the block device contents yet.
+int save_snapshot(const struct processor *proc, const char *filename)
+{
+    FILE *file;
+    struct snapshot_header header;
+    uint32_t core_id;
+    const struct core *core;
+    bool ok = true;
+
+    file = fopen(filename, "wb");
+    if (file == NULL)
+    {
+        perror("save_snapshot: error opening snapshot file");
+        return -1;
+    }
+
+    header.magic = SNAPSHOT_MAGIC;
+    header.num_cores = proc->num_cores;
+    header.threads_per_core = proc->threads_per_core;
+    header.memory_size = proc->memory_size;
+    header.thread_state_size = sizeof(struct thread);
+    ok &= fwrite(&header, sizeof(header), 1, file) == 1;
+    ok &= fwrite(&proc->thread_enable_mask, sizeof(proc->thread_enable_mask), 1, file) == 1;
+    ok &= fwrite(&proc->interrupt_levels, sizeof(proc->interrupt_levels), 1, file) == 1;
+    ok &= fwrite(&proc->current_timer_count, sizeof(proc->current_timer_count), 1, file) == 1;
+    ok &= fwrite(&proc->total_instructions, sizeof(proc->total_instructions), 1, file) == 1;
+    for (core_id = 0; core_id < proc->num_cores; core_id++)
+    {
+        core = &proc->cores[core_id];
+        ok &= fwrite(&core->trap_handler_pc, sizeof(core->trap_handler_pc), 1, file) == 1;
+        ok &= fwrite(&core->tlb_miss_handler_pc, sizeof(core->tlb_miss_handler_pc), 1, file) == 1;
+        ok &= fwrite(&core->phys_tlb_update_addr, sizeof(core->phys_tlb_update_addr), 1, file) == 1;
+        ok &= fwrite(&core->is_level_triggered, sizeof(core->is_level_triggered), 1, file) == 1;
+        ok &= fwrite(&core->next_itlb_way, sizeof(core->next_itlb_way), 1, file) == 1;
+        ok &= fwrite(&core->next_dtlb_way, sizeof(core->next_dtlb_way), 1, file) == 1;
+        ok &= fwrite(core->itlb, sizeof(struct tlb_entry), TLB_SETS * TLB_WAYS, file) == TLB_SETS * TLB_WAYS;
+        ok &= fwrite(core->dtlb, sizeof(struct tlb_entry), TLB_SETS * TLB_WAYS, file) == TLB_SETS * TLB_WAYS;
+        ok &= fwrite(core->threads, sizeof(struct thread), proc->threads_per_core, file)
+              == proc->threads_per_core;
+    }
+
+    ok &= fwrite(proc->memory, proc->memory_size, 1, file) == 1;
+    if (!ok)
+    {
+        fclose(file);
+        perror("save_snapshot: fwrite failed");
+        return -1;
+    }
+
+    fclose(file);
+
+    return 0;
+}
+
+int load_snapshot(struct processor *proc, const char *filename)
+{
+    FILE *file;
+    struct snapshot_header header;
+    uint32_t core_id;
+    uint32_t thread_id;
+    struct core *core;
+    bool ok = true;
+
+    file = fopen(filename, "rb");
+    if (file == NULL)
+    {
+        perror("load_snapshot: error opening snapshot file");
+        return -1;
+    }
+
+    if (fread(&header, sizeof(header), 1, file) != 1
+        || header.magic != SNAPSHOT_MAGIC
+        || header.thread_state_size != sizeof(struct thread))
+    {
+        fclose(file);
+        fprintf(stderr, "load_snapshot: not a snapshot file from this emulator\n");
+        return -1;
+    }
+
+    if (header.num_cores != proc->num_cores
+        || header.threads_per_core != proc->threads_per_core
+        || header.memory_size != proc->memory_size)
+    {
+        fclose(file);
+        fprintf(stderr, "load_snapshot: snapshot has a different configuration "
+                "(%u cores, %u threads per core, memory size %08x)\n",
+                header.num_cores, header.threads_per_core, header.memory_size);
+        return -1;
+    }
+
+    ok &= fread(&proc->thread_enable_mask, sizeof(proc->thread_enable_mask), 1, file) == 1;
+    ok &= fread(&proc->interrupt_levels, sizeof(proc->interrupt_levels), 1, file) == 1;
+    ok &= fread(&proc->current_timer_count, sizeof(proc->current_timer_count), 1, file) == 1;
+    ok &= fread(&proc->total_instructions, sizeof(proc->total_instructions), 1, file) == 1;
+    for (core_id = 0; core_id < proc->num_cores; core_id++)
+    {
+        core = &proc->cores[core_id];
+        ok &= fread(&core->trap_handler_pc, sizeof(core->trap_handler_pc), 1, file) == 1;
+        ok &= fread(&core->tlb_miss_handler_pc, sizeof(core->tlb_miss_handler_pc), 1, file) == 1;
+        ok &= fread(&core->phys_tlb_update_addr, sizeof(core->phys_tlb_update_addr), 1, file) == 1;
+        ok &= fread(&core->is_level_triggered, sizeof(core->is_level_triggered), 1, file) == 1;
+        ok &= fread(&core->next_itlb_way, sizeof(core->next_itlb_way), 1, file) == 1;
+        ok &= fread(&core->next_dtlb_way, sizeof(core->next_dtlb_way), 1, file) == 1;
+        ok &= fread(core->itlb, sizeof(struct tlb_entry), TLB_SETS * TLB_WAYS, file) == TLB_SETS * TLB_WAYS;
+        ok &= fread(core->dtlb, sizeof(struct tlb_entry), TLB_SETS * TLB_WAYS, file) == TLB_SETS * TLB_WAYS;
+        ok &= fread(core->threads, sizeof(struct thread), proc->threads_per_core, file)
+              == proc->threads_per_core;
+
+        // The saved pointers are from the process that wrote the snapshot
+        for (thread_id = 0; thread_id < proc->threads_per_core; thread_id++)
+            core->threads[thread_id].core = core;
+    }
+
+    ok &= fread(proc->memory, proc->memory_size, 1, file) == 1;
+    if (!ok)
+    {
+        fclose(file);
+        fprintf(stderr, "load_snapshot: snapshot file is truncated\n");
+        return -1;
+    }
+
+    fclose(file);
+
+    return 0;
+}
+
+int load_image_file(struct processor *proc, const char *filename)
+{
+    if (has_suffix(filename, ".bin"))
+        return load_raw_file(proc, filename);
+    else if (has_suffix(filename, ".snap"))
+        return load_snapshot(proc, filename);
+    else
+        return load_hex_file(proc, filename);
+}
+
 void write_memory_to_file(const struct processor *proc, const char *filename,
                           uint32_t base_address, uint32_t length)
 {
@@ -336,6 +548,60 @@ void write_memory_to_file(const struct processor *proc, const char *filename,
     fclose(file);
 }
 
+// Write a 32-bit hash of each cache line in a range of memory to a file,
+// most significant byte first. The hash is FNV-1a, applied to each 32-bit
+// word of the line (formed from its bytes in address order, most significant
+// first). The verilator model writes the same thing with +memdumphash, so
+// cosimulation can compare a small file instead of all of memory.
+void write_memory_hashes_to_file(const struct processor *proc, const char *filename,
+                                 uint32_t base_address, uint32_t length)
+{
+    FILE *file;
+    const uint8_t *line;
+    uint32_t offset;
+    uint32_t word_offset;
+    uint32_t hash;
+    uint8_t hash_bytes[4];
+
+    file = fopen(filename, "wb+");
+    if (file == NULL)
+    {
+        perror("write_memory_hashes_to_file: Error opening output file");
+        return;
+    }
+
+    if (base_address > proc->memory_size)
+        length = 0;
+    else
+        length = MIN(proc->memory_size - base_address, length);
+
+    for (offset = 0; offset + CACHE_LINE_LENGTH <= length; offset += CACHE_LINE_LENGTH)
+    {
+        line = UINT8_PTR(proc->memory, base_address + offset);
+        hash = FNV_OFFSET_BASIS;
+        for (word_offset = 0; word_offset < CACHE_LINE_LENGTH; word_offset += 4)
+        {
+            hash ^= ((uint32_t) line[word_offset] << 24)
+                    | ((uint32_t) line[word_offset + 1] << 16)
+                    | ((uint32_t) line[word_offset + 2] << 8)
+                    | (uint32_t) line[word_offset + 3];
+            hash *= FNV_PRIME;
+        }
+
+        hash_bytes[0] = (uint8_t)(hash >> 24);
+        hash_bytes[1] = (uint8_t)(hash >> 16);
+        hash_bytes[2] = (uint8_t)(hash >> 8);
+        hash_bytes[3] = (uint8_t) hash;
+        if (fwrite(hash_bytes, sizeof(hash_bytes), 1, file) != 1)
+        {
+            perror("write_memory_hashes_to_file: fwrite failed");
+            break;
+        }
+    }
+
+    fclose(file);
+}
+
 const void *get_memory_region_ptr(const struct processor *proc, uint32_t address, uint32_t length)
 {
     assert(length < proc->memory_size);
@@ -433,7 +699,7 @@ bool execute_instructions(struct processor *proc, uint64_t total_instructions)
                 return false;
             }
 
-            if (proc->crashed)
+            if (proc->crashed || proc->stopped_before_block_access)
                 return false;
 
             next_thread = next_set_bit(proc->thread_enable_mask,
@@ -456,7 +722,7 @@ bool execute_instructions(struct processor *proc, uint64_t total_instructions)
                 return false;
             }
 
-            if (proc->crashed)
+            if (proc->crashed || proc->stopped_before_block_access)
                 return false;
 
             next_thread = next_set_bit(proc->thread_enable_mask,
@@ -1303,6 +1569,17 @@ static void execute_scalar_load_store_inst(struct thread *thread, uint32_t instr
         return;
     }
 
+    if (is_device_access && thread->core->proc->stop_before_block_access
+            && physical_address >= REG_SD_WRITE_DATA
+            && physical_address <= REG_SD_CONTROL)
+    {
+        // Back up so this instruction executes again when resumed from
+        // a snapshot.
+        thread->pc -= 4;
+        thread->core->proc->stopped_before_block_access = true;
+        return;
+    }
+
     if (is_load)
     {
         switch (op)
@@ -31,6 +31,10 @@ struct processor *init_processor(uint32_t memsize, uint32_t num_cores,
                                  bool randomize_memory,
                                  const char *shared_memory_file);
 
+// Fill memory with values from the random generator, to expose programs that
+// read memory before initializing it.
+void randomize_memory_contents(struct processor*);
+
 // Calling this function will cause this to print all instruction side
 // effects to standard out.
 void enable_tracing(struct processor*);
@@ -43,8 +47,26 @@ void enable_random_thread_sched(struct processor*);
 // Open a file formatted in the Verilog $readmemh format into memory starting
 // address 0.
 int load_hex_file(struct processor*, const char *filename);
+int load_raw_file(struct processor*, const char *filename);
+
+// Load a raw binary image if the file name ends with .bin, a snapshot if it
+// ends with .snap, or a hex file otherwise.
+int load_image_file(struct processor*, const char *filename);
+
+// Snapshots save the processor and memory state, so a program can be resumed
+// from that point later.
+int save_snapshot(const struct processor*, const char *filename);
+int load_snapshot(struct processor*, const char *filename);
+
+// Stop execution just before any thread first accesses the block device,
+// without performing the access. This is the point to save a snapshot that can
+// be resumed with a different block device.
+void stop_before_block_device_access(struct processor*);
+bool is_stopped_before_block_device_access(const struct processor*);
 void write_memory_to_file(const struct processor*, const char *filename,
                           uint32_t base_address, uint32_t length);
+void write_memory_hashes_to_file(const struct processor*, const char *filename,
+                                 uint32_t base_address, uint32_t length);
 const void *get_memory_region_ptr(const struct processor*, uint32_t address,
                                   uint32_t length);
 void print_registers(const struct processor*, uint32_t thread_id);
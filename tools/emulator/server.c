@@ -0,0 +1,414 @@
+//
+// Copyright 2011-2015 Jeff Bush
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#include <errno.h>
+#include <fcntl.h>
+#include <poll.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/resource.h>
+#include <sys/time.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <unistd.h>
+#include "processor.h"
+#include "sdmmc.h"
+#include "server.h"
+#include "util.h"
+
+//
+// Server mode runs many programs, one after another, in a single emulator
+// process. This avoids the cost of starting a new process and allocating and
+// initializing emulated memory for each one, which dominates the run time of
+// small test programs.
+//
+// The server initializes the processor once, then reads requests from
+// stdin, one per line:
+//
+//   run<TAB><arg><TAB><arg>...  Run a program. The arguments are the image
+//                               file name (which can be a snapshot) and the
+//                               options -a, -b, -d, -H, and -v, which have
+//                               the same meaning as on the command line.
+//   kill                        Stop the program that is currently running.
+//
+// For each run request, the server forks a child process, which starts with a
+// copy of the initial processor state, loads the image, and runs it. The
+// server writes the following responses to stdout:
+//
+//   output <length>\n<data>     Output from the program (standard output and
+//                               standard error)
+//   exit <status> <rss>\n       The program has finished. Status is the exit
+//                               code, or the negated signal number if it was
+//                               killed. rss is its peak resident set size in
+//                               kilobytes.
+//
+// The server exits when stdin is closed.
+//
+
+#define MAX_LINE_LENGTH 4096
+#define MAX_REQUEST_ARGS 16
+
+static char input_buffer[MAX_LINE_LENGTH];
+static size_t input_length;
+static char output_buffer[0x10000];
+static bool randomize_memory_per_run;
+
+// If a complete line has been read from the client, copy it into line
+// (without the newline) and return true.
+static bool get_buffered_line(char *line)
+{
+    char *newline = memchr(input_buffer, '\n', input_length);
+    size_t line_length;
+
+    if (newline == NULL)
+        return false;
+
+    line_length = (size_t)(newline - input_buffer);
+    memcpy(line, input_buffer, line_length);
+    line[line_length] = '\0';
+    input_length -= line_length + 1;
+    memmove(input_buffer, newline + 1, input_length);
+
+    return true;
+}
+
+// Requests are read with read() rather than stdio so the server can poll for
+// a kill command while a program is running. Returns the number of bytes
+// read, 0 if the client closed the connection, or -1 if there was an error.
+static ssize_t fill_input_buffer(void)
+{
+    ssize_t got;
+
+    if (input_length == sizeof(input_buffer))
+    {
+        fprintf(stderr, "fill_input_buffer: request too long\n");
+        return -1;
+    }
+
+    do
+    {
+        got = read(STDIN_FILENO, input_buffer + input_length,
+                   sizeof(input_buffer) - input_length);
+    }
+    while (got < 0 && errno == EINTR);
+
+    if (got < 0)
+        perror("fill_input_buffer: read failed");
+    else
+        input_length += (size_t) got;
+
+    return got;
+}
+
+static int write_all(const void *data, size_t length)
+{
+    const char *ptr = (const char*) data;
+    ssize_t written;
+
+    while (length > 0)
+    {
+        written = write(STDOUT_FILENO, ptr, length);
+        if (written < 0)
+        {
+            if (errno == EINTR)
+                continue;
+
+            perror("write_all: write failed");
+            return -1;
+        }
+
+        ptr += written;
+        length -= (size_t) written;
+    }
+
+    return 0;
+}
+
+static int send_output(const char *data, size_t length)
+{
+    char header[32];
+
+    snprintf(header, sizeof(header), "output %zu\n", length);
+    if (write_all(header, strlen(header)) < 0)
+        return -1;
+
+    return write_all(data, length);
+}
+
+static int send_exit(int status, long max_rss)
+{
+    char response[64];
+
+    snprintf(response, sizeof(response), "exit %d %ld\n", status, max_rss);
+    return write_all(response, strlen(response));
+}
+
+// This runs in the child process. Returns the exit code.
+static int run_program(struct processor *proc, int argc, char *argv[])
+{
+    const char *image_file = NULL;
+    char *dump_filename = NULL;
+    uint32_t dump_base = 0;
+    uint32_t dump_length = 0;
+    bool dump_hashes = false;
+    char *separator;
+    bool block_device_open = false;
+    int i;
+
+    for (i = 0; i < argc; i++)
+    {
+        if (strcmp(argv[i], "-a") == 0)
+            enable_random_thread_sched(proc);
+        else if (strcmp(argv[i], "-v") == 0)
+            enable_tracing(proc);
+        else if (strcmp(argv[i], "-H") == 0)
+            dump_hashes = true;
+        else if (strcmp(argv[i], "-b") == 0 && i + 1 < argc)
+        {
+            if (open_block_device(argv[++i]) < 0)
+                return 1;
+
+            block_device_open = true;
+        }
+        else if (strcmp(argv[i], "-d") == 0 && i + 1 < argc)
+        {
+            // Memory dump, of the form: filename,start,length
+            dump_filename = argv[++i];
+            separator = strchr(dump_filename, ',');
+            if (separator == NULL || strchr(separator + 1, ',') == NULL)
+            {
+                fprintf(stderr, "bad format for memory dump\n");
+                return 1;
+            }
+
+            *separator = '\0';
+            dump_base = parse_num_arg(separator + 1);
+            dump_length = parse_num_arg(strchr(separator + 1, ',') + 1);
+        }
+        else if (argv[i][0] != '-' && image_file == NULL)
+            image_file = argv[i];
+        else
+        {
+            fprintf(stderr, "Bad server request argument %s\n", argv[i]);
+            return 1;
+        }
+    }
+
+    if (image_file == NULL)
+    {
+        fprintf(stderr, "No image filename specified\n");
+        return 1;
+    }
+
+    if (load_image_file(proc, image_file) < 0)
+    {
+        fprintf(stderr, "Error reading image %s\n", image_file);
+        return 1;
+    }
+
+    dbg_set_stop_on_fault(proc, false);
+    while (execute_instructions(proc, 1000000))
+        ;
+
+    if (dump_filename)
+    {
+        if (dump_hashes)
+            write_memory_hashes_to_file(proc, dump_filename, dump_base, dump_length);
+        else
+            write_memory_to_file(proc, dump_filename, dump_base, dump_length);
+    }
+
+    dump_instruction_stats(proc);
+    if (block_device_open)
+        close_block_device();
+
+    fflush(stdout);
+
+    return is_stopped_on_fault(proc) ? 1 : 0;
+}
+
+// Returns 1 if the server should read another request, 0 if the client
+// closed the connection, or -1 if there was an error.
+static int handle_run_request(struct processor *proc, char *request)
+{
+    char *args[MAX_REQUEST_ARGS];
+    int num_args = 0;
+    char *arg;
+    char line[MAX_LINE_LENGTH];
+    int output_pipe[2];
+    pid_t child_pid;
+    struct pollfd fds[2];
+    nfds_t num_fds = 2;
+    ssize_t got;
+    int status;
+    struct rusage usage;
+    bool client_open = true;
+
+    for (arg = strtok(request, "\t"); arg != NULL; arg = strtok(NULL, "\t"))
+    {
+        if (num_args == MAX_REQUEST_ARGS)
+        {
+            fprintf(stderr, "handle_run_request: too many arguments\n");
+            return -1;
+        }
+
+        args[num_args++] = arg;
+    }
+
+    if (pipe(output_pipe) < 0)
+    {
+        perror("handle_run_request: pipe failed");
+        return -1;
+    }
+
+    child_pid = fork();
+    if (child_pid < 0)
+    {
+        perror("handle_run_request: fork failed");
+        return -1;
+    }
+
+    if (child_pid == 0)
+    {
+        // The child gets a fresh copy of the initial processor state. Seed
+        // the random generator again so thread scheduling and the initial
+        // memory contents are different for each run.
+        signal(SIGPIPE, SIG_DFL);
+        close(output_pipe[0]);
+        dup2(output_pipe[1], STDOUT_FILENO);
+        dup2(output_pipe[1], STDERR_FILENO);
+        close(output_pipe[1]);
+        close(STDIN_FILENO);
+        open("/dev/null", O_RDONLY);
+        seed_random(current_time_us());
+        if (randomize_memory_per_run)
+            randomize_memory_contents(proc);
+
+        exit(run_program(proc, num_args, args));
+    }
+
+    close(output_pipe[1]);
+
+    // Forward output until the child closes the pipe (when it exits)
+    fds[0].fd = output_pipe[0];
+    fds[0].events = POLLIN;
+    fds[1].fd = STDIN_FILENO;
+    fds[1].events = POLLIN;
+    while (true)
+    {
+        if (poll(fds, num_fds, -1) < 0)
+        {
+            if (errno == EINTR)
+                continue;
+
+            perror("handle_run_request: poll failed");
+            kill(child_pid, SIGKILL);
+            break;
+        }
+
+        if (num_fds > 1 && fds[1].revents)
+        {
+            if (fill_input_buffer() <= 0)
+            {
+                client_open = false;
+                num_fds = 1;
+                kill(child_pid, SIGKILL);
+            }
+
+            while (get_buffered_line(line))
+            {
+                if (strcmp(line, "kill") == 0)
+                    kill(child_pid, SIGKILL);
+                else
+                    fprintf(stderr, "Unexpected command while running: %s\n", line);
+            }
+        }
+
+        if (fds[0].revents)
+        {
+            got = read(output_pipe[0], output_buffer, sizeof(output_buffer));
+            if (got < 0 && errno == EINTR)
+                continue;
+
+            if (got <= 0)
+                break;
+
+            if (client_open && send_output(output_buffer, (size_t) got) < 0)
+            {
+                client_open = false;
+                num_fds = 1;
+                kill(child_pid, SIGKILL);
+            }
+        }
+    }
+
+    close(output_pipe[0]);
+    while (wait4(child_pid, &status, 0, &usage) < 0)
+    {
+        if (errno != EINTR)
+        {
+            perror("handle_run_request: wait4 failed");
+            return -1;
+        }
+    }
+
+    if (!client_open)
+        return 0;
+
+    if (send_exit(WIFSIGNALED(status) ? -WTERMSIG(status) : WEXITSTATUS(status),
+                  usage.ru_maxrss) < 0)
+    {
+        return -1;
+    }
+
+    return 1;
+}
+
+int run_server(struct processor *proc, bool randomize_memory)
+{
+    char line[MAX_LINE_LENGTH];
+    ssize_t got;
+    int result;
+
+    randomize_memory_per_run = randomize_memory;
+
+    // Detect a closed connection with write errors instead
+    signal(SIGPIPE, SIG_IGN);
+
+    while (true)
+    {
+        while (!get_buffered_line(line))
+        {
+            got = fill_input_buffer();
+            if (got <= 0)
+                return (int) got;
+        }
+
+        if (strncmp(line, "run\t", 4) == 0)
+        {
+            result = handle_run_request(proc, line + 4);
+            if (result <= 0)
+                return result;
+        }
+        else if (strcmp(line, "kill") != 0) // Program already finished
+        {
+            fprintf(stderr, "Unknown server command: %s\n", line);
+            return -1;
+        }
+    }
+}
@@ -0,0 +1,29 @@
+//
+// Copyright 2011-2015 Jeff Bush
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#ifndef SERVER_H
+#define SERVER_H
+
+#include <stdbool.h>
+
+struct processor;
+
+// Run programs on request until stdin is closed (see server.c). If
+// randomize_memory is set, each program starts with different random memory
+// contents. Returns 0 if successful, -1 if there was an error.
+int run_server(struct processor*, bool randomize_memory);
+
+#endif
@@ -15,6 +15,7 @@
 //
 
 #include <stdio.h>
+#include <string.h>
 #include <sys/time.h>
 #include <sys/types.h>
 #include <time.h>
@@ -91,3 +92,18 @@ uint64_t current_time_us(void)
     return (uint64_t) tv.tv_sec * 1000000 + (uint64_t) tv.tv_usec;
 }
 
+uint32_t parse_num_arg(const char *argval)
+{
+    if (argval[0] == '0' && argval[1] == 'x')
+        return (uint32_t) strtoul(argval + 2, NULL, 16);
+    else
+        return (uint32_t) strtoul(argval, NULL, 10);
+}
+
+bool has_suffix(const char *str, const char *suffix)
+{
+    size_t str_len = strlen(str);
+    size_t suffix_len = strlen(suffix);
+
+    return str_len >= suffix_len && strcmp(str + str_len - suffix_len, suffix) == 0;
+}
@@ -128,5 +128,11 @@ uint64_t next_random(void);
 
 uint64_t current_time_us(void);
 
+// Parse a numeric command line argument, which is decimal unless it is
+// prefixed with 0x.
+uint32_t parse_num_arg(const char *argval);
+
+bool has_suffix(const char *str, const char *suffix);
+
 #endif
 
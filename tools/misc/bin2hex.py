@@ -15,13 +15,35 @@
 # limitations under the License.
 #
 
+"""
+Convert a binary file to hexadecimal, with one 32-bit word per line, in the
+format that the emulator and verilator model load. Reads from standard input
+if no file name (or -) is given.
+
+    bin2hex.py boot.bin > boot.hex
+"""
+
 import sys
-import binascii
 
-with open(sys.argv[1], 'rb') as f:
+# Must be a multiple of the word size
+CHUNK_SIZE = 0x100000
+
+
+def convert(infile, outfile):
     while True:
-        word = f.read(4)
-        if not word:
+        chunk = infile.read(CHUNK_SIZE)
+        if not chunk:
             break
 
-        print(binascii.hexlify(word).decode())
+        outfile.write(chunk.hex('\n', -4).encode() + b'\n')
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] == '-':
+        convert(sys.stdin.buffer, sys.stdout.buffer)
+    else:
+        with open(sys.argv[1], 'rb') as infile:
+            convert(infile, sys.stdout.buffer)
+
+if __name__ == '__main__':
+    main()